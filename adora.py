@@ -0,0 +1,241 @@
+"""
+Command-line interface to AdoraExcel, for batch jobs that should not start the UI.
+
+Each subcommand imports only the modules it needs, so ``list`` and ``export``
+never load the parser or the OpenAI client, and one process handles any number
+of files or questions.
+
+Usage:
+    python -m adora ingest month_end/ --workers 8
+    python -m adora list                     # stored files
+    python -m adora list 12                  # tables of file 12
+    python -m adora query 12 -q "Total revenue per region?" -q "Any outliers?"
+    python -m adora query 12 14 --questions-file questions.txt --format jsonl
+    python -m adora export 12 --table Sales --format csv --output exports/
+"""
+import argparse
+import contextlib
+import json
+import os
+import sys
+import time
+from typing import Dict, List, Any, Iterable, Iterator
+
+def _emit(record: Dict[str, Any]):
+    """Write one JSON record per line to stdout."""
+    sys.stdout.write(json.dumps(record, default=str) + "\n")
+    sys.stdout.flush()
+
+def _diagnostics():
+    """Send the library modules' progress prints to stderr so stdout only carries results."""
+    return contextlib.redirect_stdout(sys.stderr)
+
+def cmd_ingest(args) -> int:
+    """Ingest workbooks with the parallel batch ingester."""
+    import database as db
+    import ingest
+
+    files = ingest.collect_files(args.paths)
+    if not files:
+        print("No .xlsx/.xls files found", file=sys.stderr)
+        return 2
+
+    db.init_db()
+    started = time.perf_counter()
+
+    def print_progress(files_done, total_files, report):
+        print(f"{files_done}/{total_files} {report['status']}: {report['source']}", file=sys.stderr)
+
+    reports = ingest.ingest_files(files, workers=args.workers or ingest.INGEST_WORKERS,
+                                  copy_to_uploads=not args.no_copy,
+                                  queue_size=args.queue_size or ingest.INGEST_QUEUE_SIZE,
+                                  progress_callback=print_progress)
+    if args.format == 'jsonl':
+        for report in reports:
+            _emit(report)
+    else:
+        ingest.print_report(reports, time.perf_counter() - started)
+    return 1 if any(report['status'] == 'error' for report in reports) else 0
+
+def cmd_list(args) -> int:
+    """List stored files, or the tables of the given files."""
+    import database as db
+    db.init_db()
+
+    if not args.file_ids:
+        files = db.list_excel_files()
+        for file in files:
+            if args.format == 'jsonl':
+                _emit(file)
+            else:
+                uploaded_at = file['uploaded_at'].strftime('%Y-%m-%d %H:%M') if file['uploaded_at'] else ''
+                print(f"{file['id']:>6}  {uploaded_at:<16}  {file['tables_count']:>4} tables  {file['file_name']}")
+        return 0
+
+    status = 0
+    for file_id in args.file_ids:
+        tables = db.list_excel_tables(file_id)
+        if not tables:
+            print(f"File {file_id} not found or has no tables", file=sys.stderr)
+            status = 1
+            continue
+        for table in tables:
+            if args.format == 'jsonl':
+                _emit({'file_id': file_id, **table})
+            else:
+                print(f"{file_id:>6}  {table['id']:>6}  {table['row_count'] or 0:>9} rows  "
+                      f"{table['sheet_name']} / {table['table_name']}")
+    return status
+
+def _read_questions(args) -> List[str]:
+    """Questions from -q options and --questions-file (one per line, '-' for stdin)."""
+    questions = list(args.question or [])
+    if args.questions_file:
+        with (sys.stdin if args.questions_file == '-' else open(args.questions_file, encoding='utf-8')) as f:
+            questions.extend(line.strip() for line in f if line.strip())
+    return questions
+
+def cmd_query(args) -> int:
+    """Answer every question about every given file."""
+    questions = _read_questions(args)
+    if not questions:
+        print("No questions given; use -q or --questions-file", file=sys.stderr)
+        return 2
+
+    import database as db
+    with _diagnostics():
+        from ai_utils import analyze_table, prepare_analysis_data
+    db.init_db()
+
+    status = 0
+    for file_id in args.file_ids:
+        with _diagnostics():
+            # Rows are read on demand while each prompt is compiled
+            file_data = db.get_excel_file(file_id, with_rows=False)
+            # Built once per file and reused for all of its questions
+            analysis_data = prepare_analysis_data(file_data) if file_data else []
+        if not analysis_data:
+            print(f"File {file_id} not found or has no data to analyze", file=sys.stderr)
+            status = 1
+            continue
+
+        for question in questions:
+            started = time.perf_counter()
+            with _diagnostics():
+                answer = analyze_table(analysis_data, question, mode=args.mode)
+            elapsed = time.perf_counter() - started
+            if args.format == 'jsonl':
+                _emit({'file_id': file_id, 'file_name': file_data['file_name'], 'question': question,
+                       'answer': answer, 'elapsed_s': round(elapsed, 3)})
+            else:
+                print(f"## {file_data['file_name']}: {question}\n\n{answer}\n")
+    return status
+
+def _safe_name(name: str) -> str:
+    """Make a sheet or table name usable as part of a file name."""
+    return "".join(c if c.isalnum() or c in "-_." else "_" for c in str(name)).strip("_") or "table"
+
+def _table_columns(rows: Iterable[Dict[str, Any]]) -> List[str]:
+    """All column names in the order they first appear."""
+    columns = {}
+    for row in rows:
+        columns.update(dict.fromkeys(row))
+    return list(columns)
+
+def _write_csv(path: str, rows: Iterator[Dict[str, Any]], columns: List[str]) -> int:
+    import csv
+    count = 0
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=columns, restval='')
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    return count
+
+def _write_jsonl(path: str, rows: Iterator[Dict[str, Any]]) -> int:
+    count = 0
+    with open(path, 'w', encoding='utf-8') as f:
+        for row in rows:
+            f.write(json.dumps(row, default=str) + "\n")
+            count += 1
+    return count
+
+def cmd_export(args) -> int:
+    """Export stored tables to CSV or JSON Lines files, streaming rows from the database."""
+    import database as db
+    db.init_db()
+    os.makedirs(args.output, exist_ok=True)
+
+    status = 0
+    for file_id in args.file_ids:
+        tables = [
+            table for table in db.list_excel_tables(file_id)
+            if (not args.sheet or table['sheet_name'] == args.sheet)
+            and (not args.table or table['table_name'] == args.table)
+        ]
+        if not tables:
+            print(f"No matching tables in file {file_id}", file=sys.stderr)
+            status = 1
+            continue
+
+        for table in tables:
+            path = os.path.join(args.output, f"{file_id}_{_safe_name(table['sheet_name'])}_"
+                                             f"{_safe_name(table['table_name'])}.{args.format}")
+            if args.format == 'csv':
+                # Rows may not all have the same keys, so the header needs a first pass
+                columns = _table_columns(db.iter_table_rows(table['id']))
+                count = _write_csv(path, db.iter_table_rows(table['id']), columns)
+            else:
+                count = _write_jsonl(path, db.iter_table_rows(table['id']))
+            print(f"{path}: {count} rows", file=sys.stderr)
+    return status
+
+def build_parser() -> argparse.ArgumentParser:
+    arg_parser = argparse.ArgumentParser(prog="python -m adora", description="AdoraExcel command-line interface")
+    commands = arg_parser.add_subparsers(dest="command", required=True)
+
+    ingest_parser = commands.add_parser("ingest", help="Ingest workbooks, glob patterns or directories")
+    ingest_parser.add_argument("paths", nargs="+", help="Workbooks, glob patterns or directories")
+    ingest_parser.add_argument("--workers", type=int, help="Parse worker processes (default: INGEST_WORKERS)")
+    ingest_parser.add_argument("--queue-size", type=int,
+                               help="Parsed workbooks buffered for the database writer (default: INGEST_QUEUE_SIZE)")
+    ingest_parser.add_argument("--no-copy", action="store_true",
+                               help="Store files where they are instead of copying them to the upload folder")
+    ingest_parser.add_argument("--format", choices=["text", "jsonl"], default="text")
+    ingest_parser.set_defaults(handler=cmd_ingest)
+
+    list_parser = commands.add_parser("list", help="List stored files, or the tables of the given files")
+    list_parser.add_argument("file_ids", nargs="*", type=int, help="File IDs whose tables to list")
+    list_parser.add_argument("--format", choices=["text", "jsonl"], default="text")
+    list_parser.set_defaults(handler=cmd_list)
+
+    query_parser = commands.add_parser("query", help="Ask questions about stored files")
+    query_parser.add_argument("file_ids", nargs="+", type=int, help="File IDs to ask about")
+    query_parser.add_argument("-q", "--question", action="append", help="Question (repeatable)")
+    query_parser.add_argument("--questions-file", help="File with one question per line ('-' for stdin)")
+    query_parser.add_argument("--mode", choices=["auto", "single", "map_reduce"],
+                              help="Ask in one request or per sheet (default: ANALYSIS_MODE)")
+    query_parser.add_argument("--format", choices=["markdown", "jsonl"], default="markdown")
+    query_parser.set_defaults(handler=cmd_query)
+
+    export_parser = commands.add_parser("export", help="Export stored tables to CSV or JSON Lines")
+    export_parser.add_argument("file_ids", nargs="+", type=int, help="File IDs to export")
+    export_parser.add_argument("--sheet", help="Only export tables of this sheet")
+    export_parser.add_argument("--table", help="Only export tables with this name")
+    export_parser.add_argument("--format", choices=["csv", "jsonl"], default="csv")
+    export_parser.add_argument("--output", default="exports", help="Output directory")
+    export_parser.set_defaults(handler=cmd_export)
+    return arg_parser
+
+def main(argv: List[str] = None) -> int:
+    args = build_parser().parse_args(argv)
+    try:
+        return args.handler(args)
+    except BrokenPipeError:
+        # Output piped into e.g. `head`; silence the error on interpreter shutdown too
+        sys.stdout = open(os.devnull, 'w')
+        return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,23 +1,42 @@
-from openai import OpenAI
-from langchain.chains import LLMChain
-from langchain.prompts import PromptTemplate
 import pandas as pd
 import os
-import streamlit as st
 import re
-from typing import Dict, Any, List, Optional, Union
+import logging
+import asyncio
+import contextvars
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Any, Iterable, List, Optional, Union
 from dotenv import load_dotenv
+from profiling import profile_table
+from prompt_compiler import (PROMPT_TOKEN_BUDGET, compile_prompt, context_window, count_message_tokens,
+                             count_tokens, mentions)
+from llm_providers import get_provider
+from serializers import serialize_data
+from tracing import span
 
 # Load environment variables
 load_dotenv()
 
-# Initialize the OpenAI client
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+logger = logging.getLogger(__name__)
+
+# Model used to answer questions about tables, and the tokens reserved for its answer
+ANALYSIS_MODEL = os.getenv('ANALYSIS_MODEL', 'gpt-4-turbo-preview')
+ANALYSIS_MAX_TOKENS = int(os.getenv('ANALYSIS_MAX_TOKENS', '4000'))
+# How questions about several tables are asked: 'single' (one request), 'map_reduce'
+# (one request per sheet, then one combining the answers) or 'auto' (map_reduce when
+# one prompt cannot hold every table's schema and profile)
+ANALYSIS_MODE = os.getenv('ANALYSIS_MODE', 'auto')
+# What the map step asks about separately: 'sheet' or 'table'
+ANALYSIS_MAP_UNIT = os.getenv('ANALYSIS_MAP_UNIT', 'sheet')
+# Map requests in flight at once
+ANALYSIS_MAX_CONCURRENCY = int(os.getenv('ANALYSIS_MAX_CONCURRENCY', '4'))
+# Answer tokens per map request; the partial answers make up the combining prompt
+ANALYSIS_MAP_MAX_TOKENS = int(os.getenv('ANALYSIS_MAP_MAX_TOKENS', '1000'))
 
-# Initialize the LLM
 def get_llm(messages, model="gpt-3.5-turbo", temperature=0.1):
     """
-    Get a completion from the OpenAI API.
+    Get a completion from the configured LLM provider.
     
     Args:
         messages: List of message dictionaries with 'role' and 'content'
@@ -25,17 +44,12 @@ def get_llm(messages, model="gpt-3.5-turbo", temperature=0.1):
         temperature: Controls randomness (0.0 to 2.0)
         
     Returns:
-        The response from the OpenAI API
+        dict: content, model, prompt_tokens, completion_tokens and finish_reason
     """
     try:
-        response = client.chat.completions.create(
-            model=model,
-            messages=messages,
-            temperature=temperature
-        )
-        return response
+        return get_provider().complete(messages, model=model, temperature=temperature)
     except Exception as e:
-        print(f"Error in get_llm: {str(e)}")
+        logger.error("Error in get_llm: %s", e)
         raise
 
 def find_table(data, sheet_name: str = None, table_name: str = None):
@@ -66,6 +80,8 @@ def display_table(table_data: Dict[str, Any], max_rows: int = 100, max_columns:
     """
     Display a table using Streamlit's dataframe component.
     """
+    import streamlit as st
+    
     if not table_data:
         return "Error: No table data provided."
     
@@ -129,9 +145,7 @@ def display_table(table_data: Dict[str, Any], max_rows: int = 100, max_columns:
     
     except Exception as e:
         error_msg = f"Error displaying table: {str(e)}"
-        print(f"Debug - {error_msg}")
-        import traceback
-        traceback.print_exc()
+        logger.exception(error_msg)
         return error_msg
 
 def generate_summary(df: pd.DataFrame, table_name: str = None, sheet_name: str = None) -> str:
@@ -156,7 +170,7 @@ def generate_summary(df: pd.DataFrame, table_name: str = None, sheet_name: str =
         3. Any notable patterns or insights
         4. Potential use cases for analysis"""
         
-        response = client.chat.completions.create(
+        response = get_provider().complete(
             model="gpt-3.5-turbo",
             messages=[
                 {"role": "system", "content": "You are a data analyst assistant that provides clear, concise summaries of tabular data."},
@@ -166,177 +180,308 @@ def generate_summary(df: pd.DataFrame, table_name: str = None, sheet_name: str =
             max_tokens=500
         )
         
-        return response.choices[0].message.content.strip()
+        return response['content'].strip()
     except Exception as e:
         return f"Could not generate summary: {str(e)}"
 
-def analyze_table(analysis_data: List[Dict], question: str) -> str:
+def _row_source(file_data: Dict[str, Any], sheet_name: str, table_name: str,
+                rows: Optional[List[Dict[str, Any]]]) -> Callable[[int, int], Iterable[Dict[str, Any]]]:
+    """Rows ``start:stop`` of a table: sliced from its loaded rows, or read from the database on demand."""
+    if rows is not None:
+        return lambda start, stop: rows[start:stop]
+    import database as db
+    table_id = file_data['table_ids'][sheet_name][table_name]
+    return lambda start, stop: db.iter_table_rows(table_id, start, stop)
+
+def prepare_analysis_data(file_data: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Turn a stored file into the per-table entries that ``analyze_table`` expects.
+    
+    No rows are read or converted here: each entry gets a ``row_source`` that the
+    prompt compiler calls for just the rows that can fit its token budget. The
+    rows come from ``file_data`` when they were loaded and from
+    ``database.iter_table_rows`` when it was read with ``with_rows=False``.
+    Sheets without detected tables are read directly from the workbook.
+    
+    Args:
+        file_data: File as returned by ``database.get_excel_file``
+        
+    Returns:
+        list: One dict per table with sheet, table, columns, row_source,
+            total_rows and profile
+    """
+    with span('analysis.build_catalog', file=file_data.get('file_name')) as build_span:
+        analysis_data = []
+        skipped = 0
+        total_tables = 0
+    
+        # First, count the total number of tables across all sheets
+        for sheet_name, tables in file_data.get('tables', {}).items():
+            total_tables += len(tables)
+    
+        for sheet_name, tables in file_data.get('tables', {}).items():
+            # If no tables in sheet, try to extract data directly from the sheet
+            if not tables:
+                logger.debug("No tables found in sheet %s, reading it directly", sheet_name)
+                try:
+                    # Try to read the sheet directly
+                    df = pd.read_excel(file_data['file_path'], sheet_name=sheet_name)
+                    if not df.empty:
+                        df = df.dropna(how='all').reset_index(drop=True)
+                        if not df.empty:
+                            # Clean column names
+                            df.columns = [str(col).strip() for col in df.columns]
+                            records = serialize_data(df.to_dict('records'))
+                            analysis_data.append({
+                                'sheet': sheet_name,
+                                'table': 'Sheet Data',
+                                'columns': list(df.columns),
+                                'row_source': _row_source(file_data, sheet_name, 'Sheet Data', records),
+                                'total_rows': len(records),
+                                'profile': profile_table(records)
+                            })
+                except Exception as e:
+                    skipped += 1
+                    logger.warning("Error processing sheet %s: %s", sheet_name, e)
+                continue
+        
+            # Process each table in the sheet
+            for table_name, table_data in tables.items():
+                try:
+                    profile = file_data.get('profiles', {}).get(sheet_name, {}).get(table_name)
+                    row_count = file_data.get('row_counts', {}).get(sheet_name, {}).get(table_name)
+                    if row_count is None:
+                        row_count = len(table_data or [])
+                    if not row_count:
+                        continue
+                    analysis_data.append({
+                        'sheet': sheet_name,
+                        'table': table_name,
+                        # Columns come from the profile, or from the first row when there is none
+                        'columns': [column['name'] for column in profile['columns']]
+                                   if profile and profile.get('columns') else None,
+                        'row_source': _row_source(file_data, sheet_name, table_name, table_data),
+                        'total_rows': row_count,
+                        # Column statistics computed over all rows at upload time
+                        'profile': profile
+                    })
+                except Exception as e:
+                    skipped += 1
+                    logger.warning("Error processing table %s in sheet %s: %s", table_name, sheet_name, e)
+    
+        build_span.set(tables=len(analysis_data), stored_tables=total_tables, skipped=skipped,
+                       rows=sum(entry['total_rows'] for entry in analysis_data))
+    
+    return analysis_data
+
+def build_analysis_messages(analysis_data: List[Dict], question: str,
+                            token_budget: Optional[int] = None) -> List[Dict[str, str]]:
     """
-    Analyze table data from multiple sheets and answer questions using OpenAI's API.
+    Build the system and user messages that ``analyze_table`` sends to the model.
     
     Args:
         analysis_data: List of dictionaries containing table data with metadata
         question: User's question about the data
+        token_budget: Prompt token limit (default: PROMPT_TOKEN_BUDGET)
         
     Returns:
-        str: Generated analysis response with rich formatting
+        list: ``[system_message, user_message]``
     """
-    try:
-        if not analysis_data or not isinstance(analysis_data, list):
-            return "Error: No valid data provided for analysis"
-        
-        # Count total sheets and tables
-        sheets = {}
-        total_tables = 0
-        for data in analysis_data:
-            sheet_name = data.get('sheet', 'Unknown Sheet')
-            if sheet_name not in sheets:
-                sheets[sheet_name] = 0
-            sheets[sheet_name] += 1
-            total_tables += 1
-        
-        # Prepare system message with instructions for analyzing multiple sheets
-        system_message = {
-            "role": "system",
-            "content": f"""# Multi-Sheet Excel Data Analysis Assistant
+    return compile_prompt(analysis_data, question, token_budget, model=ANALYSIS_MODEL,
+                          response_tokens=ANALYSIS_MAX_TOKENS)['messages']
 
-You are an expert data analyst AI that helps users understand and work with Excel data across {len(sheets)} sheets and {total_tables} tables. Your responses should be:
+def _llm_call(provider, messages: List[Dict[str, str]], max_tokens: int, span_name: str = 'llm.call',
+              **attributes) -> Dict[str, Any]:
+    """Send one analysis request, recording it as a span with its token usage."""
+    with span(span_name, model=ANALYSIS_MODEL, provider=provider.name, **attributes) as call_span:
+        response = provider.complete(
+            model=ANALYSIS_MODEL,
+            messages=messages,
+            temperature=0.2,  # Lower temperature for more factual responses
+            max_tokens=max_tokens,  # Reserved out of the context window by the prompt compiler
+            top_p=0.9,
+            frequency_penalty=0.1,
+            presence_penalty=0.1
+        )
+        call_span.set(prompt_tokens=response['prompt_tokens'], completion_tokens=response['completion_tokens'],
+                      shared=response.get('shared', False))
+    return response
 
-## Response Guidelines:
-- **Accuracy**: Base responses strictly on the provided data from all sheets and tables
-- **Clarity**: Use clear, concise language with proper Markdown formatting
-- **Insightful**: Provide meaningful analysis and insights across all sheets and tables
-- **Structured**: Organize information with headers, lists, and tables
-- **Helpful**: Offer explanations and context for non-technical users
-- **Honest**: Acknowledge data limitations when present
+def map_units(analysis_data: List[Dict], question: str, unit: str = None) -> List[Dict[str, Any]]:
+    """
+    Split the tables into the units the map step asks about separately.
+    
+    Units are sheets (or single tables with unit='table'; a file with one sheet is
+    always split by table). When the question names some of the units' tables or
+    sheets, only those units are returned.
+    
+    Returns:
+        list: dicts with name (e.g. "sheet Sales") and tables (analysis_data entries)
+    """
+    unit = unit or ANALYSIS_MAP_UNIT
+    sheets = {}
+    for table in analysis_data:
+        sheets.setdefault(table.get('sheet', 'Unknown Sheet'), []).append(table)
+    if unit == 'table' or len(sheets) == 1:
+        units = [{'name': f"table {table.get('table', 'Table')} of sheet {table.get('sheet', 'Unknown Sheet')}",
+                  'tables': [table]} for table in analysis_data]
+    else:
+        units = [{'name': f"sheet {sheet_name}", 'tables': tables} for sheet_name, tables in sheets.items()]
+    relevant = [u for u in units if any(mentions(question, table) for table in u['tables'])]
+    return relevant or units
 
-## Data Analysis Approach:
-1. **Understand the Data**:
-   - Review all provided tables and their structures across all sheets
-   - Note column names, data types, and sample values
-   - Identify relationships between tables and sheets
-   - Pay attention to the sheet and table names for context
+def build_reduce_messages(question: str, partials: List[Dict[str, str]], token_budget: int) -> List[Dict[str, str]]:
+    """
+    Build the request that combines the partial answers of the map step.
+    
+    Args:
+        question: User's question
+        partials: dicts with name (the unit) and answer
+        token_budget: Prompt token limit; long partial answers are shortened to fit
+        
+    Returns:
+        list: ``[system_message, user_message]``
+    """
+    system_message = {
+        "role": "system",
+        "content": f"""# Combining Partial Answers
 
-2. **Analyze the Query**:
-   - Carefully read and understand the user's question
-   - Identify which sheets and tables are relevant to the question
-   - Consider any calculations or transformations needed across sheets
-   - If specific sheet/table is mentioned, focus on that data
+You are an expert data analyst AI. The user's question about an Excel file was answered separately for {len(partials)} parts of the file, each answer using only that part's tables. Combine the partial answers into one answer to the question:
 
-3. **Provide Response**:
-   - Start with a direct answer to the query
-   - Include supporting data and calculations from relevant sheets/tables
-   - Clearly indicate which sheet and table each piece of data comes from
-   - Explain your reasoning and methodology
-   - Highlight any limitations or assumptions
-   - Suggest follow-up questions or analyses
+- Add up or compare figures across parts where the question asks for totals or comparisons, and show the calculation
+- Mention which sheet and table each figure comes from
+- Leave out partial answers that say their data is not relevant
+- If partial answers contradict each other or a part could not be answered, say so
+- Use Markdown formatting with headers, bullet points and tables"""
+    }
+    
+    def user_message(answers: List[str]) -> Dict[str, str]:
+        prompt_parts = [f"# USER QUESTION:\n{question}\n", "## PARTIAL ANSWERS"]
+        for partial, answer in zip(partials, answers):
+            prompt_parts.append(f"\n### From {partial['name']}\n{answer}\n\n---")
+        prompt_parts.append(f"\n# QUESTION TO ANSWER:\n{question}")
+        return {"role": "user", "content": "\n".join(prompt_parts)}
+    
+    answers = [partial['answer'] for partial in partials]
+    messages = [system_message, user_message(answers)]
+    excess = count_message_tokens(messages, ANALYSIS_MODEL) - token_budget
+    if excess > 0:
+        # Shorten every partial answer by the same share of its length
+        keep = max(0.0, 1 - excess / max(sum(count_tokens(answer, ANALYSIS_MODEL) for answer in answers), 1)) * 0.95
+        answers = [answer[:int(len(answer) * keep)] + " [...]" for answer in answers]
+        messages = [system_message, user_message(answers)]
+    return messages
 
-4. **Formatting**:
-   - Use Markdown for clear formatting
-   - Include tables for tabular data (use markdown tables)
-   - Use bullet points for lists
-   - **Bold** important information
-   - Use headers to organize different sections
-   - Always mention the sheet and table names when referencing data
-   - Use code blocks for data samples or calculations
+async def analyze_table_async(analysis_data: List[Dict], question: str, max_concurrency: int = None,
+                              unit: str = None) -> str:
+    """
+    Answer a question by asking each sheet (or table) separately, then combining the answers.
+    
+    The map requests run concurrently, at most ``max_concurrency`` at a time, so the
+    latency is that of the slowest sheet plus the combining request rather than
+    growing with the file. A sheet whose request fails is reported as unanswered
+    instead of failing the whole answer.
+    
+    Args:
+        analysis_data: List of dictionaries containing table data with metadata
+        question: User's question about the data
+        max_concurrency: Map requests in flight at once (default: ANALYSIS_MAX_CONCURRENCY)
+        unit: 'sheet' or 'table' (default: ANALYSIS_MAP_UNIT)
+        
+    Returns:
+        str: Combined answer
+    """
+    units = map_units(analysis_data, question, unit)
+    provider = get_provider()
+    max_concurrency = max(1, max_concurrency or ANALYSIS_MAX_CONCURRENCY)
+    loop = asyncio.get_running_loop()
+    
+    with span('llm.map_reduce', units=len(units), concurrency=max_concurrency), \
+            ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix='llm-map') as executor:
+        semaphore = asyncio.Semaphore(max_concurrency)
+        
+        async def ask(map_unit: Dict[str, Any]) -> Dict[str, str]:
+            sub_question = (f"{question}\n\n(This request covers only the {map_unit['name']}. Answer from these "
+                            f"tables alone and state the exact figures you used, such as totals, counts and values, "
+                            f"so that the answer can be combined with answers about the rest of the file. If these "
+                            f"tables cannot answer the question, reply only: Not relevant.)")
+            async with semaphore:
+                try:
+                    compiled = compile_prompt(map_unit['tables'], sub_question, model=ANALYSIS_MODEL,
+                                              response_tokens=ANALYSIS_MAP_MAX_TOKENS)
+                    # The provider clients block, so each request waits on the thread pool;
+                    # copying the context keeps its span under llm.map_reduce
+                    response = await loop.run_in_executor(executor, functools.partial(
+                        contextvars.copy_context().run, _llm_call, provider, compiled['messages'], ANALYSIS_MAP_MAX_TOKENS,
+                        'llm.map', unit=map_unit['name'], tables=len(map_unit['tables'])))
+                    return {'name': map_unit['name'], 'answer': response['content'].strip()}
+                except Exception as e:
+                    logger.warning("Error answering for %s: %s", map_unit['name'], e)
+                    return {'name': map_unit['name'], 'answer': f"(No answer: {str(e)})", 'error': str(e)}
+        
+        partials = await asyncio.gather(*(ask(map_unit) for map_unit in units))
+        if all(partial.get('error') for partial in partials):
+            raise RuntimeError(partials[0]['error'])
+        if len(partials) == 1:
+            return partials[0]['answer']
+        
+        budget = min(PROMPT_TOKEN_BUDGET, context_window(ANALYSIS_MODEL) - ANALYSIS_MAX_TOKENS)
+        messages = build_reduce_messages(question, partials, budget)
+        response = await loop.run_in_executor(executor, functools.partial(
+            contextvars.copy_context().run, _llm_call, provider, messages, ANALYSIS_MAX_TOKENS, 'llm.reduce', partials=len(partials)))
+    return response['content'].strip()
 
-5. **Important Notes**:
-   - The data comes from {len(sheets)} sheets: {', '.join(sheets.keys())}
-   - Each sheet may contain multiple tables
-   - Pay attention to the table names and sheet names in the data
-   - If the user asks about a specific sheet or table, make sure to reference the correct one"""
-        }
-        
-        # Prepare the data for the prompt
-        prompt_parts = [f"# USER QUESTION:\n{question}\n"]
-        
-        # Add summary of available data
-        prompt_parts.append("## AVAILABLE DATA SUMMARY")
-        prompt_parts.append(f"- Total Sheets: {len(sheets)}")
-        prompt_parts.append(f"- Total Tables: {total_tables}")
-        
-        # Group data by sheet
-        sheets_data = {}
-        for data in analysis_data:
-            sheet_name = data.get('sheet', 'Unknown Sheet')
-            if sheet_name not in sheets_data:
-                sheets_data[sheet_name] = []
-            sheets_data[sheet_name].append(data)
-        
-        # Add information about each sheet and its tables
-        for sheet_name, tables in sheets_data.items():
-            prompt_parts.append(f"\n## 📑 SHEET: {sheet_name}")
-            prompt_parts.append(f"**Tables in this sheet:** {len(tables)}")
-            
-            for table_data in tables:
-                table_name = table_data.get('table', 'Table')
-                total_rows = table_data.get('total_rows', 0)
-                columns = table_data.get('columns', [])
-                sample_data = table_data.get('sample_data', [])
-                
-                prompt_parts.append(f"\n### Table: {table_name}")
-                prompt_parts.append(f"- **Total Rows**: {total_rows:,}")
-                prompt_parts.append(f"- **Columns**: {', '.join(columns)}")
-                
-                # Add a sample of the data (first 3 rows)
-                if sample_data and len(sample_data) > 0:
-                    try:
-                        sample_df = pd.DataFrame(sample_data)
-                        if not sample_df.empty:
-                            prompt_parts.append("\n**Sample Data (first 3 rows):**")
-                            prompt_parts.append(sample_df.head(3).to_markdown(index=False))
-                    except Exception as e:
-                        print(f"Error formatting sample data: {str(e)}")
-                prompt_parts.append("\n---")
-        
-        # Add the user's question again for clarity
-        prompt_parts.append(f"\n# QUESTION TO ANSWER:\n{question}")
+def analyze_table(analysis_data: List[Dict], question: str, mode: str = None) -> str:
+    """
+    Analyze table data from multiple sheets and answer questions using the configured LLM provider.
+    
+    Args:
+        analysis_data: List of dictionaries containing table data with metadata
+        question: User's question about the data
+        mode: 'single' (one request), 'map_reduce' (see ``analyze_table_async``) or
+            'auto': map_reduce when one prompt cannot hold every table's schema and
+            profile (default: ANALYSIS_MODE)
         
-        # Add instructions for the response
-        prompt_parts.append("""
-## INSTRUCTIONS FOR YOUR RESPONSE:
-1. Start with a clear, concise answer to the question
-2. Reference specific sheets and tables when providing data
-3. Include relevant data points and calculations
-4. Format your response with markdown for clarity
-5. If multiple sheets/tables are relevant, compare and contrast the data
-6. If the question is unclear or data is missing, ask for clarification
-""")
-        
-        # Combine all parts into the final prompt
-        full_prompt = "\n".join(prompt_parts)
-        
-        # Debug: Print the prompt length
-        print(f"Prompt length: {len(full_prompt)} characters")
-        
-        # Create the user message
-        user_message = {
-            "role": "user",
-            "content": full_prompt
-        }
+    Returns:
+        str: Generated analysis response with rich formatting
+    """
+    try:
+        if not analysis_data or not isinstance(analysis_data, list):
+            return "Error: No valid data provided for analysis"
+        
+        mode = mode or ANALYSIS_MODE
+        if mode == 'map_reduce' and len(analysis_data) > 1:
+            return asyncio.run(analyze_table_async(analysis_data, question))
+        
+        with span('llm.build_prompt', tables=len(analysis_data)) as prompt_span:
+            compiled = compile_prompt(analysis_data, question, model=ANALYSIS_MODEL,
+                                      response_tokens=ANALYSIS_MAX_TOKENS)
+            messages = compiled['messages']
+            prompt_span.set(chars=sum(len(message['content']) for message in messages),
+                            tokens=compiled['prompt_tokens'], budget=compiled['budget'],
+                            tokenizer=compiled['tokenizer'])
+        
+        if mode == 'auto' and len(analysis_data) > 1:
+            left_out = [
+                table for table, entry in zip(compiled['tables'], analysis_data)
+                if not table['schema'] or (entry.get('profile') and not table['profile'])
+            ]
+            if left_out:
+                logger.debug("%d of %d tables do not fit one prompt; asking per sheet", len(left_out), len(analysis_data))
+                return asyncio.run(analyze_table_async(analysis_data, question))
         
         # Get the response from the model
-        response = client.chat.completions.create(
-            model="gpt-4-turbo-preview",
-            messages=[system_message, user_message],
-            temperature=0.2,  # Lower temperature for more factual responses
-            max_tokens=4000,  # Increased token limit for comprehensive responses
-            top_p=0.9,
-            frequency_penalty=0.1,
-            presence_penalty=0.1
-        )
+        response = _llm_call(get_provider(), messages, ANALYSIS_MAX_TOKENS)
         
         # Extract and return the response
-        return response.choices[0].message.content.strip()
+        return response['content'].strip()
         
     except Exception as e:
-        import traceback
-        error_details = traceback.format_exc()
-        print(f"Error in analyze_table: {error_details}")
+        logger.exception("Error in analyze_table")
         return f"Error analyzing table data: {str(e)}\n\nPlease try again with a more specific question or check if the data is properly loaded."
 
 def generate_chat_response(chat_history: List[Dict[str, str]], current_question: str, table_context: pd.DataFrame = None) -> str:
-    """Generate a response for the chat interface using the OpenAI API."""
+    """Generate a response for the chat interface using the configured LLM provider."""
     if table_context is not None and not table_context.empty:
         return analyze_table([{'data': table_context.to_dict('records')}], current_question)
     
@@ -359,14 +504,14 @@ def generate_chat_response(chat_history: List[Dict[str, str]], current_question:
             "content": current_question
         })
         
-        response = client.chat.completions.create(
+        response = get_provider().complete(
             model="gpt-3.5-turbo",
             messages=messages,
             temperature=0.1,
             max_tokens=1000
         )
         
-        return response.choices[0].message.content.strip()
+        return response['content'].strip()
         
     except Exception as e:
         return f"Error generating response: {str(e)}"
\ No newline at end of file
@@ -1,452 +1,50 @@
 import os
 import sys
+import itertools
+import logging
 import streamlit as st
 import pandas as pd
 import time
 import json
-import requests
 from typing import Dict, List, Any, Optional
 from dotenv import load_dotenv
 
-# Load environment variables from .env file in the same directory as app.py
-env_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.env')
-load_dotenv(env_path)
+logger = logging.getLogger(__name__)
 
-# Debug: Print current working directory and .env path
-print(f"Current working directory: {os.getcwd()}")
-print(f"Loading .env from: {env_path}")
+# .env file in the same directory as app.py
+env_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.env')
 
-# OpenAI API Configuration
-try:
-    # Try to load from environment
-    OPENAI_API_KEY = os.getenv('OPENAI_API_KEY', '').strip()  # Add strip() to remove any whitespace
+@st.cache_resource(show_spinner=False)
+def bootstrap() -> None:
+    """
+    One-time process setup: load .env, validate the LLM provider (the OpenAI API
+    key, unless LLM_PROVIDER=mock), create the upload folder and the database tables.
     
-    # Debug output
-    print(f"Loaded OPENAI_API_KEY length: {len(OPENAI_API_KEY) if OPENAI_API_KEY else 0}")
+    Streamlit re-executes this script on every interaction; the result is cached
+    for the lifetime of the process, so this runs once rather than on every rerun.
+    A failure raises and is not cached, so the next rerun tries again.
     
-    if not OPENAI_API_KEY:
-        st.error("❌ OPENAI_API_KEY not found in environment variables. Please check your .env file.")
-        st.stop()
-        
-    # Simple validation that the key starts with 'sk-'
-    if not OPENAI_API_KEY.startswith('sk-'):
-        st.error(f"❌ Invalid API key format. OpenAI API key should start with 'sk-'. Got: '{OPENAI_API_KEY[:10]}...'")
-        st.stop()
-        
-    print("✅ OpenAI API key loaded and validated successfully")
-    
-    # Test the API key with a simple request to OpenAI
-    test_headers = {
-        'Authorization': f'Bearer {OPENAI_API_KEY}',
-        'Content-Type': 'application/json'
-    }
-    test_data = {
-        'model': 'gpt-3.5-turbo',
-        'messages': [{'role': 'user', 'content': 'test'}],
-        'max_tokens': 5
-    }
-    
-    try:
-        response = requests.post(
-            'https://api.openai.com/v1/chat/completions',
-            headers=test_headers,
-            json=test_data,
-            timeout=10
-        )
-        if response.status_code == 200:
-            print("✅ OpenAI API key is valid and working")
-        else:
-            st.error(f"❌ OpenAI API key validation failed with status {response.status_code}: {response.text}")
-            st.stop()
-    except Exception as e:
-        st.error(f"❌ Error validating OpenAI API key: {str(e)}")
-        st.stop()
-        
-except Exception as e:
-    st.error(f"❌ Error initializing OpenAI API: {str(e)}")
-    st.stop()
-
-# Initialize OpenAI client with GPT model by default
-def get_openai_response(messages: List[Dict[str, str]], 
-                     model: str = "gpt-3.5-turbo",
-                     temperature: float = 0.3,  # Lower temperature for more focused responses
-                     max_tokens: int = 1000,  # Adjusted for OpenAI models
-                     top_p: float = 0.9) -> str:  # Adjusted for better results with GPT
+    Raises:
+        RuntimeError: If the API key is missing, malformed or rejected, or the mock LLM is unreachable
     """
-    Get response from OpenAI API with enhanced error handling and parameters
+    load_dotenv(env_path)
     
-    Args:
-        messages: List of message dictionaries with 'role' and 'content'
-        model: The model to use (default: gpt-3.5-turbo)
-        temperature: Controls randomness (0.0 to 2.0)
-        max_tokens: Maximum number of tokens to generate
-        top_p: Controls diversity via nucleus sampling (0.0 to 1.0)
-        
-    Returns:
-        str: Generated response content or error message
-    """
-    try:
-        # Get API key from environment
-        api_key = os.getenv("OPENAI_API_KEY")
-        if not api_key:
-            return "Error: OPENAI_API_KEY environment variable not set"
-        
-        # Validate parameters
-        if not isinstance(messages, list) or not messages:
-            return "Error: messages must be a non-empty list"
-            
-        if temperature < 0 or temperature > 2:
-            return "Error: temperature must be between 0 and 2"
-            
-        if max_tokens <= 0 or max_tokens > 4096:  # Max tokens for most OpenAI models
-            return "Error: max_tokens must be between 1 and 4096"
-            
-        if top_p <= 0 or top_p > 1:
-            return "Error: top_p must be between 0 and 1"
-            
-        # Prepare the API request
-        headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json"
-        }
-        
-        payload = {
-            "model": model,
-            "messages": messages,
-            "temperature": temperature,
-            "max_tokens": max_tokens,
-            "top_p": top_p,
-            "stop": None
-        }
-        
-        # Make the API request
-        response = requests.post(
-            "https://api.openai.com/v1/chat/completions",
-            headers=headers,
-            json=payload,
-            timeout=60  # Increased timeout for larger responses
-        )
-        
-        # Handle the response
-        if response.status_code == 200:
-            result = response.json()
-            return result["choices"][0]["message"]["content"]
-        else:
-            error_msg = f"OpenAI API request failed with status {response.status_code}"
-            try:
-                error_detail = response.json().get("error", {}).get("message", "No error details provided")
-                error_msg += f": {error_detail}"
-            except:
-                error_msg += f": {response.text}"
-            return f"Error: {error_msg}"
-            
-    except requests.exceptions.RequestException as e:
-        return f"Error: Request failed - {str(e)}"
-    except Exception as e:
-        return f"Unexpected error: {str(e)}"
-
-def analyze_table(analysis_data: List[Dict], prompt: str) -> str:
-    """
-    Analyze the table data and generate a comprehensive response using OpenAI's API.
+    # Validate the LLM provider: the OpenAI API key, or that the mock server answers
+    from llm_providers import get_provider
+    get_provider().check()
     
-    Args:
-        analysis_data: List of dictionaries containing table data with metadata
-        prompt: User's query about the data
-        
-    Returns:
-        str: Generated analysis response with rich formatting
-    """
-    try:
-        # Prepare system message with detailed instructions for the AI
-        system_message = {
-            "role": "system",
-            "content": """# Excel Data Analysis Assistant
-
-You are an expert data analyst AI that helps users understand and work with Excel data. You have COMPLETE ACCESS to ALL DATA in the Excel file.
+    # Imported after load_dotenv so that DATABASE_URL and UPLOAD_FOLDER from .env apply
+    import database as db
+    import excel_parser as parser
+    os.makedirs(parser.UPLOAD_FOLDER, exist_ok=True)
+    db.init_db()
 
-## CRITICAL INSTRUCTIONS:
-1. You have access to the ENTIRE DATASET, not just a sample
-2. The data is provided in a JSON format with all rows included
-3. Use Python list slicing to access any part of the data:
-   - `data[-1]` for the last row
-   - `data[-3:]` for the last 3 rows
-   - `len(data)` to get total row count
-   - `[row['column_name'] for row in data]` to extract a column
-
-## Data Access Examples:
-- Last row: `data[-1]`
-- Last 3 rows: `data[-3:]`
-- Specific column: `[row['column_name'] for row in data]`
-- Filtered data: `[row for row in data if condition]`
-
-## Response Guidelines:
-- **Accuracy**: Base responses on the complete dataset
-- **Completeness**: Analyze all relevant data points
-- **Clarity**: Use clear, concise language with Markdown formatting
-- **Evidence**: Include specific data points to support your answers
-- **Honesty**: If data is insufficient, explain what's missing
-
-## For Specific Queries:
-- When asked for "last X rows", use negative indexing: `data[-X:]`
-- For row counts, use `len(data)` which matches `total_rows`
-- For column operations, use list comprehensions
-- Always verify data exists before accessing it
-
-## Important Notes:
-- The data preview is just for human readability
-- You have access to ALL rows in the JSON data structure
-- Use Python's list and dictionary operations to analyze the data
-- If a query is about specific rows or ranges, access them directly using the methods above"""
-        }
-        
-        # Prepare data context with better formatting and more details
-        def format_data_context():
-            context = []
-            for idx, table in enumerate(analysis_data, 1):
-                table_info = []
-                table_name = table.get('table', f'Table {idx}')
-                sheet_name = table.get('sheet', 'Unknown Sheet')
-                total_rows = table.get('total_rows', 0)
-                
-                # Table header with metadata
-                table_info.append(f"### 📊 {table_name} (Sheet: {sheet_name})\n")
-                table_info.append(f"- **Total Rows:** {total_rows:,}\n")
-                
-                # Add column information with types
-                columns = table.get('columns', [])
-                column_types = table.get('column_types', {})
-                if columns:
-                    table_info.append("**Columns:**\n")
-                    for col in columns:
-                        col_type = column_types.get(col, 'unknown')
-                        table_info.append(f"  - `{col}` ({col_type})\n")
-                    table_info.append("\n")
-                
-                # Get all data for analysis
-                all_data = table.get('data', [])
-                if all_data:
-                    total_rows = len(all_data)
-                    table_info.append(f"**Complete Data Table ({total_rows} total rows):**\n\n")
-                    
-                    # Add a note about data availability
-                    table_info.append("*Note: You have access to ALL ROWS of data for analysis. "
-                                    "The table below shows a preview of the data structure.*\n\n")
-                    
-                    # For very large tables, limit the display to avoid overwhelming the context window
-                    if total_rows > 20:
-                        table_info.append(f"*Displaying first 5 rows of {total_rows} total rows. "
-                                        "All rows are available for analysis.*\n\n")
-                    
-                    # Show column headers
-                    headers = " | ".join(columns)
-                    separators = " | ".join([":---"] * len(columns))
-                    table_info.append(f"| {headers} |\n")
-                    table_info.append(f"|{separators}|\n")
-                    
-                    # For small datasets, show all rows
-                    # For large datasets, just show a few rows as example
-                    max_display_rows = 5 if total_rows > 10 else total_rows
-                    for row in all_data[:max_display_rows]:
-                        row_data = []
-                        for col in columns:
-                            cell = str(row.get(col, "")).replace("\n", " ")
-                            row_data.append(cell[:50] + ("..." if len(cell) > 50 else ""))
-                        table_info.append("| " + " | ".join(row_data) + " |\n")
-                    
-                    if total_rows > max_display_rows:
-                        table_info.append(f"| ... and {total_rows - max_display_rows} more rows ... |\n")
-                    
-                    table_info.append("\n")
-                
-                # Add basic statistics if available
-                if columns and sample_data:
-                    table_info.append("**Quick Statistics:**\n")
-                    table_info.append("- Sample size: ", str(sample_size), " rows\n")
-                    table_info.append("- Total columns: ", str(len(columns)), "\n\n")
-                
-                context.append("".join(table_info))
-            
-            return "\n\n".join(context)
-        
-        # Prepare the complete data context with all rows
-        def get_complete_data_context():
-            context = []
-            for idx, table in enumerate(analysis_data, 1):
-                table_info = []
-                table_name = table.get('table', f'Table {idx}')
-                sheet_name = table.get('sheet', 'Unknown Sheet')
-                total_rows = table.get('total_rows', 0)
-                
-                # Table header with metadata
-                table_info.append(f"### 📊 {table_name} (Sheet: {sheet_name})\n")
-                table_info.append(f"- **Total Rows:** {total_rows:,}\n")
-                
-                # Add column information with types
-                columns = table.get('columns', [])
-                column_types = table.get('column_types', {})
-                if columns:
-                    table_info.append("**Columns:**\n")
-                    for col in columns:
-                        col_type = column_types.get(col, 'unknown')
-                        table_info.append(f"  - `{col}` ({col_type})\n")
-                    table_info.append("\n")
-                
-                # Add complete data
-                all_data = table.get('data', [])
-                if all_data:
-                    # For large datasets, we'll include the data in a more efficient format
-                    if total_rows > 20:
-                        table_info.append(f"**Complete Dataset Summary ({total_rows} rows):**\n\n")
-                        table_info.append("*Note: The complete dataset is available for analysis. "
-                                      "The AI can access all rows to answer your questions.*\n\n")
-                        
-                        # Show first few and last few rows to give context
-                        for i, row in enumerate(all_data[:3]):
-                            row_data = [f"Row {i+1}:"]
-                            for col in columns[:5]:  # Limit to first 5 columns for display
-                                cell = str(row.get(col, "")).replace("\n", " ")
-                                row_data.append(f"{col}: {cell[:30]}" + ("..." if len(cell) > 30 else ""))
-                            table_info.append("  - " + " | ".join(row_data) + "\n")
-                        
-                        if total_rows > 6:
-                            table_info.append(f"  - ... {total_rows - 6} more rows ...\n")
-                            
-                            # Show last 3 rows
-                            for i in range(max(3, total_rows-3), total_rows):
-                                row = all_data[i]
-                                row_data = [f"Row {i+1}:"]
-                                for col in columns[:5]:  # Limit to first 5 columns for display
-                                    cell = str(row.get(col, "")).replace("\n", " ")
-                                    row_data.append(f"{col}: {cell[:30]}" + ("..." if len(cell) > 30 else ""))
-                                table_info.append("  - " + " | ".join(row_data) + "\n")
-                    else:
-                        # For smaller datasets, show all data
-                        table_info.append(f"**Complete Data Table ({total_rows} rows):**\n\n")
-                        headers = " | ".join(columns)
-                        separators = " | ".join([":---"] * len(columns))
-                        table_info.append(f"| {headers} |\n")
-                        table_info.append(f"|{separators}|\n")
-                        
-                        for row in all_data:
-                            row_data = []
-                            for col in columns:
-                                cell = str(row.get(col, "")).replace("\n", " ")
-                                row_data.append(cell[:30] + ("..." if len(cell) > 30 else ""))
-                            table_info.append("| " + " | ".join(row_data) + " |\n")
-                    
-                    table_info.append("\n")
-                
-                # Add the complete data in a structured format for the AI
-                table_info.append("\n**Complete Data (for analysis):**\n")
-                table_info.append("```json\n")
-                
-                # For analysis, we'll include all data but in a more compact format
-                analysis_data = {
-                    "table_name": table_name,
-                    "sheet_name": sheet_name,
-                    "total_rows": total_rows,
-                    "columns": columns,
-                    "data": all_data  # Include all data for analysis
-                }
-                
-                # Convert to JSON with minimal whitespace to save tokens
-                table_info.append(json.dumps(analysis_data, separators=(',', ':')))
-                table_info.append("\n```\n")
-                
-                # Add explicit instructions for specific queries
-                if total_rows > 0:
-                    table_info.append("\n**Data Access Notes:**\n")
-                    table_info.append("- To access the last row: `data[-1]`\n")
-                    table_info.append("- To access the last 3 rows: `data[-3:]`\n")
-                    table_info.append("- To count rows: `total_rows` or `len(data)`\n")
-                    table_info.append("- To get a specific column: `[row['column_name'] for row in data]`\n\n")
-                
-                context.append("".join(table_info))
-            
-            return "\n\n".join(context)
-
-        # Prepare the user message with complete data context
-        user_message = {
-            "role": "user",
-            "content": f"""# 📊 Excel Data Analysis Request
-
-## 📂 Data Overview
-{format_data_context()}
-
-## ❓ User Query
-{prompt}
-
-## 🔍 IMPORTANT DATA ACCESS NOTES:
-1. You have access to ALL ROWS in the 'data' array of each table
-2. To access data, use these patterns:
-   - Last row: `data[-1]`
-   - Last 3 rows: `data[-3:]`
-   - First 5 rows: `data[:5]`
-   - Specific column: `[row['column_name'] for row in data]`
-   - Row count: `len(data)`
-
-3. The data preview is for display only - always use the complete dataset in the JSON structure for your analysis
-4. For any request about specific rows or ranges, access them directly using the methods above
-5. When showing results, include the actual data points from the complete dataset
-
-## 📝 Response Requirements:
-- Start with a clear, direct answer to the query
-- Include specific data points from the complete dataset to support your answer
-- If showing a subset of data, indicate if it's a sample from a larger dataset
-- For any calculations, state that they're based on the complete dataset
-- If the query is about specific rows (e.g., 'last 3 rows'), show the actual data from those rows
-4. **Format the Response**:
-   - Start with a direct answer to the question
-   - Provide supporting evidence and calculations from the complete dataset
-   - Use Markdown formatting for clarity
-   - Include relevant data points in your response
-   - For large datasets, you can summarize but make it clear you're considering all data
+try:
+    bootstrap()
+except Exception as e:
+    st.error(f"❌ {str(e)}")
+    st.stop()
 
-## 🎯 Your Response (based on complete dataset analysis):
-"""
-        }
-        
-        # Get response from Groq with Llama 3
-        with st.spinner("Analyzing your data..."):
-            try:
-                response = get_groq_response(
-                    [system_message, user_message],
-                    model="llama3-70b-8192",  # Using Llama 3 70B model
-                    temperature=0.2,  # Lower temperature for more focused, deterministic responses
-                    max_tokens=4000,  # Increased token limit for more detailed responses
-                    top_p=0.9,  # Slightly higher top_p for better creativity when needed
-                )
-                
-                # Post-process the response
-                if not response or not response.strip():
-                    return "I couldn't generate a response. The data might be too complex or the question might be unclear."
-                
-                # Clean up the response
-                response = response.strip()
-                
-                # Ensure the response ends with proper punctuation
-                if response and response[-1] not in {'.', '!', '?', ':', ';'}:  
-                    response += '.'
-                    
-                # Add a friendly sign-off if the response is long enough
-                if len(response.split()) > 50:  # If response is more than 50 words
-                    response += "\n\n*Is there anything specific about this analysis you'd like me to elaborate on?*"
-                    
-                return response
-                
-            except Exception as api_error:
-                error_msg = str(api_error)
-                if "rate limit" in error_msg.lower():
-                    return "I'm currently experiencing high demand. Please try again in a moment. If the issue persists, you may want to check your API rate limits."
-                elif "timeout" in error_msg.lower():
-                    return "The request timed out while processing your data. The dataset might be too large. Please try again with a more specific question or a smaller dataset."
-                else:
-                    return f"I encountered an error while processing your request: {error_msg}"
-        
-    except Exception as e:
-        error_msg = f"Error analyzing data: {str(e)}"
-        st.error(error_msg)
-        return "I encountered an error while processing your request. Please try again later or rephrase your question."
 from pathlib import Path
 from datetime import datetime
 import json
@@ -456,14 +54,13 @@ from models import ExcelFile, ExcelTable, ChatHistory
 import database as db
 import excel_parser as parser
 from serializers import serialize_data, prepare_for_db
-from ai_utils import generate_chat_response, analyze_table
+from tracing import span, recent_traces, flatten_trace, clear_traces
+# ai_utils, ingest and visualization_utils are imported by the pages that use them
 
 # Configuration
-UPLOAD_FOLDER = "excel_uploads"
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-
-# Initialize database
-db.init_db()
+UPLOAD_FOLDER = parser.UPLOAD_FOLDER
+# Show the span timings of recent runs in the sidebar
+DEBUG_PANEL = os.getenv('DEBUG_PANEL', '0') == '1'
 
 # Page configuration
 st.set_page_config(
@@ -511,6 +108,39 @@ def initialize_session_state():
 # Initialize session state
 initialize_session_state()
 
+def run_bulk_upload(uploaded_files):
+    """Save several uploaded workbooks and ingest them in parallel, with progress and a per-file report."""
+    import ingest
+    
+    staged_names = {}
+    for uploaded_file in uploaded_files:
+        file_path, _ = parser.save_uploaded_file(uploaded_file, UPLOAD_FOLDER)
+        staged_names[file_path] = uploaded_file.name
+    
+    progress = st.progress(0.0, text=f"Ingesting {len(staged_names)} files...")
+    
+    def report_progress(files_done, total_files, report):
+        progress.progress(files_done / max(total_files, 1), text=f"Processed {files_done} of {total_files} files")
+    
+    reports = ingest.ingest_files(
+        list(staged_names),
+        copy_to_uploads=False,
+        discard_failed=True,
+        progress_callback=report_progress
+    )
+    
+    saved = sum(1 for report in reports if report['status'] == 'saved')
+    if saved == len(reports):
+        st.success(f"Ingested all {saved} files.")
+    else:
+        st.warning(f"Ingested {saved} of {len(reports)} files. See the report below for the others.")
+    st.dataframe(pd.DataFrame([{
+        'File': staged_names[report['source']],
+        'Status': report['status'],
+        'Tables': report['tables'],
+        'Details': report['error'] or ''
+    } for report in reports]), use_container_width=True)
+
 def show_upload_page():
     """Render the file upload page."""
     if st.session_state.page != 'upload':
@@ -524,6 +154,10 @@ def show_upload_page():
         tables_data = st.session_state.upload_success.get('tables_data')
         
         st.success("Excel file processed successfully!")
+        if st.session_state.upload_success.get('version', 1) > 1:
+            reused_sheets = st.session_state.upload_success.get('reused_sheets', [])
+            st.info(f"Saved as version {st.session_state.upload_success['version']}. "
+                    f"{len(reused_sheets)} unchanged sheet(s) were reused from the previous version.")
         st.subheader("Tables Found")
         
         # Display table summary
@@ -595,8 +229,21 @@ def show_upload_page():
         st.markdown("---")
         st.subheader("Upload Another File")
     
+    # Bulk upload: many workbooks parsed in parallel worker processes (see ingest.py)
+    with st.expander("📦 Bulk upload"):
+        bulk_files = st.file_uploader(
+            "Choose Excel files", type=["xlsx", "xls"], accept_multiple_files=True, key="bulk_uploader"
+        )
+        if bulk_files and st.button(f"Ingest {len(bulk_files)} files", use_container_width=True):
+            run_bulk_upload(bulk_files)
+    
     # File uploader
     uploaded_file = st.file_uploader("Choose an Excel file", type=["xlsx", "xls"])
+    as_new_version = st.checkbox(
+        "Save as a new version if this workbook was uploaded before",
+        value=True,
+        help="Only sheets that changed since the previous upload are parsed; unchanged sheets are reused."
+    )
     
     if uploaded_file and not st.session_state.get('processing_file', False):
         st.session_state.processing_file = True
@@ -604,12 +251,14 @@ def show_upload_page():
         st.session_state.uploaded_file_name = uploaded_file.name
         
         try:
-            with st.spinner("Processing file..."):
+            with st.spinner("Processing file..."), span('upload', file=uploaded_file.name, bytes=uploaded_file.size):
                 # Save the uploaded file
                 file_path, file_hash = parser.save_uploaded_file(uploaded_file, UPLOAD_FOLDER)
                 
-                # Check for duplicate file (by hash or filename)
-                is_duplicate, message = db.is_duplicate_file(file_hash, uploaded_file.name)
+                # Check for duplicate file (by hash, and by filename unless saving a new version)
+                is_duplicate, message = db.is_duplicate_file(
+                    file_hash, None if as_new_version else uploaded_file.name
+                )
                 if is_duplicate:
                     st.warning(message)
                     try:
@@ -620,10 +269,26 @@ def show_upload_page():
                     st.session_state.processing_file = False
                     return
                 
-                # Extract tables from the Excel file
-                tables_data = parser.extract_all_tables(file_path)
+                # Hash each sheet so the next upload of this workbook can skip unchanged sheets
+                with span('excel.sheet_hashes'):
+                    sheet_hashes = parser.calculate_sheet_hashes(file_path)
+                previous = None
+                reused_sheets = []
+                if as_new_version and sheet_hashes:
+                    previous = db.find_previous_version(*parser.safe_file_stem(uploaded_file.name))
+                if previous:
+                    reused_sheets = [
+                        sheet_name for sheet_name, sheet_hash in sheet_hashes.items()
+                        if previous['sheet_hashes'].get(sheet_name) == sheet_hash
+                    ]
+                
+                # Extract tables from the Excel file, skipping sheets reused from the previous version.
+                # Tables are streamed into the database sheet by sheet rather than parsed up front.
+                changed_sheets = [name for name in sheet_hashes if name not in reused_sheets] if sheet_hashes else None
+                tables = parser.iter_tables(file_path, sheet_names=changed_sheets)
+                first_table = next(tables, None)
                 
-                if not tables_data:
+                if first_table is None and not reused_sheets:
                     st.error("No tables found in the Excel file.")
                     os.remove(file_path)
                     st.session_state.processing_file = False
@@ -631,17 +296,45 @@ def show_upload_page():
                 
                 # Save to database
                 try:
+                    save_progress = st.progress(0.0, text="Saving tables to database...")
+                    total_sheets = max(len(sheet_hashes), 1)
+                    sheets_seen = set()
+
+                    def counted_tables():
+                        for table in itertools.chain([first_table] if first_table else [], tables):
+                            sheets_seen.add(table[0])
+                            yield table
+
+                    def report_save_progress(tables_saved, total_tables):
+                        # The table count is not known up front, so progress is by sheet
+                        save_progress.progress(
+                            min((len(sheets_seen) + len(reused_sheets)) / total_sheets, 1.0),
+                            text=f"Saved {tables_saved} tables"
+                        )
+
                     file_id = db.save_excel_file(
                         file_name=os.path.basename(file_path),
                         file_path=file_path,
                         file_hash=file_hash,
-                        tables_data=tables_data
+                        tables_data=counted_tables(),
+                        progress_callback=report_save_progress,
+                        parent_file_id=previous['id'] if previous else None,
+                        sheet_hashes=sheet_hashes,
+                        reused_sheets=reused_sheets
                     )
                     
+                    if previous:
+                        logger.info("Saved version %d of %s: reused %d sheet(s), parsed %d sheet(s)",
+                                    previous['version'] + 1, previous['file_name'], len(reused_sheets), len(sheets_seen))
+                    # Show the saved file, including any sheets reused from the previous version
+                    tables_data = db.get_excel_file(file_id)['tables']
+
                     # Store success state in session
                     st.session_state.upload_success = {
                         'file_id': file_id,
-                        'tables_data': tables_data
+                        'tables_data': tables_data,
+                        'version': previous['version'] + 1 if previous else 1,
+                        'reused_sheets': reused_sheets
                     }
                     st.rerun()
                     
@@ -1359,7 +1052,7 @@ def show_chat_page():
         ]
     
     # Display chat messages in a container with improved styling
-    with st.container():
+    with st.container(), span('chat.render', messages=len(st.session_state.chat_messages[chat_key])):
         if chat_key in st.session_state.chat_messages:
             for message in st.session_state.chat_messages[chat_key]:
                 # Skip empty or system messages in the display
@@ -1425,7 +1118,6 @@ def show_chat_page():
     if prompt and (len(st.session_state.chat_messages[chat_key]) == 0 or 
                   st.session_state.chat_messages[chat_key][-1].get("content") != prompt):
         try:
-            print(f"Processing new message: {prompt}")
             # Add user message to chat
             user_message = {
                 "role": "user", 
@@ -1451,7 +1143,7 @@ def show_chat_page():
             st.rerun()
             
         except Exception as e:
-            print(f"Error processing message: {str(e)}")
+            logger.error("Error processing message: %s", e)
             st.error(f"Error processing your message: {str(e)}")
     
     # Handle the AI response after rerun
@@ -1460,96 +1152,21 @@ def show_chat_page():
         st.session_state.get('processing_started', False)):
         
         prompt = st.session_state.pending_prompt
-        print(f"Processing AI response for prompt: {prompt}")
         
         # Clear the processing flag
         st.session_state.processing_started = False
         
         try:
-            # Prepare analysis data in a separate function to keep things clean
-            def prepare_analysis_data():
-                print("Preparing analysis data...")
-                analysis_data = []
-                total_tables = 0
-                
-                # First, count the total number of tables across all sheets
-                for sheet_name, tables in file_data.get('tables', {}).items():
-                    total_tables += len(tables)
-                
-                print(f"Found {total_tables} tables across {len(file_data.get('tables', {}))} sheets")
-                
-                for sheet_name, tables in file_data.get('tables', {}).items():
-                    print(f"Processing sheet: {sheet_name} with {len(tables)} tables")
-                    
-                    # If no tables in sheet, try to extract data directly from the sheet
-                    if not tables:
-                        print(f"No tables found in sheet {sheet_name}, trying to extract data directly")
-                        try:
-                            # Try to read the sheet directly
-                            df = pd.read_excel(file_data['file_path'], sheet_name=sheet_name)
-                            if not df.empty:
-                                df = df.dropna(how='all').reset_index(drop=True)
-                                if not df.empty:
-                                    # Clean column names
-                                    df.columns = [str(col).strip() for col in df.columns]
-                                    # Convert all columns to string to handle mixed types
-                                    df = df.astype(str)
-                                    # Include all rows in the analysis data
-                                    table_rows = len(df)
-                                    analysis_data.append({
-                                        'sheet': sheet_name,
-                                        'table': 'Sheet Data',
-                                        'columns': list(df.columns),
-                                        'data': df.to_dict('records'),  # Store all rows
-                                        'sample_data': df.head(5).to_dict('records'),  # Keep a small sample for display
-                                        'total_rows': table_rows,
-                                        'column_types': {col: str(df[col].dtype) for col in df.columns}
-                                    })
-                                    print(f"Added sheet data from {sheet_name} with {len(df)} rows")
-                        except Exception as e:
-                            print(f"Error processing sheet {sheet_name}: {str(e)}")
-                        continue
-                    
-                    # Process each table in the sheet
-                    for table_name, table_data in tables.items():
-                        try:
-                            print(f"  Processing table: {table_name}")
-                            df = pd.DataFrame(table_data)
-                            if not df.empty:
-                                # Clean the data
-                                df = df.dropna(how='all').reset_index(drop=True)
-                                if not df.empty:
-                                    # Clean column names
-                                    df.columns = [str(col).strip() for col in df.columns]
-                                    # Convert all columns to string to handle mixed types
-                                    df = df.astype(str)
-                                    # Store all data for analysis
-                                    table_rows = len(df)
-                                    analysis_data.append({
-                                        'sheet': sheet_name,
-                                        'table': table_name,
-                                        'columns': list(df.columns),
-                                        'data': df.to_dict('records'),  # Store all rows
-                                        'sample_data': df.head(5).to_dict('records'),  # Keep a small sample for display
-                                        'total_rows': table_rows,
-                                        'column_types': {col: str(df[col].dtype) for col in df.columns}
-                                    })
-                                    print(f"  Added table {table_name} with {table_rows} rows")
-                        except Exception as e:
-                            print(f"  Error processing table {table_name} in sheet {sheet_name}: {str(e)}")
-                
-                print(f"Total tables/sheets processed: {len(analysis_data)}")
-                return analysis_data
+            # Imported on first use: only the chat page talks to the model
+            from ai_utils import analyze_table, prepare_analysis_data
             
             # Get analysis data
-            analysis_data = prepare_analysis_data()
+            analysis_data = prepare_analysis_data(file_data)
             if not analysis_data:
                 raise ValueError("No valid data available for analysis. Please check if your Excel file contains valid data.")
             
             # Get AI response with error handling
-            print("Sending request to OpenAI API...")
             response = analyze_table(analysis_data, prompt)
-            print("Received response from OpenAI API")
             
             if not response or not response.strip():
                 response = "I'm sorry, but I couldn't generate a response. Please try again with a different question."
@@ -1580,7 +1197,7 @@ def show_chat_page():
                             sheet_name='all_sheets'
                         )
                     except Exception as e:
-                        print(f"Error saving chat history: {str(e)}")
+                        logger.error("Error saving chat history: %s", e)
                         st.error(f"Error saving chat history: {str(e)}")
                 
                 # Clear the pending prompt
@@ -1594,7 +1211,7 @@ def show_chat_page():
                 
         except Exception as e:
             error_msg = str(e)
-            print(f"Error in chat processing: {error_msg}")
+            logger.error("Error in chat processing: %s", error_msg)
             
             # Remove processing message if it exists
             if (chat_key in st.session_state.chat_messages and 
@@ -1626,7 +1243,7 @@ def show_chat_page():
                 st.session_state.chat_messages[chat_key].pop()
             
             error_msg = str(e)
-            print(f"Error in chat processing: {error_msg}")
+            logger.error("Error in chat processing: %s", error_msg)
             
             # Only add error message if it's not already the last message
             if (not st.session_state.chat_messages[chat_key] or 
@@ -1679,7 +1296,8 @@ def show_chat_page():
     st.sidebar.markdown("---")
     st.sidebar.markdown("### AI Model")
     st.sidebar.info(f"Using: GPT 4.0 Turbo")
-    st.sidebar.caption("Powered by OpenAI API")
+    from llm_providers import get_provider
+    st.sidebar.caption(f"Powered by {get_provider().label}")
     
     # Add some helpful tips
     st.sidebar.markdown("---")
@@ -1748,12 +1366,37 @@ def show_chat_page():
             del st.session_state.selected_file
         st.session_state.page = 'file_detail'
         st.rerun()
+def show_trace_panel(max_traces: int = 10):
+    """Show the span timings of recent runs in a sidebar expander."""
+    with st.sidebar.expander("🐞 Timings", expanded=False):
+        from llm_providers import coalescing_stats
+        coalescing = coalescing_stats()
+        if coalescing and coalescing['calls']:
+            st.caption(f"LLM requests: {coalescing['calls']:,}, {coalescing['saved']:,} "
+                       f"({coalescing['saved_share']:.0%}) answered by an identical request already in flight")
+        traces = recent_traces(max_traces)
+        if not traces:
+            st.caption("No traces recorded yet.")
+            return
+        if st.button("Clear", key="clear_traces"):
+            clear_traces()
+            st.rerun()
+        for trace in traces:
+            attributes = ", ".join(f"{key}={value}" for key, value in trace['attributes'].items())
+            st.markdown(f"**{trace['name']}** {attributes} — {trace['duration_ms']:,.0f} ms")
+            st.dataframe(pd.DataFrame([{
+                'Stage': "\u00a0\u00a0" * row['depth'] + row['name'],
+                'ms': round(row['duration_ms'], 1),
+                '%': round(row['share'] * 100, 1) if row['share'] is not None else None,
+                'Attributes': ", ".join(f"{key}={value}" for key, value in row['attributes'].items())
+                              + (f" error={row['error']}" if row['error'] else "")
+            } for row in flatten_trace(trace)]), hide_index=True, use_container_width=True)
+
 # Navigation
 st.sidebar.title("📊 Excel ChatBot")
 
 # Navigation options
 nav_options = ["📤 Upload Excel", "📋 Browse Files", "💬 Chat with Sheets", "📈 Visualize Excel"]
-from visualization_utils import visualize_excel_file
 
 # Get current page index
 page_index = 0  # Default to Upload Excel
@@ -1770,25 +1413,28 @@ page = st.sidebar.radio(
     key='nav_radio'
 )
 
-# Page routing
-if page == "📤 Upload Excel":
-    st.session_state.page = 'upload'
-    show_upload_page()
-elif page == "📋 Browse Files":
-    st.session_state.page = 'browse'
-    show_browse_page()
-elif page == "💬 Chat with Sheets":
-    # Only show chat page if a file is selected
-    if 'selected_file' in st.session_state and st.session_state.selected_file:
-        st.session_state.page = 'chat'
-        show_chat_page()
-    else:
-        st.warning("Please select a file from the Browse Files page first.")
+# Page routing; each run of the script is one trace in the debug panel
+with span('render', page=page):
+    if page == "📤 Upload Excel":
+        st.session_state.page = 'upload'
+        show_upload_page()
+    elif page == "📋 Browse Files":
         st.session_state.page = 'browse'
         show_browse_page()
-elif page == "📈 Visualize Excel":
- st.session_state.page = 'visualize'
- visualize_excel_file()
+    elif page == "💬 Chat with Sheets":
+        # Only show chat page if a file is selected
+        if 'selected_file' in st.session_state and st.session_state.selected_file:
+            st.session_state.page = 'chat'
+            show_chat_page()
+        else:
+            st.warning("Please select a file from the Browse Files page first.")
+            st.session_state.page = 'browse'
+            show_browse_page()
+    elif page == "📈 Visualize Excel":
+        # Imported here: it loads plotly, which the other pages do not need
+        from visualization_utils import visualize_excel_file
+        st.session_state.page = 'visualize'
+        visualize_excel_file()
 
 # Clear upload success state when navigating away from upload page
 if 'last_page' in st.session_state and st.session_state.last_page == 'upload' and st.session_state.page != 'upload':
@@ -1800,3 +1446,6 @@ st.session_state.last_page = st.session_state.page
 # Handle file detail page (not in sidebar)
 if st.session_state.page == 'file_detail':
     show_file_detail_page()
+
+if DEBUG_PANEL:
+    show_trace_panel()
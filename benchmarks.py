@@ -0,0 +1,233 @@
+"""
+Benchmarks for the upload and analysis paths, with a stored baseline.
+
+Each benchmark is timed over several runs and measured once more under
+``tracemalloc`` for its peak memory. Results are compared with a baseline saved
+by an earlier run (``--save-baseline``), and the script fails when a benchmark
+got slower or uses more memory than the baseline by more than the threshold.
+
+Benchmarks run against a throwaway SQLite database and a generated workbook:
+
+- ``extract_tables_from_sheet`` and ``extract_all_tables`` (openpyxl parsing)
+- ``serialize_data`` and ``prepare_for_db`` on rows with dates
+- ``save_excel_file`` and ``get_excel_file`` against SQLite
+- ``prepare_analysis_data`` and ``build_analysis_messages`` (the chat prompt)
+- ``analyze_table`` against the local mock LLM with no emulated delays, i.e. the
+  pipeline's own cost of one chat answer including the HTTP round trip
+
+Baselines are machine-specific, so none is committed: save one on the machine
+(or CI runner type) that compares against it. The script exits 1 on regressions
+and 2 when there is no usable baseline to compare with.
+
+Usage:
+    python benchmarks.py --save-baseline          # record benchmark_baseline.json
+    python benchmarks.py                          # compare with it (exits 2 without one)
+    python benchmarks.py --rows 20000 --repeat 10 --threshold 0.1
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+import uuid
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Any, Tuple
+
+# Relative slowdown or memory growth over the baseline that counts as a regression
+BENCHMARK_THRESHOLD = float(os.getenv('BENCHMARK_THRESHOLD', '0.25'))
+# Slowdowns smaller than this (ms) are treated as noise
+BENCHMARK_MIN_DELTA_MS = float(os.getenv('BENCHMARK_MIN_DELTA_MS', '2'))
+BASELINE_FILE = 'benchmark_baseline.json'
+
+
+def make_workbook(path: str, rows: int, columns: int = 8):
+    """Write a workbook with a large mixed-type table, a second small sheet and a defined table."""
+    import openpyxl
+    from openpyxl.worksheet.table import Table
+
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    sheet.title = 'Data'
+    sheet.append(['id', 'date', 'region', 'product'] + [f'value_{i}' for i in range(columns - 4)])
+    start = datetime(2024, 1, 1)
+    regions = ['North', 'South', 'East', 'West']
+    for i in range(rows):
+        sheet.append([i, start + timedelta(hours=i), regions[i % 4], f'product_{i % 97}']
+                     + [(i * (k + 1)) % 1000 / 10 for k in range(columns - 4)])
+
+    summary = workbook.create_sheet('Summary')
+    summary.append(['region', 'target'])
+    for k, region in enumerate(regions):
+        summary.append([region, 1000 * (k + 1)])
+    summary.add_table(Table(displayName='Targets', ref=f'A1:B{len(regions) + 1}'))
+    workbook.save(path)
+
+
+def measure(func: Callable[[], Any], repeat: int) -> Dict[str, float]:
+    """
+    Time ``func`` over ``repeat`` runs after one warm-up run, then measure its peak memory.
+
+    Returns:
+        dict: median_ms, min_ms and peak_mb (peak traced allocation of one run)
+    """
+    func()
+    timings = []
+    for _ in range(max(1, repeat)):
+        started = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - started) * 1000)
+
+    # Separate run: tracemalloc slows allocation-heavy code down considerably
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        'median_ms': statistics.median(timings),
+        'min_ms': min(timings),
+        'peak_mb': peak / (1024 * 1024)
+    }
+
+
+def build_benchmarks(workdir: str, rows: int) -> List[Tuple[str, Callable[[], Any]]]:
+    """Prepare the fixtures and return (name, callable) pairs in run order."""
+    import openpyxl
+    import database as db
+    import excel_parser as parser
+    from serializers import serialize_data, prepare_for_db
+    from ai_utils import prepare_analysis_data, build_analysis_messages, analyze_table
+    from llm_providers import MockProvider, set_provider
+    from mock_llm import start_server
+
+    workbook_path = os.path.join(workdir, 'benchmark.xlsx')
+    make_workbook(workbook_path, rows)
+    db.init_db()
+
+    sheet = openpyxl.load_workbook(workbook_path, data_only=True)['Data']
+    tables_data = parser.extract_all_tables(workbook_path)
+    # Rows as openpyxl returns them, before serialization (dates as datetime objects)
+    raw_rows = [
+        {'id': i, 'date': datetime(2024, 1, 1) + timedelta(hours=i), 'region': 'North', 'value': i / 10}
+        for i in range(rows)
+    ]
+
+    def save():
+        return db.save_excel_file(
+            file_name='benchmark.xlsx',
+            file_path=workbook_path,
+            file_hash=uuid.uuid4().hex + uuid.uuid4().hex,
+            tables_data=tables_data
+        )
+
+    file_id = save()
+    file_data = db.get_excel_file(file_id)
+    analysis_data = prepare_analysis_data(file_data)
+    question = "What is the total of value_1 per region, and which product sells best?"
+    # Zero delays: measure our side of the call, not the emulated model
+    set_provider(MockProvider(start_server(latency_ms=0, prefill_ms_per_1k=0, token_ms=0, jitter=0)['url']))
+
+    return [
+        ('extract_tables_from_sheet', lambda: parser.extract_tables_from_sheet(sheet)),
+        ('extract_all_tables', lambda: parser.extract_all_tables(workbook_path)),
+        ('serialize_data', lambda: serialize_data(raw_rows)),
+        ('prepare_for_db', lambda: prepare_for_db(raw_rows)),
+        ('save_excel_file', save),
+        ('get_excel_file', lambda: db.get_excel_file(file_id)),
+        ('prepare_analysis_data', lambda: prepare_analysis_data(file_data)),
+        ('build_analysis_messages', lambda: build_analysis_messages(analysis_data, question)),
+        ('analyze_table', lambda: analyze_table(analysis_data, question)),
+    ]
+
+
+def compare(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]],
+            threshold: float, min_delta_ms: float) -> List[str]:
+    """
+    Compare results with a baseline.
+
+    Time is compared on the fastest run, which is the least sensitive to noise.
+
+    Returns:
+        list: One message per regression
+    """
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        slower_ms = result['min_ms'] - base['min_ms']
+        if result['min_ms'] > base['min_ms'] * (1 + threshold) and slower_ms > min_delta_ms:
+            regressions.append(f"{name}: {result['min_ms']:.1f} ms vs {base['min_ms']:.1f} ms baseline "
+                               f"(+{slower_ms / base['min_ms']:.0%})")
+        if result['peak_mb'] > base['peak_mb'] * (1 + threshold) and result['peak_mb'] - base['peak_mb'] > 1:
+            regressions.append(f"{name}: peak {result['peak_mb']:.1f} MB vs {base['peak_mb']:.1f} MB baseline")
+    return regressions
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Benchmark parsing, storage and prompt building")
+    arg_parser.add_argument("--rows", type=int, default=5000, help="Rows in the generated table")
+    arg_parser.add_argument("--repeat", type=int, default=5, help="Timed runs per benchmark")
+    arg_parser.add_argument("--only", nargs="+", help="Run only these benchmarks")
+    arg_parser.add_argument("--baseline", default=BASELINE_FILE, help="Baseline file")
+    arg_parser.add_argument("--save-baseline", action="store_true", help="Store these results as the baseline")
+    arg_parser.add_argument("--threshold", type=float, default=BENCHMARK_THRESHOLD,
+                            help="Allowed relative slowdown / memory growth, e.g. 0.25")
+    args = arg_parser.parse_args()
+
+    # Without a baseline nothing can be compared, which must not pass as "no regressions"
+    if not args.save_baseline and not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}; run with --save-baseline first")
+        sys.exit(2)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        # Set before database is imported: benchmarks never touch the configured database
+        os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(workdir, 'benchmark.db')}"
+        os.environ['TRACE_LOG_FILE'] = ''
+
+        results = {}
+        # The measured code prints progress; keep it out of the report
+        with open(os.devnull, 'w') as devnull:
+            with contextlib.redirect_stdout(devnull):
+                benchmarks = build_benchmarks(workdir, args.rows)
+            for name, func in benchmarks:
+                if args.only and name not in args.only:
+                    continue
+                with contextlib.redirect_stdout(devnull):
+                    results[name] = measure(func, args.repeat)
+                result = results[name]
+                print(f"{name:<28} median {result['median_ms']:>9.1f} ms  min {result['min_ms']:>9.1f} ms  "
+                      f"peak {result['peak_mb']:>7.1f} MB")
+
+        import database as db
+        db.engine.dispose()
+
+    meta = {
+        'rows': args.rows,
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'created_at': datetime.now().isoformat(timespec='seconds')
+    }
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump({'meta': meta, 'results': results}, f, indent=2)
+        print(f"Saved baseline to {args.baseline}")
+        sys.exit(0)
+
+    with open(args.baseline, encoding='utf-8') as f:
+        baseline = json.load(f)
+    if baseline['meta'].get('rows') != args.rows:
+        print(f"Baseline was recorded with --rows {baseline['meta'].get('rows')}; not comparing")
+        sys.exit(2)
+
+    regressions = compare(results, baseline['results'], args.threshold, BENCHMARK_MIN_DELTA_MS)
+    for message in regressions:
+        print(f"REGRESSION {message}")
+    print(f"{len(regressions)} regression(s) against {args.baseline} (threshold {args.threshold:.0%})")
+    sys.exit(1 if regressions else 0)
@@ -0,0 +1,244 @@
+"""
+Server-side downsampling and aggregation for Plotly charts.
+
+Reduces a DataFrame to a bounded number of points before it is handed to
+Plotly, so large sheets do not ship every row to the browser:
+
+- line charts keep the visually significant points (Largest-Triangle-Three-Buckets)
+- scatter charts are binned on a 2D grid, one point per occupied cell
+- bar and pie charts are aggregated per category, keeping the top categories
+"""
+import os
+import numpy as np
+import pandas as pd
+from typing import Tuple, Dict, Any
+
+# Maximum number of points sent to the browser per chart
+CHART_POINT_BUDGET = int(os.getenv('CHART_POINT_BUDGET', '5000'))
+# Maximum number of bars after aggregation; the remainder is grouped as "Other"
+CHART_MAX_CATEGORIES = int(os.getenv('CHART_MAX_CATEGORIES', '100'))
+# Maximum number of pie slices after aggregation; the remainder is grouped as "Other"
+CHART_MAX_SLICES = int(os.getenv('CHART_MAX_SLICES', '12'))
+# Line and scatter charts with more points than this are drawn with WebGL
+WEBGL_POINT_THRESHOLD = int(os.getenv('WEBGL_POINT_THRESHOLD', '1000'))
+
+OTHER_LABEL = 'Other'
+
+def _as_float(series: pd.Series) -> Tuple[np.ndarray, bool]:
+    """
+    Convert a numeric or datetime series to float64 values.
+
+    Returns:
+        tuple: (values, is_datetime); values are nanoseconds since the epoch for datetimes
+    """
+    if pd.api.types.is_datetime64_any_dtype(series):
+        values = series.to_numpy(dtype='datetime64[ns]').astype(np.int64).astype(np.float64)
+        values[series.isna().to_numpy()] = np.nan
+        return values, True
+    return pd.to_numeric(series, errors='coerce').to_numpy(dtype=np.float64), False
+
+def _from_float(values: np.ndarray, is_datetime: bool):
+    """Inverse of _as_float."""
+    if is_datetime:
+        return pd.to_datetime(values.astype(np.int64))
+    return values
+
+def _is_continuous(series: pd.Series) -> bool:
+    """Whether a column can be treated as a continuous axis."""
+    return (pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series)) \
+        or pd.api.types.is_datetime64_any_dtype(series)
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """
+    Select ``n_out`` points with the Largest-Triangle-Three-Buckets algorithm.
+
+    The first and last points are always kept. The points in between are split
+    into ``n_out - 2`` buckets, and from each bucket the point forming the
+    largest triangle with the previously selected point and the average of the
+    next bucket is kept. Each bucket is evaluated with vectorized NumPy.
+
+    Args:
+        x: X values, sorted ascending, without NaNs
+        y: Y values, without NaNs
+        n_out: Number of points to keep
+
+    Returns:
+        np.ndarray: Indices of the selected points, ascending
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    indices = np.empty(n_out, dtype=np.int64)
+    indices[0] = 0
+    indices[-1] = n - 1
+
+    selected = 0
+    for bucket in range(n_out - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        next_end = edges[bucket + 2] if bucket + 2 < len(edges) else n
+        avg_x = x[end:next_end].mean()
+        avg_y = y[end:next_end].mean()
+
+        ax, ay = x[selected], y[selected]
+        areas = np.abs((ax - avg_x) * (y[start:end] - ay) - (ax - x[start:end]) * (avg_y - ay))
+        selected = start + int(np.argmax(areas))
+        indices[bucket + 1] = selected
+    return indices
+
+def _columns(x: str, y: str) -> list:
+    """The X and Y columns, once each: both axes start on the same column in the chart form."""
+    return list(dict.fromkeys([x, y]))
+
+def _axes_frame(x: str, x_values, y: str, y_values, **extra) -> pd.DataFrame:
+    """A DataFrame of the plotted X and Y values; when both axes are one column, the X values are kept."""
+    columns = {x: x_values}
+    if y != x:
+        columns[y] = y_values
+    return pd.DataFrame({**columns, **extra})
+
+def _systematic_sample(df: pd.DataFrame, budget: int) -> pd.DataFrame:
+    """Keep every k-th row so that at most ``budget`` rows remain."""
+    step = int(np.ceil(len(df) / budget))
+    return df.iloc[::step]
+
+def downsample_line(df: pd.DataFrame, x: str, y: str, budget: int = CHART_POINT_BUDGET) -> Tuple[pd.DataFrame, str]:
+    """
+    Reduce a line chart to at most ``budget`` points with LTTB.
+
+    Continuous X axes are sorted first; categorical X axes are downsampled by
+    row position. A non-numeric Y axis falls back to systematic sampling.
+
+    Returns:
+        tuple: (DataFrame to plot, name of the method used)
+    """
+    if not pd.api.types.is_numeric_dtype(df[y]) or pd.api.types.is_bool_dtype(df[y]):
+        return _systematic_sample(df, budget), 'sampled'
+
+    if _is_continuous(df[x]):
+        data = df[_columns(x, y)].dropna().sort_values(x, kind='stable')
+        x_values, _ = _as_float(data[x])
+    else:
+        data = df[_columns(x, y)].dropna(subset=[y])
+        x_values = np.arange(len(data), dtype=np.float64)
+
+    y_values = data[y].to_numpy(dtype=np.float64)
+    return data.iloc[lttb_indices(x_values, y_values, budget)], 'lttb'
+
+def bin_scatter(df: pd.DataFrame, x: str, y: str, budget: int = CHART_POINT_BUDGET) -> Tuple[pd.DataFrame, str]:
+    """
+    Reduce a scatter chart to at most ``budget`` points by 2D binning.
+
+    Both axes are split into ``sqrt(budget)`` equal-width bins; each occupied
+    cell becomes one point at the mean of its members, with the number of
+    members in a ``points`` column. Non-continuous axes fall back to
+    systematic sampling.
+
+    Returns:
+        tuple: (DataFrame to plot, name of the method used)
+    """
+    if not (_is_continuous(df[x]) and _is_continuous(df[y])):
+        return _systematic_sample(df, budget), 'sampled'
+
+    x_values, x_is_datetime = _as_float(df[x])
+    y_values, y_is_datetime = _as_float(df[y])
+    finite = np.isfinite(x_values) & np.isfinite(y_values)
+    x_values, y_values = x_values[finite], y_values[finite]
+    if len(x_values) == 0:
+        return df.iloc[:0], 'binned'
+
+    bins = max(int(np.sqrt(budget)), 1)
+
+    def bin_index(values: np.ndarray) -> np.ndarray:
+        low, high = values.min(), values.max()
+        if high == low:
+            return np.zeros(len(values), dtype=np.int64)
+        return np.clip(((values - low) / (high - low) * bins).astype(np.int64), 0, bins - 1)
+
+    cells = bin_index(x_values) * bins + bin_index(y_values)
+    counts = np.bincount(cells, minlength=bins * bins)
+    occupied = counts > 0
+    x_means = np.bincount(cells, weights=x_values, minlength=bins * bins)[occupied] / counts[occupied]
+    y_means = np.bincount(cells, weights=y_values, minlength=bins * bins)[occupied] / counts[occupied]
+
+    return _axes_frame(x, _from_float(x_means, x_is_datetime), y, _from_float(y_means, y_is_datetime),
+                       points=counts[occupied]), 'binned'
+
+def _collapse_tail(grouped: pd.Series, max_groups: int) -> pd.Series:
+    """Keep the ``max_groups - 1`` largest groups and sum the rest into an "Other" group."""
+    if len(grouped) <= max_groups:
+        return grouped
+    top = grouped.nlargest(max_groups - 1)
+    other = grouped.drop(top.index).sum()
+    return pd.concat([top, pd.Series([other], index=[OTHER_LABEL])])
+
+def aggregate_categories(df: pd.DataFrame, x: str, y: str, max_groups: int,
+                         bin_continuous: bool = False) -> Tuple[pd.DataFrame, str]:
+    """
+    Aggregate ``y`` per value of ``x`` for bar and pie charts.
+
+    Numeric ``y`` columns are summed and anything else is counted. When there
+    are more than ``max_groups`` groups, continuous X axes are split into
+    ``max_groups`` equal-width bins if ``bin_continuous`` is set; otherwise the
+    largest groups are kept and the rest summed into "Other". When ``x`` and
+    ``y`` are the same column, the result holds the group labels only.
+
+    Returns:
+        tuple: (DataFrame to plot, name of the method used)
+    """
+    numeric_y = pd.api.types.is_numeric_dtype(df[y]) and not pd.api.types.is_bool_dtype(df[y])
+    if numeric_y:
+        grouped = df.groupby(x, sort=False, dropna=False)[y].sum()
+    else:
+        grouped = df.groupby(x, sort=False, dropna=False).size()
+
+    if len(grouped) <= max_groups:
+        return _axes_frame(x, grouped.index, y, grouped.to_numpy()), 'aggregated'
+
+    if bin_continuous and _is_continuous(df[x]):
+        x_values, is_datetime = _as_float(df[x])
+        weights = df[y].to_numpy(dtype=np.float64) if numeric_y else np.ones(len(df))
+        finite = np.isfinite(x_values) & np.isfinite(weights)
+        sums, edges = np.histogram(x_values[finite], bins=max_groups, weights=weights[finite])
+        return _axes_frame(x, _from_float(edges[:-1], is_datetime), y, sums), 'binned'
+
+    grouped = _collapse_tail(grouped, max_groups)
+    return _axes_frame(x, grouped.index.astype(str), y, grouped.to_numpy()), 'aggregated'
+
+def prepare_chart_data(df: pd.DataFrame, chart_type: str, x: str, y: str,
+                       budget: int = CHART_POINT_BUDGET) -> Tuple[pd.DataFrame, Dict[str, Any]]:
+    """
+    Reduce a DataFrame to what a chart needs to draw within the point budget.
+
+    DataFrames within the budget are returned unchanged.
+
+    Args:
+        df: Source data
+        chart_type: One of "Bar", "Line", "Pie" or "Scatter"
+        x: X-axis (or names) column
+        y: Y-axis (or values) column
+        budget: Maximum number of points to plot
+
+    Returns:
+        tuple: (DataFrame to plot, info dict with original_rows, plotted_points,
+            method and render_mode)
+    """
+    original_rows = len(df)
+    method = None
+    if original_rows > budget:
+        if chart_type == "Line":
+            df, method = downsample_line(df, x, y, budget)
+        elif chart_type == "Scatter":
+            df, method = bin_scatter(df, x, y, budget)
+        elif chart_type == "Bar":
+            df, method = aggregate_categories(df, x, y, min(CHART_MAX_CATEGORIES, budget), bin_continuous=True)
+        elif chart_type == "Pie":
+            df, method = aggregate_categories(df, x, y, min(CHART_MAX_SLICES, budget))
+
+    return df, {
+        'original_rows': original_rows,
+        'plotted_points': len(df),
+        'method': method,
+        'render_mode': 'webgl' if len(df) > WEBGL_POINT_THRESHOLD else 'auto'
+    }
@@ -1,11 +1,25 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, scoped_session
+from sqlalchemy import create_engine, event, insert, update, delete, select, literal, and_, func, text, Integer
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.pool import StaticPool
+from sqlalchemy.orm import sessionmaker, Session
 from contextlib import contextmanager
 import os
+import io
+import re
+import json
+import shutil
+import sqlite3
+import hashlib
+import logging
+import queue
+import time
+import threading
 from dotenv import load_dotenv
-from models import Base, ExcelFile, ExcelTable, ChatHistory, MessageRole
-from typing import Generator, Optional, Dict, Any, List, Tuple
-from sqlalchemy.exc import SQLAlchemyError
+from models import Base, ExcelFile, ExcelTable, ExcelTableChunk, ChatHistory, MessageRole
+from excel_parser import calculate_table_hash, fingerprint_table, fingerprint_sheet
+from tracing import span
+from typing import Generator, Iterator, Iterable, Mapping, Callable, Optional, Dict, Any, List, Tuple, Union
+from sqlalchemy.exc import SQLAlchemyError, TimeoutError as PoolTimeoutError
 from datetime import datetime
 
 # Load environment variables
@@ -21,19 +35,184 @@ POSTGRES_DB = os.getenv('POSTGRES_DB', 'Adora_AI')
 
 
 
-DATABASE_URL = f"postgresql://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DB}?sslmode=require&channel_binding=require"
+# DATABASE_URL selects the backend, e.g. sqlite:///excel_database.db for a local
+# single-node deployment; without it the PostgreSQL settings above are used.
+DATABASE_URL = os.getenv('DATABASE_URL') or f"postgresql://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DB}?sslmode=require&channel_binding=require"
 
 # Azure Config
 
 
-engine = create_engine(DATABASE_URL, pool_pre_ping=True)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Connection pool configuration
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '10'))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', '20'))
+DB_POOL_TIMEOUT = int(os.getenv('DB_POOL_TIMEOUT', '30'))  # seconds to wait for a free connection
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', '1800'))  # seconds before a connection is replaced
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv('DB_STATEMENT_TIMEOUT_MS', '0'))  # 0 disables the timeout
+
+# SQLite tuning
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', '5000'))
+SQLITE_CACHE_SIZE_KB = int(os.getenv('SQLITE_CACHE_SIZE_KB', '65536'))
+SQLITE_MMAP_SIZE = int(os.getenv('SQLITE_MMAP_SIZE', str(256 * 1024 * 1024)))
+
+def _is_sqlite_memory(url) -> bool:
+    """Return True if a SQLite URL points at an in-memory database."""
+    return url.database in (None, '', ':memory:') or 'mode=memory' in str(url)
+
+def _engine_options(url) -> Dict[str, Any]:
+    """Build create_engine keyword arguments for the backend selected by ``url``."""
+    if url.get_backend_name() == 'sqlite':
+        options = {'connect_args': {'check_same_thread': False, 'timeout': SQLITE_BUSY_TIMEOUT_MS / 1000}}
+        if _is_sqlite_memory(url):
+            # Every connection to :memory: is a separate database, so share one
+            options['poolclass'] = StaticPool
+        else:
+            options.update(pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW,
+                           pool_timeout=DB_POOL_TIMEOUT, pool_pre_ping=True)
+        return options
+    
+    options = {
+        'pool_pre_ping': True,
+        'pool_size': DB_POOL_SIZE,
+        'max_overflow': DB_MAX_OVERFLOW,
+        'pool_timeout': DB_POOL_TIMEOUT,
+        'pool_recycle': DB_POOL_RECYCLE,
+    }
+    if DB_STATEMENT_TIMEOUT_MS > 0 and url.get_backend_name() == 'postgresql':
+        options['connect_args'] = {'options': f'-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}'}
+    return options
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Apply WAL mode and single-node tuning to each new SQLite connection."""
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    cursor.close()
+
+def create_db_engine(database_url: str) -> Engine:
+    """
+    Create an engine for ``database_url`` with backend-specific settings.
+    
+    PostgreSQL engines get the configured pool and statement timeout. SQLite
+    engines run in WAL mode with foreign keys enforced and tuned cache/mmap
+    pragmas, and in-memory databases share a single connection.
+    """
+    url = make_url(database_url)
+    db_engine = create_engine(url, **_engine_options(url))
+    if url.get_backend_name() == 'sqlite':
+        event.listen(db_engine, 'connect', _set_sqlite_pragmas)
+    return db_engine
+
+engine = create_db_engine(DATABASE_URL)
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
+
+def configure_database(database_url: str) -> Engine:
+    """
+    Point the module at a different database, e.g. a temporary SQLite file for
+    offline tests, benchmarks and batch jobs.
+    
+    Args:
+        database_url: SQLAlchemy database URL
+        
+    Returns:
+        The new engine
+    """
+    global engine, DATABASE_URL
+    old_engine = engine
+    DATABASE_URL = database_url
+    engine = create_db_engine(database_url)
+    SessionLocal.configure(bind=engine)
+    old_engine.dispose()
+    return engine
+
+class _PoolWaitStats:
+    """Thread-safe counters for how long sessions wait to obtain a connection."""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+    
+    def reset(self):
+        with self._lock:
+            self.checkouts = 0
+            self.timeouts = 0
+            self.total_wait = 0.0
+            self.max_wait = 0.0
+    
+    def record(self, wait: float, timed_out: bool = False):
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+                return
+            self.checkouts += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+    
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'checkouts': self.checkouts,
+                'checkout_timeouts': self.timeouts,
+                'avg_wait_ms': (self.total_wait / self.checkouts * 1000) if self.checkouts else 0.0,
+                'max_wait_ms': self.max_wait * 1000,
+            }
+
+_pool_wait_stats = _PoolWaitStats()
+
+def get_pool_metrics() -> Dict[str, Any]:
+    """
+    Return connection pool metrics.
+    
+    Returns:
+        dict: Pool size, connections checked out/in, current overflow, and the
+        number of session checkouts with their average/maximum wait time
+    """
+    pool = engine.pool
+    metrics = {
+        'pool_class': type(pool).__name__,
+        'pool_size': pool.size() if hasattr(pool, 'size') else None,
+        'checked_out': pool.checkedout() if hasattr(pool, 'checkedout') else None,
+        'checked_in': pool.checkedin() if hasattr(pool, 'checkedin') else None,
+        'overflow': pool.overflow() if hasattr(pool, 'overflow') else None,
+        'max_overflow': DB_MAX_OVERFLOW,
+    }
+    metrics.update(_pool_wait_stats.snapshot())
+    return metrics
+
+def reset_pool_metrics():
+    """Reset the checkout wait counters reported by get_pool_metrics."""
+    _pool_wait_stats.reset()
+
+# Number of ExcelTable rows sent per multi-row INSERT in save_excel_file
+TABLE_INSERT_BATCH_SIZE = int(os.getenv('TABLE_INSERT_BATCH_SIZE', '50'))
+# On PostgreSQL (psycopg2 or psycopg), write table and chunk rows with COPY instead of INSERT
+DB_BULK_COPY = os.getenv('DB_BULK_COPY', '1').strip().lower() not in ('0', 'false', 'no', 'off')
+
+# Tables with more rows than this are stored as ExcelTableChunk rows (0 disables chunking)
+TABLE_CHUNK_THRESHOLD = int(os.getenv('TABLE_CHUNK_THRESHOLD', '50000'))
+# Number of records per ExcelTableChunk
+TABLE_CHUNK_SIZE = int(os.getenv('TABLE_CHUNK_SIZE', '5000'))
+
+# Number of ExcelFile rows deleted per transaction in delete_excel_files
+FILE_DELETE_BATCH_SIZE = int(os.getenv('FILE_DELETE_BATCH_SIZE', '500'))
 
 @contextmanager
-def get_db_session() -> Generator[scoped_session, None, None]:
+def get_db_session() -> Generator[Session, None, None]:
     """Database session context manager."""
-    session = scoped_session(SessionLocal)
+    session = SessionLocal()
     try:
+        # Acquire the connection up front so pool wait time can be measured
+        started = time.perf_counter()
+        try:
+            session.connection()
+        except PoolTimeoutError:
+            _pool_wait_stats.record(time.perf_counter() - started, timed_out=True)
+            raise
+        _pool_wait_stats.record(time.perf_counter() - started)
         yield session
         session.commit()
     except Exception as e:
@@ -58,8 +237,10 @@ def is_duplicate_file(file_hash: str, file_name: str = None) -> Tuple[bool, str]
         Tuple of (is_duplicate, message) where message explains the reason
     """
     with get_db_session() as db_session:
-        # First check by hash (exact duplicate)
-        existing_by_hash = db_session.query(ExcelFile).filter(ExcelFile.file_hash == file_hash).first()
+        # First check by hash (exact duplicate), including duplicated files, whose file_hash is not a content hash
+        existing_by_hash = db_session.query(ExcelFile.id).filter(
+            (ExcelFile.file_hash == file_hash) | (ExcelFile.content_hash == file_hash)
+        ).first()
         if existing_by_hash:
             return True, "This exact file has already been uploaded."
             
@@ -74,77 +255,748 @@ def is_duplicate_file(file_hash: str, file_name: str = None) -> Tuple[bool, str]
                 
         return False, ""
 
-def save_excel_file(file_name: str, file_path: str, file_hash: str, tables_data: Dict[str, Any]) -> Optional[int]:
-    """Save Excel file and its tables to the database."""
+def find_previous_version(base_name: str, extension: str) -> Optional[Dict[str, Any]]:
+    """
+    Find the latest stored upload of a workbook with the same original name.
+    
+    Stored uploads are named ``<base_name>_<YYYYmmdd_HHMMSS>[_<n>]<extension>``
+    (see ``excel_parser.save_uploaded_file``).
+    
+    Args:
+        base_name: Sanitized original file name without extension
+        extension: Original file extension, including the dot
+        
+    Returns:
+        dict: ID, file name, version and sheet hashes of the latest version, or None
+    """
+    stored_name = re.compile(rf"^{re.escape(base_name)}_\d{{8}}_\d{{6}}(_\d+)?{re.escape(extension)}$")
     with get_db_session() as db_session:
+        candidates = db_session.query(
+            ExcelFile.id, ExcelFile.file_name, ExcelFile.version, ExcelFile.sheet_hashes, ExcelFile.uploaded_at
+        ).filter(ExcelFile.file_name.like(f"{base_name}%")).all()
+        versions = [c for c in candidates if stored_name.match(c.file_name)]
+        if not versions:
+            return None
+        latest = max(versions, key=lambda c: (c.version, c.uploaded_at, c.id))
+        return {
+            'id': latest.id,
+            'file_name': latest.file_name,
+            'version': latest.version,
+            'sheet_hashes': latest.sheet_hashes or {}
+        }
+
+def _profile_rows(table_data: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """Profile a table's columns; a failed profile is logged and stored as NULL rather than failing the upload."""
+    # Imported here so that reading the database does not load pandas
+    from profiling import profile_table
+    try:
+        with span('table.profile', rows=len(table_data)):
+            return profile_table(table_data)
+    except Exception as e:
+        print(f"Warning: could not profile table: {str(e)}")
+        return None
+
+def _table_mapping(file_id: int, sheet_name: str, table_name: str,
+                   table_data: List[Dict[str, Any]], content_hash: Optional[str] = None) -> Dict[str, Any]:
+    """Build the ``excel_tables`` row mapping for one table, without its profile or fingerprints."""
+    if not content_hash:
+        with span('table.hash', rows=len(table_data)):
+            content_hash = calculate_table_hash(table_data)
+    return {
+        'excel_file_id': file_id,
+        'sheet_name': sheet_name,
+        'table_name': table_name,
+        'data': table_data,
+        'row_count': len(table_data),
+        'content_hash': content_hash
+    }
+
+def _should_chunk(table_data: List[Dict[str, Any]], threshold: int = None) -> bool:
+    """Return True if a table is large enough to be stored as ExcelTableChunk rows."""
+    threshold = TABLE_CHUNK_THRESHOLD if threshold is None else threshold
+    return threshold > 0 and len(table_data) > threshold
+
+def _supports_copy(db_session) -> bool:
+    """Return True if bulk inserts on this session can use PostgreSQL COPY."""
+    dialect = db_session.get_bind().dialect
+    return DB_BULK_COPY and dialect.name == 'postgresql' and dialect.driver in ('psycopg2', 'psycopg')
+
+def _copy_value(value: Any) -> str:
+    """Encode one value as a field of COPY's text format."""
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, (dict, list)):
+        value = json.dumps(value, separators=(',', ':'), ensure_ascii=False, default=str)
+    return (str(value).replace('\\', '\\\\').replace('\t', '\\t')
+            .replace('\n', '\\n').replace('\r', '\\r'))
+
+def _copy_rows(db_session, model, rows: List[Dict[str, Any]]):
+    """Write row mappings into ``model``'s table with one COPY ... FROM STDIN."""
+    preparer = db_session.get_bind().dialect.identifier_preparer
+    columns = list(rows[0])
+    sql = (f"COPY {preparer.format_table(model.__table__)} "
+           f"({', '.join(preparer.quote(column) for column in columns)}) FROM STDIN")
+    payload = ''.join(
+        '\t'.join(_copy_value(row.get(column)) for column in columns) + '\n' for row in rows
+    )
+    # The session's own connection, so the rows are part of its transaction
+    cursor = db_session.connection().connection.cursor()
+    try:
+        if hasattr(cursor, 'copy_expert'):  # psycopg2
+            cursor.copy_expert(sql, io.StringIO(payload))
+        else:  # psycopg 3
+            with cursor.copy(sql) as copy:
+                copy.write(payload)
+    finally:
+        cursor.close()
+
+def _bulk_insert(db_session, model, rows: List[Dict[str, Any]]):
+    """
+    Insert row mappings into ``model``'s table in one round trip.
+    
+    PostgreSQL sessions use COPY (see ``DB_BULK_COPY``); other backends get a
+    single executemany ``INSERT``, which SQLAlchemy sends as multi-row VALUES
+    where the dialect supports it.
+    """
+    if not rows:
+        return
+    if _supports_copy(db_session):
+        with span('db.copy', table=model.__tablename__, rows=len(rows)):
+            _copy_rows(db_session, model, rows)
+    else:
+        db_session.execute(insert(model), rows)
+
+def _insert_chunked_table(db_session, mapping: Dict[str, Any], chunk_size: int = None) -> int:
+    """Insert a table as an empty ExcelTable row plus ExcelTableChunk rows, one chunk per INSERT."""
+    chunk_size = max(1, chunk_size or TABLE_CHUNK_SIZE)
+    rows = mapping['data']
+    with span('db.insert_chunked', rows=len(rows), chunks=-(-len(rows) // chunk_size)):
+        table_id = db_session.execute(
+            insert(ExcelTable).values(**{**mapping, 'data': [], 'is_chunked': True}).returning(ExcelTable.id)
+        ).scalar_one()
+        for chunk_index, row_offset in enumerate(range(0, len(rows), chunk_size)):
+            chunk_rows = rows[row_offset:row_offset + chunk_size]
+            _bulk_insert(db_session, ExcelTableChunk, [{
+                'excel_table_id': table_id,
+                'chunk_index': chunk_index,
+                'row_offset': row_offset,
+                'row_count': len(chunk_rows),
+                'data': chunk_rows
+            }])
+    return table_id
+
+def _iter_parsed_tables(tables_data) -> Iterator[Tuple[str, str, List[Dict[str, Any]]]]:
+    """Yield (sheet name, table name, rows) from a nested mapping or pass a stream of such tuples through."""
+    if isinstance(tables_data, Mapping):
+        for sheet_name, tables in tables_data.items():
+            for table_name, rows in tables.items():
+                yield sheet_name, table_name, rows
+    else:
+        yield from tables_data
+
+def save_excel_file(file_name: str, file_path: str, file_hash: str,
+                    tables_data: Union[Dict[str, Any], Iterable[Tuple[str, str, List[Dict[str, Any]]]]],
+                    batch_size: int = TABLE_INSERT_BATCH_SIZE,
+                    progress_callback: Optional[Callable[[int, Optional[int]], None]] = None,
+                    parent_file_id: Optional[int] = None,
+                    sheet_hashes: Optional[Dict[str, str]] = None,
+                    reused_sheets: Optional[Iterable[str]] = None,
+                    table_meta: Optional[Dict[str, Dict[str, Dict[str, Any]]]] = None) -> Optional[int]:
+    """
+    Save Excel file and its tables to the database.
+    
+    ``tables_data`` is either the nested mapping returned by
+    ``excel_parser.extract_all_tables`` or a stream of (sheet, table, rows)
+    tuples such as ``excel_parser.iter_tables``. A stream is consumed as it is
+    written: only the tables of the current sheet (needed for its sheet
+    fingerprint) and one batch of row mappings are held at a time, and each
+    sheet's rows can be freed once they are sent.
+    
+    Tables are written ``batch_size`` at a time in one round trip each: with COPY
+    on PostgreSQL, and with a single executemany ``INSERT`` elsewhere (see
+    ``_bulk_insert``). Tables with more than ``TABLE_CHUNK_THRESHOLD`` rows are
+    split into ExcelTableChunk rows of ``TABLE_CHUNK_SIZE`` records. Each table's
+    column profile (see ``profiling.profile_table``) and its table and sheet
+    fingerprints (see ``excel_parser.fingerprint_table``) are computed and
+    stored alongside it.
+    
+    When ``parent_file_id`` is given the file is saved as the next version of that
+    file. The tables of ``reused_sheets`` are copied from the parent inside the
+    database instead of being passed in ``tables_data``, and parsed tables whose
+    content hash matches the parent's table of the same name are copied as well,
+    keeping their stored profile.
+    
+    Hashes, fingerprints and profiles already computed elsewhere (e.g. by the
+    parse workers in ``ingest.py``) can be passed in ``table_meta`` and are
+    stored as given instead of being recomputed here.
+    
+    Args:
+        file_name: Name to store for the file
+        file_path: Path of the uploaded file on disk
+        file_hash: SHA-256 hash of the file content
+        tables_data: Mapping of sheet name -> table name -> list of row dicts, or an
+            iterable of (sheet name, table name, rows) with each sheet's tables together
+        batch_size: Number of tables sent to the database per INSERT
+        progress_callback: Optional callable receiving (tables_saved, total_tables)
+            after each batch is flushed; total_tables is None when ``tables_data`` is a stream
+        parent_file_id: Optional ID of the previous version of this file
+        sheet_hashes: Optional sheet name -> content hash mapping, in workbook order
+        reused_sheets: Sheets unchanged since the parent version, copied from it
+        table_meta: Optional mapping of sheet name -> table name -> dict with any of
+            'content_hash', 'fingerprint' and 'profile'
+        
+    Returns:
+        The ID of the new ExcelFile record
+    """
+    batch_size = max(1, batch_size)
+    reused_sheets = set(reused_sheets or []) if parent_file_id is not None else set()
+    parsed_tables = (sum(len(tables) for tables in tables_data.values())
+                     if isinstance(tables_data, Mapping) else None)
+    with span('db.save_excel_file', file=file_name) as save_span, get_db_session() as db_session:
         try:
+            version = 1
+            parent_tables = {}
+            reused_counts = {}
+            if parent_file_id is not None:
+                parent = db_session.query(ExcelFile.version).filter(ExcelFile.id == parent_file_id).first()
+                if parent is None:
+                    raise ValueError(f"Previous version {parent_file_id} not found")
+                version = parent.version + 1
+                for table_id, sheet_name, table_name, content_hash in db_session.query(
+                    ExcelTable.id, ExcelTable.sheet_name, ExcelTable.table_name, ExcelTable.content_hash
+                ).filter(ExcelTable.excel_file_id == parent_file_id):
+                    if sheet_name in reused_sheets:
+                        reused_counts[sheet_name] = reused_counts.get(sheet_name, 0) + 1
+                    elif content_hash:
+                        parent_tables[(sheet_name, table_name)] = (table_id, content_hash)
+            
+            total_tables = None if parsed_tables is None else parsed_tables + sum(reused_counts.values())
+            
             # Create ExcelFile record
             excel_file = ExcelFile(
                 file_name=file_name,
                 file_path=file_path,
-                file_hash=file_hash
+                file_hash=file_hash,
+                content_hash=file_hash,
+                version=version,
+                parent_file_id=parent_file_id,
+                sheet_hashes=sheet_hashes
             )
             db_session.add(excel_file)
             db_session.flush()
             
-            # Prepare and add ExcelTable records
-            for sheet_name, tables in tables_data.items():
-                for table_name, table_data in tables.items():
-                    excel_table = ExcelTable(
-                        excel_file_id=excel_file.id,
-                        sheet_name=sheet_name,
-                        table_name=table_name,
-                        data=table_data  # Data will be serialized by SQLAlchemy
-                    )
-                    db_session.add(excel_table)
+            tables_saved = 0
+            batch = []
             
-            db_session.commit()
+            def report(saved: int):
+                nonlocal tables_saved
+                tables_saved += saved
+                if progress_callback:
+                    progress_callback(tables_saved, total_tables)
+            
+            def flush_batch():
+                nonlocal batch
+                if batch:
+                    with span('db.insert', tables=len(batch), rows=sum(m['row_count'] for m in batch)):
+                        _bulk_insert(db_session, ExcelTable, batch)
+                    saved = len(batch)
+                    batch = []
+                    report(saved)
+            
+            # Reused sheets are copied where they sit in workbook order, between the parsed ones
+            sheet_order = {sheet_name: position for position, sheet_name in enumerate(sheet_hashes or {})}
+            pending_reused = sorted(reused_sheets, key=lambda name: sheet_order.get(name, len(sheet_order)))
+            
+            def copy_reused_sheets(before: Optional[str] = None):
+                position = sheet_order.get(before, len(sheet_order)) if before is not None else None
+                while pending_reused and (position is None
+                                          or sheet_order.get(pending_reused[0], len(sheet_order)) < position):
+                    sheet_name = pending_reused.pop(0)
+                    flush_batch()
+                    copy_file_tables(db_session, parent_file_id, excel_file.id, sheet_names=[sheet_name])
+                    report(reused_counts.get(sheet_name, 0))
+            
+            def save_sheet(sheet_name: str, sheet_tables: Dict[str, List[Dict[str, Any]]]):
+                sheet_meta = (table_meta or {}).get(sheet_name, {})
+                table_fingerprints = {
+                    table_name: sheet_meta.get(table_name, {}).get('fingerprint') or fingerprint_table(table_data)
+                    for table_name, table_data in sheet_tables.items()
+                }
+                sheet_fingerprint = fingerprint_sheet(table_fingerprints)
+                copied_tables = False
+                
+                # Insert ExcelTable rows batch by batch
+                for table_name, table_data in sheet_tables.items():
+                    meta = sheet_meta.get(table_name, {})
+                    mapping = _table_mapping(excel_file.id, sheet_name, table_name, table_data,
+                                             meta.get('content_hash'))
+                    previous = parent_tables.get((sheet_name, table_name))
+                    if previous and previous[1] == mapping['content_hash']:
+                        flush_batch()
+                        copy_file_tables(db_session, parent_file_id, excel_file.id, table_ids=[previous[0]])
+                        copied_tables = True
+                        report(1)
+                        continue
+                    
+                    mapping['fingerprint'] = table_fingerprints[table_name]
+                    mapping['sheet_fingerprint'] = sheet_fingerprint
+                    mapping['profile'] = meta['profile'] if 'profile' in meta else _profile_rows(table_data)
+                    if _should_chunk(table_data):
+                        _insert_chunked_table(db_session, mapping)
+                        report(1)
+                        continue
+                    
+                    batch.append(mapping)
+                    if len(batch) >= batch_size:
+                        flush_batch()
+                
+                if copied_tables:
+                    # Tables copied from the parent carry the parent's fingerprint for this sheet
+                    db_session.execute(update(ExcelTable).where(
+                        ExcelTable.excel_file_id == excel_file.id,
+                        ExcelTable.sheet_name == sheet_name
+                    ).values(sheet_fingerprint=sheet_fingerprint))
+            
+            # Collect one sheet's tables at a time; its fingerprint depends on all of them
+            current_sheet, sheet_tables = None, {}
+            for sheet_name, table_name, table_data in _iter_parsed_tables(tables_data):
+                if sheet_name != current_sheet:
+                    if sheet_tables:
+                        save_sheet(current_sheet, sheet_tables)
+                    current_sheet, sheet_tables = sheet_name, {}
+                    copy_reused_sheets(before=sheet_name)
+                if sheet_name not in reused_sheets:
+                    sheet_tables[table_name] = table_data
+            if sheet_tables:
+                save_sheet(current_sheet, sheet_tables)
+            copy_reused_sheets()
+            
+            flush_batch()
+            save_span.set(tables=tables_saved)
+            with span('db.commit'):
+                db_session.commit()
             return excel_file.id
             
         except SQLAlchemyError as e:
             db_session.rollback()
             raise Exception(f"Failed to save Excel file to database: {str(e)}")
 
-def get_excel_file(file_id: int) -> Optional[Dict[str, Any]]:
-    """Retrieve an Excel file and its tables by ID."""
+def _table_rows(db_session, table: ExcelTable) -> List[Dict[str, Any]]:
+    """Return all rows of a table, reassembling chunked tables in row order."""
+    if not table.is_chunked:
+        return table.data
+    chunks = db_session.query(ExcelTableChunk.data).filter(
+        ExcelTableChunk.excel_table_id == table.id
+    ).order_by(ExcelTableChunk.row_offset)
+    return [row for (data,) in chunks for row in data]
+
+def get_excel_file(file_id: int, with_rows: bool = True) -> Optional[Dict[str, Any]]:
+    """
+    Retrieve an Excel file and its tables by ID.
+    
+    Args:
+        file_id: ID of the Excel file
+        with_rows: Load every table's rows; when False the row lists in 'tables'
+            are None and rows can be read on demand with ``iter_table_rows``
+        
+    Returns:
+        dict: id, file_name, file_path, uploaded_at, and per sheet and table name:
+            tables (rows), profiles, table_ids and row_counts
+    """
     with get_db_session() as db_session:
         file = db_session.query(ExcelFile).filter_by(id=file_id).first()
         if not file:
             return None
             
         tables_by_sheet = {}
-        for table in file.tables:
-            tables_by_sheet.setdefault(table.sheet_name, {})[table.table_name] = table.data
+        profiles_by_sheet = {}
+        ids_by_sheet = {}
+        counts_by_sheet = {}
+        if with_rows:
+            tables = file.tables
+        else:
+            tables = db_session.query(
+                ExcelTable.id, ExcelTable.sheet_name, ExcelTable.table_name,
+                ExcelTable.row_count, ExcelTable.profile
+            ).filter(ExcelTable.excel_file_id == file_id).order_by(ExcelTable.id).all()
+        for table in tables:
+            rows = _table_rows(db_session, table) if with_rows else None
+            tables_by_sheet.setdefault(table.sheet_name, {})[table.table_name] = rows
+            profiles_by_sheet.setdefault(table.sheet_name, {})[table.table_name] = table.profile
+            ids_by_sheet.setdefault(table.sheet_name, {})[table.table_name] = table.id
+            counts_by_sheet.setdefault(table.sheet_name, {})[table.table_name] = (
+                len(rows) if rows is not None and table.row_count is None else table.row_count
+            )
             
         return {
             'id': file.id,
             'file_name': file.file_name,
             'file_path': file.file_path,
             'uploaded_at': file.uploaded_at,  # Keep as datetime object
-            'tables': tables_by_sheet
+            'tables': tables_by_sheet,
+            'profiles': profiles_by_sheet,
+            'table_ids': ids_by_sheet,
+            'row_counts': counts_by_sheet
         }
 
+def iter_table_rows(table_id: int, start: int = 0, stop: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Lazily yield rows ``start:stop`` of a stored table.
+    
+    For chunked tables only the chunks overlapping the requested range are read,
+    one at a time, so e.g. ``start=-3`` touches just the last chunk.
+    
+    Args:
+        table_id: ID of the ExcelTable
+        start: Index of the first row; negative values count from the end
+        stop: Index after the last row (default: end of table); negative values count from the end
+        
+    Yields:
+        dict: One row at a time, in table order
+    """
+    with get_db_session() as db_session:
+        table = db_session.query(
+            ExcelTable.id, ExcelTable.is_chunked, ExcelTable.row_count
+        ).filter(ExcelTable.id == table_id).first()
+        if not table:
+            return
+        
+        if not table.is_chunked:
+            (data,) = db_session.query(ExcelTable.data).filter(ExcelTable.id == table_id).one()
+            yield from data[slice(start, stop)]
+            return
+        
+        start, stop, _ = slice(start, stop).indices(table.row_count or 0)
+        if start >= stop:
+            return
+        
+        chunks = db_session.query(
+            ExcelTableChunk.row_offset, ExcelTableChunk.data
+        ).filter(
+            ExcelTableChunk.excel_table_id == table_id,
+            ExcelTableChunk.row_offset < stop,
+            ExcelTableChunk.row_offset + ExcelTableChunk.row_count > start
+        ).order_by(ExcelTableChunk.row_offset).yield_per(1)
+        
+        for row_offset, data in chunks:
+            yield from data[max(start - row_offset, 0):stop - row_offset]
+
+def find_table_id(file_id: int, table_name: str, sheet_name: Optional[str] = None) -> Optional[int]:
+    """Return the ID of a stored table by file, table name and optional sheet name."""
+    with get_db_session() as db_session:
+        query = db_session.query(ExcelTable.id).filter(
+            ExcelTable.excel_file_id == file_id,
+            ExcelTable.table_name == table_name
+        )
+        if sheet_name:
+            query = query.filter(ExcelTable.sheet_name == sheet_name)
+        row = query.order_by(ExcelTable.id).first()
+        return row.id if row else None
+
+def list_excel_tables(file_id: int) -> List[Dict[str, Any]]:
+    """
+    List the tables stored for a file without loading their data.
+    
+    Args:
+        file_id: ID of the Excel file
+        
+    Returns:
+        list: One dict per table with its ID, sheet name, table name, row count,
+            content hash and table/sheet fingerprints, in the order the tables were saved
+    """
+    with get_db_session() as db_session:
+        tables = db_session.query(
+            ExcelTable.id, ExcelTable.sheet_name, ExcelTable.table_name, ExcelTable.row_count,
+            ExcelTable.content_hash, ExcelTable.fingerprint, ExcelTable.sheet_fingerprint
+        ).filter(ExcelTable.excel_file_id == file_id).order_by(ExcelTable.id).all()
+        return [{
+            'id': t.id,
+            'sheet_name': t.sheet_name,
+            'table_name': t.table_name,
+            'row_count': t.row_count,
+            'content_hash': t.content_hash,
+            'fingerprint': t.fingerprint,
+            'sheet_fingerprint': t.sheet_fingerprint
+        } for t in tables]
+
+def get_table_rows(file_id: int, sheet_name: str, table_name: str,
+                   start: int = 0, stop: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    Read a slice of a stored table's rows.
+    
+    Args:
+        file_id: ID of the Excel file
+        sheet_name: Name of the sheet containing the table
+        table_name: Name of the table
+        start: Index of the first row; negative values count from the end (e.g. -3 for the last 3 rows)
+        stop: Index after the last row (default: end of table)
+        
+    Returns:
+        list: The requested rows, or an empty list if the table does not exist
+    """
+    table_id = find_table_id(file_id, table_name, sheet_name)
+    if table_id is None:
+        return []
+    return list(iter_table_rows(table_id, start, stop))
+
+def _filter_rows(rows: Iterable[Dict[str, Any]], filters: Optional[Dict[str, Any]] = None,
+                 columns: Optional[List[str]] = None, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Apply equality filters, column projection and a row limit to rows in Python."""
+    results = []
+    for row in rows:
+        if limit is not None and len(results) >= limit:
+            break
+        if filters and any(row.get(key) != value for key, value in filters.items()):
+            continue
+        results.append({col: row.get(col) for col in columns} if columns else row)
+    return results
+
+def _query_table_postgresql(params: Dict[str, Any], clauses: List[str], filters: Optional[Dict[str, Any]],
+                            columns: Optional[List[str]], limit: Optional[int]) -> List[Dict[str, Any]]:
+    """Run query_table on PostgreSQL by unnesting JSONB arrays."""
+    if filters:
+        # Skip whole tables/chunks that contain no matching row before unnesting them
+        clauses = clauses + ["s.data @> CAST(:table_filter AS jsonb)", "r.elem @> CAST(:row_filter AS jsonb)"]
+        params['table_filter'] = json.dumps([filters])
+        params['row_filter'] = json.dumps(filters)
+
+    if columns:
+        pairs = []
+        for idx, col in enumerate(columns):
+            params[f'col_{idx}'] = col
+            pairs.append(f":col_{idx}, r.elem -> :col_{idx}")
+        projection = f"jsonb_build_object({', '.join(pairs)})"
+    else:
+        projection = "r.elem"
+
+    sql = (
+        f"SELECT {projection} AS row "
+        "FROM excel_tables t "
+        # Rows live either inline in excel_tables.data or in excel_table_chunks
+        "CROSS JOIN LATERAL ("
+        "  SELECT 0 AS row_offset, t.data AS data WHERE NOT t.is_chunked"
+        "  UNION ALL"
+        "  SELECT c.row_offset, c.data FROM excel_table_chunks c WHERE c.excel_table_id = t.id"
+        ") AS s "
+        "CROSS JOIN LATERAL jsonb_array_elements(s.data) WITH ORDINALITY AS r(elem, idx) "
+        f"WHERE {' AND '.join(clauses)} "
+        "ORDER BY t.id, s.row_offset, r.idx"
+    )
+    if limit is not None:
+        sql += " LIMIT :limit"
+        params['limit'] = limit
+
+    with get_db_session() as db_session:
+        return [row for (row,) in db_session.execute(text(sql), params)]
+
+# The SQLite path of query_table uses the -> operator, added in SQLite 3.38
+SQLITE_JSON_MIN_VERSION = (3, 38)
+
+def _json_path(column: str) -> str:
+    """Return a SQLite JSON path selecting a top-level key."""
+    return '$."' + column.replace('"', '\\"') + '"'
+
+def _query_table_sqlite(params: Dict[str, Any], clauses: List[str], filters: Optional[Dict[str, Any]],
+                        columns: Optional[List[str]], limit: Optional[int]) -> List[Dict[str, Any]]:
+    """Run query_table on SQLite by unnesting JSON arrays with json_each."""
+    clauses = list(clauses)
+    for idx, (col, value) in enumerate((filters or {}).items()):
+        params[f'filter_path_{idx}'] = _json_path(col)
+        if value is None:
+            clauses.append(f"json_type(j.value, :filter_path_{idx}) IS 'null'")
+        elif isinstance(value, (dict, list)):
+            clauses.append(f"json_extract(j.value, :filter_path_{idx}) = json(:filter_value_{idx})")
+            params[f'filter_value_{idx}'] = json.dumps(value)
+        else:
+            # json_extract returns SQL values: 2 equals 2.0 as in Python and JSONB, and text never equals a number
+            clauses.append(f"json_extract(j.value, :filter_path_{idx}) = :filter_value_{idx}")
+            params[f'filter_value_{idx}'] = value
+
+    if columns:
+        pairs = []
+        for idx, col in enumerate(columns):
+            params[f'col_{idx}'] = col
+            params[f'col_path_{idx}'] = _json_path(col)
+            pairs.append(f":col_{idx}, j.value -> :col_path_{idx}")
+        projection = f"json_object({', '.join(pairs)})"
+    else:
+        projection = "j.value"
+
+    where = ' AND '.join(clauses)
+    sql = (
+        "SELECT row FROM ("
+        f"  SELECT t.id AS table_id, 0 AS row_offset, j.key AS idx, {projection} AS row"
+        "  FROM excel_tables t, json_each(t.data) j"
+        f"  WHERE NOT t.is_chunked AND {where}"
+        "  UNION ALL"
+        f"  SELECT t.id, c.row_offset, j.key, {projection}"
+        "  FROM excel_tables t JOIN excel_table_chunks c ON c.excel_table_id = t.id, json_each(c.data) j"
+        f"  WHERE {where}"
+        ") ORDER BY table_id, row_offset, idx"
+    )
+    if limit is not None:
+        sql += " LIMIT :limit"
+        params['limit'] = limit
+
+    with get_db_session() as db_session:
+        return [json.loads(row) for (row,) in db_session.execute(text(sql), params)]
+
+def query_table(file_id: int, table_name: str, filters: Optional[Dict[str, Any]] = None,
+                columns: Optional[List[str]] = None, limit: Optional[int] = None,
+                sheet_name: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    Fetch matching rows of a stored table without loading the whole table.
+
+    On PostgreSQL the rows are unnested with ``jsonb_array_elements`` and ``filters``
+    are matched with JSONB containment, first against each table or chunk document
+    and then per row. On SQLite 3.38 or later the rows are unnested with
+    ``json_each``. In both cases filtering, projection and the limit run in SQL;
+    other backends and older SQLite versions fall back to filtering the stored
+    rows in Python. Numbers match regardless of int/float (``2 == 2.0``).
+
+    Args:
+        file_id: ID of the Excel file
+        table_name: Name of the table to query
+        filters: Optional mapping of column name -> value rows must equal
+        columns: Optional list of columns to return (default: all columns)
+        limit: Optional maximum number of rows to return
+        sheet_name: Optional sheet name, for table names used on several sheets
+
+    Returns:
+        list: Matching rows in their original order
+    """
+    params = {'file_id': file_id, 'table_name': table_name}
+    clauses = ["t.excel_file_id = :file_id", "t.table_name = :table_name"]
+    if sheet_name:
+        clauses.append("t.sheet_name = :sheet_name")
+        params['sheet_name'] = sheet_name
+
+    if engine.dialect.name == 'postgresql':
+        return _query_table_postgresql(params, clauses, filters, columns, limit)
+    if engine.dialect.name == 'sqlite' and sqlite3.sqlite_version_info >= SQLITE_JSON_MIN_VERSION:
+        return _query_table_sqlite(params, clauses, filters, columns, limit)
+
+    with get_db_session() as db_session:
+        query = db_session.query(ExcelTable.id).filter(
+            ExcelTable.excel_file_id == file_id,
+            ExcelTable.table_name == table_name
+        )
+        if sheet_name:
+            query = query.filter(ExcelTable.sheet_name == sheet_name)
+        table_ids = [table_id for (table_id,) in query.order_by(ExcelTable.id).all()]
+    rows = (row for table_id in table_ids for row in iter_table_rows(table_id))
+    return _filter_rows(rows, filters, columns, limit)
+
 def list_excel_files() -> List[Dict[str, Any]]:
     """List all Excel files in the database."""
     with get_db_session() as db_session:
-        files = db_session.query(ExcelFile).order_by(ExcelFile.uploaded_at.desc()).all()
+        # Count tables in SQL rather than loading every table's data through f.tables
+        tables_count = db_session.query(
+            ExcelTable.excel_file_id, func.count(ExcelTable.id).label('tables_count')
+        ).group_by(ExcelTable.excel_file_id).subquery()
+        files = db_session.query(
+            ExcelFile.id, ExcelFile.file_name, ExcelFile.file_hash, ExcelFile.uploaded_at,
+            func.coalesce(tables_count.c.tables_count, 0)
+        ).outerjoin(
+            tables_count, tables_count.c.excel_file_id == ExcelFile.id
+        ).order_by(ExcelFile.uploaded_at.desc()).all()
         return [{
-            'id': f.id,
-            'file_name': f.file_name,
-            'uploaded_at': f.uploaded_at,  # Keep as datetime object
-            'tables_count': len(f.tables)
-        } for f in files]
+            'id': file_id,
+            'file_name': file_name,
+            'file_hash': file_hash,
+            'uploaded_at': uploaded_at,  # Keep as datetime object
+            'tables_count': count
+        } for file_id, file_name, file_hash, uploaded_at, count in files]
+
+def _next_file_number(db_session) -> int:
+    """
+    Return the next N for duplicate names of the form ``fileN.ext``.
+    
+    The number is parsed in Python rather than with ``regexp_replace`` so it works
+    on every backend.
+    """
+    names = db_session.query(ExcelFile.file_name).filter(ExcelFile.file_name.like('file%'))
+    numbers = [int(match.group(1)) for (name,) in names if (match := re.match(r'^file(\d+)', name))]
+    return max(numbers, default=0) + 1
+
+def copy_file_tables(db_session, source_file_id: int, target_file_id: int,
+                     sheet_names: Optional[List[str]] = None,
+                     table_ids: Optional[List[int]] = None) -> None:
+    """
+    Copy the tables (and their chunks) of one file to another inside the database.
+    
+    Uses ``INSERT INTO ... SELECT`` so table data never travels through the
+    application. Every ExcelTable/ExcelTableChunk column except the keys is copied.
+    
+    Args:
+        db_session: Active database session
+        source_file_id: ID of the file whose tables are copied
+        target_file_id: ID of the file receiving the copies
+        sheet_names: Optional list restricting the copy to these sheets
+        table_ids: Optional list restricting the copy to these source tables
+    """
+    tables = ExcelTable.__table__
+    chunks = ExcelTableChunk.__table__
+    
+    table_columns = [col for col in tables.columns if col.name not in ('id', 'excel_file_id')]
+    table_select = select(literal(target_file_id, Integer), *table_columns).where(
+        tables.c.excel_file_id == source_file_id
+    ).order_by(tables.c.id)
+    if sheet_names is not None:
+        table_select = table_select.where(tables.c.sheet_name.in_(sheet_names))
+    if table_ids is not None:
+        table_select = table_select.where(tables.c.id.in_(table_ids))
+    db_session.execute(
+        insert(tables).from_select(['excel_file_id'] + [col.name for col in table_columns], table_select)
+    )
+    
+    # Chunks are re-pointed at the copied table with the same sheet and table name
+    source = tables.alias('source')
+    target = tables.alias('target')
+    chunk_columns = [col for col in chunks.columns if col.name not in ('id', 'excel_table_id')]
+    chunk_select = select(target.c.id, *chunk_columns).select_from(
+        chunks.join(source, chunks.c.excel_table_id == source.c.id).join(
+            target,
+            and_(
+                target.c.excel_file_id == target_file_id,
+                target.c.sheet_name == source.c.sheet_name,
+                target.c.table_name == source.c.table_name
+            )
+        )
+    ).where(source.c.excel_file_id == source_file_id, source.c.is_chunked.is_(True))
+    if sheet_names is not None:
+        chunk_select = chunk_select.where(source.c.sheet_name.in_(sheet_names))
+    if table_ids is not None:
+        chunk_select = chunk_select.where(source.c.id.in_(table_ids))
+    db_session.execute(
+        insert(chunks).from_select(['excel_table_id'] + [col.name for col in chunk_columns], chunk_select)
+    )
+
+def _link_or_copy(source_path: str, target_path: str) -> None:
+    """Hardlink ``target_path`` to ``source_path``, copying only if links are unsupported."""
+    if os.path.exists(target_path):
+        raise FileExistsError(f"File already exists: {target_path}")
+    try:
+        os.link(source_path, target_path)
+    except OSError:
+        shutil.copy2(source_path, target_path)
 
 def duplicate_excel_file(file_id: int) -> tuple[bool, str, int]:
     """
     Create a duplicate of an existing Excel file with a new sequential number.
     
+    Table rows are copied server-side and the file on disk is hardlinked rather
+    than copied, so the cost does not depend on the workbook size.
+    
     Args:
         file_id: ID of the file to duplicate
         
     Returns:
         tuple: (success: bool, message: str, new_file_id: int)
     """
+    created_file_path = None
     with get_db_session() as db_session:
         try:
             # Get the file to duplicate
@@ -153,15 +1005,7 @@ def duplicate_excel_file(file_id: int) -> tuple[bool, str, int]:
                 return False, "Original file not found", -1
             
             # Get the next available file number
-            max_file_num = db_session.query(
-                db.func.max(
-                    db.cast(
-                        db.func.regexp_replace(ExcelFile.file_name, r'^file(\d+).*', '\\1'),
-                        db.Integer
-                    )
-                )
-            ).scalar() or 0
-            new_file_num = max_file_num + 1
+            new_file_num = _next_file_number(db_session)
             
             # Create new file name with next sequential number
             file_name_parts = os.path.splitext(original_file.file_name)
@@ -171,38 +1015,33 @@ def duplicate_excel_file(file_id: int) -> tuple[bool, str, int]:
             original_dir = os.path.dirname(original_file.file_path)
             new_file_path = os.path.join(original_dir, new_file_name)
             
-            # Copy the file
-            import shutil
-            shutil.copy2(original_file.file_path, new_file_path)
+            # Share the bytes on disk instead of copying them
+            _link_or_copy(original_file.file_path, new_file_path)
+            created_file_path = new_file_path
             
-            # Create new database record
+            # file_hash is unique, so the duplicate gets one derived from the original's;
+            # content_hash keeps the real hash of the shared bytes for duplicate detection
             new_file = ExcelFile(
                 file_name=new_file_name,
                 file_path=new_file_path,
-                file_hash=calculate_file_hash(open(new_file_path, 'rb').read())
+                file_hash=hashlib.sha256(f"{original_file.file_hash}:{new_file_name}".encode()).hexdigest(),
+                content_hash=original_file.content_hash or original_file.file_hash,
+                version=original_file.version,
+                sheet_hashes=original_file.sheet_hashes
             )
             db_session.add(new_file)
             db_session.flush()  # Get the new file ID
             
-            # Duplicate all tables and their data
-            original_tables = db_session.query(ExcelTable).filter(
-                ExcelTable.excel_file_id == file_id
-            ).all()
-            
-            for table in original_tables:
-                new_table = ExcelTable(
-                    excel_file_id=new_file.id,
-                    sheet_name=table.sheet_name,
-                    table_name=table.table_name,
-                    data=table.data  # This should be a deep copy if it's a mutable object
-                )
-                db_session.add(new_table)
+            # Duplicate all tables and their data without loading them
+            copy_file_tables(db_session, file_id, new_file.id)
             
             db_session.commit()
             return True, f"File duplicated successfully as {new_file_name}", new_file.id
             
         except Exception as e:
             db_session.rollback()
+            if created_file_path and os.path.exists(created_file_path):
+                os.remove(created_file_path)
             import traceback
             traceback.print_exc()
             return False, f"Error duplicating file: {str(e)}", -1
@@ -305,30 +1144,39 @@ def save_chat_history(file_id: int, messages: list, sheet_name: str = None) -> b
             
             # Create a set of existing message content hashes
             for msg in existing_messages:
-                msg_hash = hash((msg.content, str(msg.role), str(msg.sheet_name)))
+                msg_hash = hash((msg.content, msg.role.value, msg.sheet_name))
                 existing_hashes.add(msg_hash)
             
             # Prepare new messages with proper enum values
             chat_messages = []
             for msg in messages:
                 try:
-                    # Skip if message is already in the database
-                    msg_hash = hash((msg["content"], msg["role"], sheet_name))
-                    if msg_hash in existing_hashes:
-                        continue
-                        
                     # Convert string role to MessageRole enum
                     if isinstance(msg["role"], str):
                         role_enum = MessageRole[msg["role"].upper()]
                     else:
                         role_enum = msg["role"]
                     
+                    # Skip if message is already in the database (the chat page saves the whole conversation)
+                    msg_hash = hash((msg["content"], role_enum.value, sheet_name))
+                    if msg_hash in existing_hashes:
+                        continue
+                    existing_hashes.add(msg_hash)
+                    
+                    # The chat page stores timestamps as 'YYYY-MM-DD HH:MM:SS' strings
+                    created_at = msg.get("created_at")
+                    if isinstance(created_at, str):
+                        try:
+                            created_at = datetime.fromisoformat(created_at)
+                        except ValueError:
+                            created_at = None
+                    
                     chat_messages.append({
                         "excel_file_id": file_id,
                         "sheet_name": sheet_name,
                         "role": role_enum,
                         "content": msg["content"],
-                        "created_at": msg.get("created_at") or datetime.utcnow()
+                        "created_at": created_at or datetime.utcnow()
                     })
                 except (KeyError, AttributeError) as e:
                     print(f"Warning: Invalid message format, skipping: {e}")
@@ -346,57 +1194,110 @@ def save_chat_history(file_id: int, messages: list, sheet_name: str = None) -> b
             print(f"Error saving chat history: {str(e)}")
             return False
 
+def _remove_upload(file_path: str) -> None:
+    """Delete an uploaded file and its directory if that leaves it empty."""
+    if os.path.exists(file_path):
+        os.remove(file_path)
+        
+        # Try to remove the directory if it's empty
+        directory = os.path.dirname(file_path)
+        if directory and os.path.exists(directory) and not os.listdir(directory):
+            os.rmdir(directory)
+
+def _file_cleanup_worker() -> None:
+    """Remove queued upload files one at a time, logging failures."""
+    while True:
+        file_path = _file_cleanup_queue.get()
+        try:
+            _remove_upload(file_path)
+        except Exception as e:
+            logging.error(f"Error removing file {file_path}: {str(e)}")
+        finally:
+            _file_cleanup_queue.task_done()
+
+_file_cleanup_queue: "queue.Queue[str]" = queue.Queue()
+_file_cleanup_thread: Optional[threading.Thread] = None
+_file_cleanup_lock = threading.Lock()
+
+def schedule_file_cleanup(file_paths: Iterable[str]) -> None:
+    """
+    Queue uploaded files for removal by a background thread.
+    
+    Call only after the transaction deleting their rows has committed. Files still
+    queued when the process exits are left on disk for the maintenance job.
+    """
+    global _file_cleanup_thread
+    with _file_cleanup_lock:
+        if _file_cleanup_thread is None or not _file_cleanup_thread.is_alive():
+            _file_cleanup_thread = threading.Thread(target=_file_cleanup_worker, name='file-cleanup', daemon=True)
+            _file_cleanup_thread.start()
+    for file_path in file_paths:
+        if file_path:
+            _file_cleanup_queue.put(file_path)
+
+def wait_for_file_cleanup() -> None:
+    """Block until every queued file removal has been processed."""
+    _file_cleanup_queue.join()
+
+def delete_excel_files(file_ids: Iterable[int], batch_size: int = FILE_DELETE_BATCH_SIZE) -> Tuple[int, List[str]]:
+    """
+    Delete many Excel files in batches, leaving their tables, chunks and chat
+    history to ``ON DELETE CASCADE``.
+    
+    Each batch is one transaction; the files on disk are queued for background
+    removal once it has committed.
+    
+    Args:
+        file_ids: IDs of the files to delete
+        batch_size: Number of files deleted per transaction
+        
+    Returns:
+        tuple: (number of files deleted, paths queued for removal)
+    """
+    file_ids = list(dict.fromkeys(file_ids))
+    batch_size = max(1, batch_size)
+    deleted_count = 0
+    removed_paths = []
+    
+    for start in range(0, len(file_ids), batch_size):
+        batch = file_ids[start:start + batch_size]
+        with get_db_session() as db_session:
+            batch_paths = [
+                file_path for (file_path,) in
+                db_session.query(ExcelFile.file_path).filter(ExcelFile.id.in_(batch))
+            ]
+            result = db_session.execute(
+                delete(ExcelFile).where(ExcelFile.id.in_(batch)).execution_options(synchronize_session=False)
+            )
+            deleted_count += result.rowcount
+        
+        # The batch has committed, so its files can go
+        schedule_file_cleanup(batch_paths)
+        removed_paths.extend(batch_paths)
+    
+    return deleted_count, removed_paths
+
 def delete_excel_file(file_id: int) -> tuple[bool, str]:
     """
     Delete an Excel file and its associated data from both database and file system.
     
+    The database rows are removed in one transaction; the file on disk is removed
+    in the background after it commits.
+    
     Args:
         file_id: ID of the file to delete
         
     Returns:
         tuple: (success: bool, message: str)
     """
-    with get_db_session() as db_session:
-        try:
-            # Start a transaction
-            file_to_delete = db_session.query(ExcelFile).filter(ExcelFile.id == file_id).first()
-            if not file_to_delete:
-                return False, "File not found"
-                
-            file_path = file_to_delete.file_path
-            
-            # Delete associated chat history first
-            db_session.query(ChatHistory).filter(ChatHistory.excel_file_id == file_id).delete()
-            
-            # Delete associated tables next
-            db_session.query(ExcelTable).filter(ExcelTable.excel_file_id == file_id).delete()
-            
-            # Delete the file record from database
-            db_session.delete(file_to_delete)
-            
-            # If database deletion was successful, delete the actual file
-            try:
-                if os.path.exists(file_path):
-                    os.remove(file_path)
-                    
-                    # Try to remove the directory if it's empty
-                    directory = os.path.dirname(file_path)
-                    if os.path.exists(directory) and not os.listdir(directory):
-                        os.rmdir(directory)
-                
-                db_session.commit()
-                return True, "File deleted successfully"
-                
-            except Exception as e:
-                # If file operations fail, rollback the transaction
-                db_session.rollback()
-                import logging
-                logging.error(f"Error during file operations: {str(e)}")
-                return False, f"Error during file operations: {str(e)}"
-                
-        except SQLAlchemyError as e:
-            db_session.rollback()
-            return False, f"Database error: {str(e)}"
-        except Exception as e:
-            db_session.rollback()
-            return False, f"Unexpected error: {str(e)}"
\ No newline at end of file
+    try:
+        deleted_count, _ = delete_excel_files([file_id])
+        if not deleted_count:
+            return False, "File not found"
+        return True, "File deleted successfully"
+        
+    except SQLAlchemyError as e:
+        return False, f"Database error: {str(e)}"
+    except Exception as e:
+        return False, f"Unexpected error: {str(e)}"
+
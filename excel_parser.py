@@ -1,16 +1,29 @@
 import os
+import math
+import json
 import hashlib
 import re
-import openpyxl
+import zipfile
+import posixpath
+import xml.etree.ElementTree as ET
 from datetime import datetime
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, Iterator, Tuple
 from pathlib import Path
 from serializers import serialize_data
+from tracing import span
+
+# Directory uploaded workbooks are stored in
+UPLOAD_FOLDER = os.getenv('UPLOAD_FOLDER', 'excel_uploads')
 
 def calculate_file_hash(file_content: bytes) -> str:
     """Calculate SHA-256 hash of file content."""
     return hashlib.sha256(file_content).hexdigest()
 
+def calculate_table_hash(rows: List[Dict[str, Any]]) -> str:
+    """Calculate SHA-256 hash of a table's rows in their stored JSON form."""
+    payload = json.dumps(rows, separators=(',', ':'), ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
 def extract_tables_from_sheet(sheet) -> Dict[str, List[Dict]]:
     """Extract tables from a single worksheet."""
     tables = {}
@@ -24,12 +37,15 @@ def extract_tables_from_sheet(sheet) -> Dict[str, List[Dict]]:
             continue
             
         headers = [str(h) if h is not None else "" for h in rows[0]]
-        table_data = [dict(zip(headers, (serialize_data(cell) for cell in row))) 
-                     for row in rows[1:]]
+        with span('excel.serialize', table=table.name, rows=len(rows) - 1):
+            table_data = [dict(zip(headers, (serialize_data(cell) for cell in row))) 
+                         for row in rows[1:]]
         tables[table.name] = table_data
 
     # Process implicit tables (data between empty rows)
-    all_values = list(sheet.values)
+    with span('excel.read_values') as read_span:
+        all_values = list(sheet.values)
+        read_span.set(rows=len(all_values))
     table_starts = [0] + [i + 1 for i, row in enumerate(all_values) 
                          if all(cell is None for cell in row)]
     
@@ -40,8 +56,9 @@ def extract_tables_from_sheet(sheet) -> Dict[str, List[Dict]]:
             continue
             
         headers = [str(h) if h is not None else f"column_{i+1}" for i, h in enumerate(chunk[0])]
-        table_data = [dict(zip(headers, (serialize_data(cell) for cell in row))) 
-                     for row in chunk[1:] if any(cell is not None for cell in row)]
+        with span('excel.serialize', rows=len(chunk) - 1):
+            table_data = [dict(zip(headers, (serialize_data(cell) for cell in row))) 
+                         for row in chunk[1:] if any(cell is not None for cell in row)]
         
         if table_data:  # Only add non-empty tables
             table_name = f"Table_{len(tables) + 1}"
@@ -49,37 +66,250 @@ def extract_tables_from_sheet(sheet) -> Dict[str, List[Dict]]:
     
     return tables
 
-def extract_all_tables(file_path: str) -> Dict[str, Dict[str, List[Dict]]]:
-    """Extract all tables from all sheets in an Excel file."""
-    try:
-        workbook = openpyxl.load_workbook(file_path, data_only=True)
-        all_tables = {}
-        
-        for sheet_name in workbook.sheetnames:
-            sheet = workbook[sheet_name]
-            tables = extract_tables_from_sheet(sheet)
-            if tables:  # Only add sheets that have tables
-                all_tables[sheet_name] = tables
-                
-        return all_tables
+def iter_tables(file_path: str, sheet_names: Optional[List[str]] = None) -> Iterator[Tuple[str, str, List[Dict]]]:
+    """
+    Lazily extract the tables of an Excel file, one sheet at a time.
+    
+    Only the rows of the sheet being extracted are held, so the stream can be
+    passed straight to ``database.save_excel_file`` without building the
+    mapping of every table in the workbook first.
+    
+    Args:
+        file_path: Path of the workbook
+        sheet_names: Optional list restricting extraction to these sheets
         
+    Yields:
+        tuple: (sheet name, table name, list of row dicts), in workbook order
+    """
+    # Imported here so that hashing and fingerprinting do not load openpyxl
+    import openpyxl
+    try:
+        with span('excel.load_workbook', bytes=os.path.getsize(file_path)) as load_span:
+            workbook = openpyxl.load_workbook(file_path, data_only=True)
+            load_span.set(sheets=len(workbook.sheetnames))
     except Exception as e:
         raise Exception(f"Error processing Excel file: {str(e)}")
+    
+    for sheet_name in workbook.sheetnames:
+        if sheet_names is not None and sheet_name not in sheet_names:
+            continue
+        try:
+            with span('excel.extract_sheet', sheet=sheet_name) as sheet_span:
+                tables = extract_tables_from_sheet(workbook[sheet_name])
+                sheet_span.set(tables=len(tables), rows=sum(len(rows) for rows in tables.values()))
+        except Exception as e:
+            raise Exception(f"Error processing Excel file: {str(e)}")
+        while tables:
+            # Hand each table over and drop the parser's reference to it
+            table_name = next(iter(tables))
+            yield sheet_name, table_name, tables.pop(table_name)
 
-def save_uploaded_file(uploaded_file, upload_folder: str) -> tuple:
+def extract_all_tables(file_path: str, sheet_names: Optional[List[str]] = None) -> Dict[str, Dict[str, List[Dict]]]:
     """
-    Save uploaded file to disk and return its path and hash.
-    Preserves the original filename, adds a timestamp, and prevents duplicates.
+    Extract all tables from the sheets of an Excel file.
+    
+    Args:
+        file_path: Path of the workbook
+        sheet_names: Optional list restricting extraction to these sheets
+        
+    Returns:
+        dict: Mapping of sheet name -> table name -> list of row dicts, for sheets with tables
+    """
+    all_tables = {}
+    for sheet_name, table_name, rows in iter_tables(file_path, sheet_names):
+        all_tables.setdefault(sheet_name, {})[table_name] = rows
+    return all_tables
+
+def _normalize_cell(value) -> str:
+    """
+    Canonical text form of a cell value for fingerprinting.
+    
+    Values are tagged with their kind so that the number 1 and the text "1" differ,
+    while formatting-only differences do not: integral floats equal ints (1.0 == 1),
+    float noise beyond 15 significant digits is dropped, surrounding whitespace is
+    stripped from text, and empty text equals an empty cell.
+    """
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 'b:1' if value else 'b:0'
+    if isinstance(value, int):
+        return f"n:{value}"
+    if isinstance(value, float):
+        if not math.isfinite(value):
+            return '' if math.isnan(value) else f"n:{value}"
+        if value.is_integer():
+            return f"n:{int(value)}"
+        return f"n:{float(f'{value:.15g}')!r}"
+    text = str(value).strip()
+    return f"s:{text}" if text else ''
+
+def fingerprint_table(rows: List[Dict[str, Any]]) -> str:
+    """
+    Stable fingerprint of a table's content over normalized cell values.
+    
+    Two extractions of the same data yield the same fingerprint even if the
+    workbooks differ in formatting, styles, shared-string layout or cell
+    positions, so caches keyed on it stay valid across uploads.
+    
+    Args:
+        rows: Table rows as a list of dicts (column header -> value)
+        
+    Returns:
+        str: SHA-256 hex digest
+    """
+    digest = hashlib.sha256()
+    for row in rows:
+        digest.update('\x1f'.join(
+            f"{str(column).strip()}={_normalize_cell(value)}" for column, value in row.items()
+        ).encode('utf-8'))
+        digest.update(b'\x1e')
+    return digest.hexdigest()
+
+def fingerprint_sheet(table_fingerprints: Dict[str, str]) -> str:
+    """
+    Fingerprint of a sheet from the fingerprints of its tables, in sheet order.
+    
+    Args:
+        table_fingerprints: Mapping of table name -> table fingerprint
+        
+    Returns:
+        str: SHA-256 hex digest
     """
+    digest = hashlib.sha256()
+    for table_name, table_fingerprint in table_fingerprints.items():
+        digest.update(f"{table_name}\x1f{table_fingerprint}\x1e".encode('utf-8'))
+    return digest.hexdigest()
+
+_MAIN_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+_REL_NS = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+_PACKAGE_REL_NS = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+
+def _read_relationships(archive: zipfile.ZipFile, part_path: str) -> Dict[str, str]:
+    """Return relationship ID -> target part path for a part of an OOXML package."""
+    directory, name = posixpath.split(part_path)
+    rels_path = posixpath.join(directory, '_rels', f"{name}.rels")
+    if rels_path not in archive.namelist():
+        return {}
+    targets = {}
+    for rel in ET.fromstring(archive.read(rels_path)).iter(f"{_PACKAGE_REL_NS}Relationship"):
+        if rel.get('TargetMode') == 'External':
+            continue
+        target = rel.get('Target', '')
+        if target.startswith('/'):
+            targets[rel.get('Id')] = target.lstrip('/')
+        else:
+            targets[rel.get('Id')] = posixpath.normpath(posixpath.join(directory, target))
+    return targets
+
+def _read_shared_strings(archive: zipfile.ZipFile) -> List[str]:
+    """Return the workbook's shared string table."""
+    if 'xl/sharedStrings.xml' not in archive.namelist():
+        return []
+    strings = []
+    with archive.open('xl/sharedStrings.xml') as source:
+        for _, element in ET.iterparse(source):
+            if element.tag == f"{_MAIN_NS}si":
+                strings.append(''.join(t.text or '' for t in element.iter(f"{_MAIN_NS}t")))
+                element.clear()
+    return strings
+
+def _read_cell_formats(archive: zipfile.ZipFile) -> List[str]:
+    """Return the number format of each cell style index (openpyxl uses it to recognize dates)."""
+    if 'xl/styles.xml' not in archive.namelist():
+        return []
+    styles = ET.fromstring(archive.read('xl/styles.xml'))
+    custom_formats = {
+        num_fmt.get('numFmtId'): num_fmt.get('formatCode', '')
+        for num_fmt in styles.iter(f"{_MAIN_NS}numFmt")
+    }
+    cell_xfs = styles.find(f"{_MAIN_NS}cellXfs")
+    if cell_xfs is None:
+        return []
+    return [
+        f"{xf.get('numFmtId', '0')}:{custom_formats.get(xf.get('numFmtId', '0'), '')}"
+        for xf in cell_xfs.findall(f"{_MAIN_NS}xf")
+    ]
+
+def calculate_sheet_hashes(file_path: str) -> Optional[Dict[str, str]]:
+    """
+    Hash the content of each worksheet of an .xlsx file without loading it with openpyxl.
+    
+    Each sheet's XML is streamed and every cell contributes its reference, type,
+    value and number format. Shared strings are resolved and style indexes are
+    replaced by the number format they point to, so edits to other sheets (which
+    renumber the shared string and style tables) do not change a sheet's hash.
+    The definitions of the sheet's Excel tables are included as well.
+    
+    Args:
+        file_path: Path of the workbook
+        
+    Returns:
+        dict: Mapping of sheet name -> SHA-256 hex digest, in workbook order, or
+            None if the file is not a zip-based workbook (e.g. legacy .xls)
+    """
+    try:
+        archive = zipfile.ZipFile(file_path)
+    except zipfile.BadZipFile:
+        return None
+    
+    with archive:
+        try:
+            workbook = ET.fromstring(archive.read('xl/workbook.xml'))
+        except KeyError:
+            return None
+        workbook_rels = _read_relationships(archive, 'xl/workbook.xml')
+        shared_strings = _read_shared_strings(archive)
+        cell_formats = _read_cell_formats(archive)
+        
+        sheet_hashes = {}
+        for sheet in workbook.iter(f"{_MAIN_NS}sheet"):
+            sheet_path = workbook_rels.get(sheet.get(f"{_REL_NS}id"))
+            if not sheet_path or sheet_path not in archive.namelist():
+                continue
+            
+            digest = hashlib.sha256()
+            with archive.open(sheet_path) as source:
+                for _, element in ET.iterparse(source):
+                    if element.tag == f"{_MAIN_NS}row":
+                        element.clear()
+                    if element.tag != f"{_MAIN_NS}c":
+                        continue
+                    cell_type = element.get('t', 'n')
+                    value = element.findtext(f"{_MAIN_NS}v")
+                    if cell_type == 's' and value is not None:
+                        value = shared_strings[int(value)]
+                    elif cell_type == 'inlineStr':
+                        value = ''.join(t.text or '' for t in element.iter(f"{_MAIN_NS}t"))
+                    style = element.get('s')
+                    number_format = cell_formats[int(style)] if style and int(style) < len(cell_formats) else ''
+                    digest.update(
+                        f"{element.get('r', '')}\x1f{cell_type}\x1f{number_format}\x1f{value}\x1e".encode('utf-8')
+                    )
+                    element.clear()
+            
+            # Defined tables change how the sheet is split into tables
+            for target in sorted(_read_relationships(archive, sheet_path).values()):
+                if target.startswith('xl/tables/') and target in archive.namelist():
+                    digest.update(archive.read(target))
+            
+            sheet_hashes[sheet.get('name')] = digest.hexdigest()
+        return sheet_hashes
+
+def safe_file_stem(original_name: str) -> tuple:
+    """Return the sanitized (base name, extension) used for stored copies of an upload."""
+    safe_name = re.sub(r'[^\w\-. ]', '_', os.path.basename(original_name))
+    return os.path.splitext(safe_name)
+
+def _unique_upload_path(upload_folder: str, original_name: str) -> str:
+    """Return a free path in upload_folder for original_name, with a timestamp added."""
     os.makedirs(upload_folder, exist_ok=True)
     
     # Get the original filename and create a safe version
-    original_name = uploaded_file.name
-    safe_name = re.sub(r'[^\w\-. ]', '_', original_name)
+    base_name, ext = safe_file_stem(original_name)
     
     # Add timestamp to the filename (before the extension)
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    base_name, ext = os.path.splitext(safe_name)
     safe_name = f"{base_name}_{timestamp}{ext}"
     
     # Check if file already exists and create a unique name if needed
@@ -91,12 +321,39 @@ def save_uploaded_file(uploaded_file, upload_folder: str) -> tuple:
         file_path = os.path.join(upload_folder, f"{base_name}_{timestamp}_{counter}{ext}")
         counter += 1
     
+    return file_path
+
+def save_uploaded_file(uploaded_file, upload_folder: str) -> tuple:
+    """
+    Save uploaded file to disk and return its path and hash.
+    Preserves the original filename, adds a timestamp, and prevents duplicates.
+    """
+    file_path = _unique_upload_path(upload_folder, uploaded_file.name)
+    
     # Save the file
     file_content = uploaded_file.getvalue()
-    with open(file_path, "wb") as f:
-        f.write(file_content)
+    with span('file.save', bytes=len(file_content)):
+        with open(file_path, "wb") as f:
+            f.write(file_content)
     
     # Calculate file hash from the content
-    file_hash = calculate_file_hash(file_content)
+    with span('file.hash', bytes=len(file_content)):
+        file_hash = calculate_file_hash(file_content)
     
     return file_path, file_hash
+
+def save_local_file(source_path: str, upload_folder: str, chunk_size: int = 1024 * 1024) -> tuple:
+    """
+    Copy a workbook from the local filesystem into the upload folder.
+    Uses the same naming as save_uploaded_file and hashes the content while copying.
+    
+    Returns:
+        tuple: (file_path, file_hash)
+    """
+    file_path = _unique_upload_path(upload_folder, source_path)
+    digest = hashlib.sha256()
+    with open(source_path, "rb") as source, open(file_path, "wb") as target:
+        for block in iter(lambda: source.read(chunk_size), b""):
+            digest.update(block)
+            target.write(block)
+    return file_path, digest.hexdigest()
@@ -0,0 +1,107 @@
+"""
+Import-time budget check for the application's entry-point modules.
+
+Imports each module in a fresh interpreter with ``python -X importtime`` and
+fails when its cumulative import time exceeds the budget, or when it loads a
+module that is meant to be imported lazily (e.g. ``database`` must not pull in
+pandas, ``ai_utils`` must not pull in openai). Each module is measured several
+times and the fastest run is compared, to keep the check stable on busy machines.
+
+Usage:
+    python import_budget.py
+    python import_budget.py --scale 2          # slower machine
+    python import_budget.py --runs 5 --verbose
+"""
+import argparse
+import os
+import subprocess
+import sys
+from typing import Dict, List, Any, Tuple
+
+# Scale factor for all budgets, e.g. 2 on slow CI runners
+IMPORT_BUDGET_SCALE = float(os.getenv('IMPORT_BUDGET_SCALE', '1'))
+
+# Cumulative import time budget (ms) and modules that must not be loaded, per entry point
+BUDGETS = {
+    'adora': {'budget_ms': 100, 'forbidden': ['database', 'pandas', 'sqlalchemy', 'streamlit', 'openai']},
+    'excel_parser': {'budget_ms': 100, 'forbidden': ['openpyxl', 'pandas']},
+    'database': {'budget_ms': 800, 'forbidden': ['pandas', 'openpyxl', 'streamlit', 'openai']},
+    'ai_utils': {'budget_ms': 900, 'forbidden': ['openai', 'langchain', 'streamlit']},
+    'llm_providers': {'budget_ms': 100, 'forbidden': ['openai', 'requests', 'pandas']},
+}
+
+
+def measure_import(module: str) -> Tuple[float, List[str]]:
+    """
+    Import a module in a fresh interpreter with ``-X importtime``.
+
+    Returns:
+        tuple: (cumulative import time of the module in ms, names of all modules it loaded)
+    """
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr.strip()[-2000:]}")
+
+    # Lines look like "import time:  self [us] | cumulative | <indent>name" and are
+    # printed children first, so a top-level entry closes the block of its imports.
+    block = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = line.split('|', 2)
+        if not cumulative.strip().isdigit():
+            continue  # header line
+        block.append(name.strip())
+        if name.startswith(' ') and not name.startswith('  '):
+            if name.strip() == module:
+                return int(cumulative) / 1000, block
+            block = []
+    raise RuntimeError(f"no import time reported for {module}")
+
+
+def check_module(module: str, spec: Dict[str, Any], runs: int, scale: float) -> Dict[str, Any]:
+    """Measure a module ``runs`` times and compare the fastest run with its budget."""
+    timings = []
+    loaded = []
+    for _ in range(max(1, runs)):
+        elapsed_ms, loaded = measure_import(module)
+        timings.append(elapsed_ms)
+
+    budget_ms = spec['budget_ms'] * scale
+    loaded_roots = {name.split('.')[0] for name in loaded}
+    forbidden = sorted(name for name in spec.get('forbidden', []) if name in loaded_roots)
+    return {
+        'module': module,
+        'elapsed_ms': min(timings),
+        'budget_ms': budget_ms,
+        'forbidden': forbidden,
+        'ok': min(timings) <= budget_ms and not forbidden
+    }
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Check the import-time budget of the entry-point modules")
+    arg_parser.add_argument("modules", nargs="*", default=list(BUDGETS), help="Modules to check (default: all)")
+    arg_parser.add_argument("--runs", type=int, default=3, help="Measurements per module; the fastest counts")
+    arg_parser.add_argument("--scale", type=float, default=IMPORT_BUDGET_SCALE, help="Multiply all budgets")
+    arg_parser.add_argument("--verbose", action="store_true", help="List every module each import loads")
+    args = arg_parser.parse_args()
+
+    failed = False
+    for module in args.modules:
+        if module not in BUDGETS:
+            arg_parser.error(f"no budget for {module}; known: {', '.join(BUDGETS)}")
+        result = check_module(module, BUDGETS[module], args.runs, args.scale)
+        status = "ok" if result['ok'] else "FAIL"
+        print(f"[{status:>4}] {module}: {result['elapsed_ms']:.0f} ms (budget {result['budget_ms']:.0f} ms)")
+        if result['forbidden']:
+            print(f"       loads {', '.join(result['forbidden'])}, which should be imported lazily")
+        if args.verbose:
+            _, loaded = measure_import(module)
+            print("       " + ", ".join(loaded))
+        failed = failed or not result['ok']
+
+    sys.exit(1 if failed else 0)
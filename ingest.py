@@ -0,0 +1,305 @@
+"""
+Batch ingestion of many workbooks.
+
+Workbooks are parsed in parallel worker processes (table extraction, sheet
+hashes, fingerprints and column profiles). The parsed results go through a
+bounded queue to a single writer thread that saves them with
+``database.save_excel_file``, so parsing scales with the number of cores while
+database writes stay sequential and only a bounded number of parsed workbooks
+is held in memory at a time.
+
+Usage:
+    python ingest.py month_end/*.xlsx --workers 8
+    python ingest.py month_end/            # every .xlsx/.xls below the directory
+"""
+import argparse
+import glob
+import hashlib
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from typing import Dict, List, Any, Optional, Callable, Iterable
+
+import database as db
+import excel_parser as parser
+from profiling import profile_table
+
+# Number of parse worker processes (default: one per core)
+INGEST_WORKERS = int(os.getenv('INGEST_WORKERS', '0')) or os.cpu_count() or 1
+# Parsed workbooks waiting for the database writer before parsing is throttled
+INGEST_QUEUE_SIZE = int(os.getenv('INGEST_QUEUE_SIZE', '4'))
+
+EXCEL_EXTENSIONS = ('.xlsx', '.xls')
+
+def collect_files(paths: Iterable[str]) -> List[str]:
+    """
+    Expand files, glob patterns and directories into a sorted list of workbooks.
+
+    Directories are searched recursively; Excel lock files (``~$...``) are skipped.
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                files.extend(os.path.join(root, name) for name in names)
+        elif glob.has_magic(path):
+            files.extend(glob.glob(path, recursive=True))
+        else:
+            files.append(path)
+    return sorted({
+        f for f in files
+        if f.lower().endswith(EXCEL_EXTENSIONS) and not os.path.basename(f).startswith('~$')
+    })
+
+def _hash_file(file_path: str, chunk_size: int = 1024 * 1024) -> str:
+    """SHA-256 of a file's content, read in chunks."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(chunk_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def build_table_meta(tables_data: Dict[str, Dict[str, List[Dict]]]) -> Dict[str, Dict[str, Dict[str, Any]]]:
+    """
+    Compute the per-table content hash, fingerprint and column profile that
+    ``database.save_excel_file`` accepts as ``table_meta``.
+    """
+    table_meta = {}
+    for sheet_name, tables in tables_data.items():
+        for table_name, rows in tables.items():
+            meta = {
+                'content_hash': parser.calculate_table_hash(rows),
+                'fingerprint': parser.fingerprint_table(rows)
+            }
+            try:
+                meta['profile'] = profile_table(rows)
+            except Exception as e:
+                print(f"Warning: could not profile {sheet_name}/{table_name}: {str(e)}")
+                meta['profile'] = None
+            table_meta.setdefault(sheet_name, {})[table_name] = meta
+    return table_meta
+
+def parse_workbook(file_path: str) -> Dict[str, Any]:
+    """
+    Parse one workbook and precompute everything the database writer needs.
+    Runs in a worker process.
+
+    Returns:
+        dict: tables_data, sheet_hashes, table_meta and parse_s (seconds)
+    """
+    started = time.perf_counter()
+    tables_data = parser.extract_all_tables(file_path)
+    return {
+        'tables_data': tables_data,
+        'sheet_hashes': parser.calculate_sheet_hashes(file_path),
+        'table_meta': build_table_meta(tables_data),
+        'parse_s': time.perf_counter() - started
+    }
+
+def _discard(report: Dict[str, Any]):
+    """Remove the staged copy of a workbook that was not saved."""
+    if report.get('discard_on_failure') and report.get('file_path') and os.path.exists(report['file_path']):
+        try:
+            os.remove(report['file_path'])
+        except OSError as e:
+            print(f"Warning: could not remove {report['file_path']}: {str(e)}")
+
+def _stage(report: Dict[str, Any], copy_to_uploads: bool, upload_folder: str) -> bool:
+    """Copy (or hash in place) one workbook and skip it if it is already stored."""
+    try:
+        if copy_to_uploads:
+            report['file_path'], report['file_hash'] = parser.save_local_file(report['source'], upload_folder)
+        else:
+            report['file_path'], report['file_hash'] = report['source'], _hash_file(report['source'])
+
+        is_duplicate, message = db.is_duplicate_file(report['file_hash'])
+        if is_duplicate:
+            report.update(status='duplicate', error=message)
+            _discard(report)
+            return False
+        return True
+    except Exception as e:
+        report.update(status='error', error=f"Could not stage file: {str(e)}")
+        _discard(report)
+        return False
+
+def _write_parsed(write_queue: queue.Queue, finished_queue: queue.Queue):
+    """Database writer: save parsed workbooks one at a time until a None sentinel arrives."""
+    while True:
+        item = write_queue.get()
+        if item is None:
+            return
+        report, parsed = item
+        started = time.perf_counter()
+        try:
+            tables_data = parsed['tables_data']
+            if not tables_data:
+                report.update(status='no_tables', error="No tables found in the Excel file.")
+            else:
+                # Re-check: an identical workbook may have been saved earlier in this batch
+                is_duplicate, message = db.is_duplicate_file(report['file_hash'])
+                if is_duplicate:
+                    report.update(status='duplicate', error=message)
+                else:
+                    report['file_id'] = db.save_excel_file(
+                        file_name=os.path.basename(report['file_path']),
+                        file_path=report['file_path'],
+                        file_hash=report['file_hash'],
+                        tables_data=tables_data,
+                        sheet_hashes=parsed['sheet_hashes'],
+                        table_meta=parsed['table_meta']
+                    )
+                    report.update(
+                        status='saved',
+                        tables=sum(len(tables) for tables in tables_data.values())
+                    )
+        except Exception as e:
+            report.update(status='error', error=str(e))
+        finally:
+            report['save_s'] = time.perf_counter() - started
+            if report['status'] != 'saved':
+                _discard(report)
+            finished_queue.put(report)
+
+def ingest_files(paths: List[str], workers: int = INGEST_WORKERS, copy_to_uploads: bool = True,
+                 upload_folder: str = parser.UPLOAD_FOLDER, queue_size: int = INGEST_QUEUE_SIZE,
+                 discard_failed: Optional[bool] = None,
+                 progress_callback: Optional[Callable[[int, int, Dict[str, Any]], None]] = None) -> List[Dict[str, Any]]:
+    """
+    Ingest many workbooks: parse in parallel processes, save through one writer thread.
+
+    Args:
+        paths: Workbook paths to ingest
+        workers: Number of parse worker processes
+        copy_to_uploads: Copy each workbook into ``upload_folder`` before ingesting it;
+            otherwise the files are stored from where they are
+        upload_folder: Destination folder for copied workbooks
+        queue_size: Parsed workbooks that may wait for the writer before parsing pauses
+        discard_failed: Delete the stored file of workbooks that were not saved
+            (default: only when they were copied)
+        progress_callback: Optional callable receiving (files_done, total_files, report)
+            on the calling thread after each workbook finishes
+
+    Returns:
+        list: One report dict per path with source, file_path, status ('saved',
+            'duplicate', 'no_tables' or 'error'), file_id, tables, error, parse_s and save_s
+    """
+    workers = max(1, workers)
+    discard_failed = copy_to_uploads if discard_failed is None else discard_failed
+    reports = [{
+        'source': path,
+        'file_path': None,
+        'file_hash': None,
+        'status': 'pending',
+        'file_id': None,
+        'tables': 0,
+        'error': None,
+        'parse_s': None,
+        'save_s': None,
+        'discard_on_failure': discard_failed
+    } for path in paths]
+
+    write_queue = queue.Queue(maxsize=max(1, queue_size))
+    finished_queue = queue.Queue()
+    writer = threading.Thread(target=_write_parsed, args=(write_queue, finished_queue), daemon=True)
+    writer.start()
+
+    files_done = 0
+
+    def drain_finished():
+        nonlocal files_done
+        while True:
+            try:
+                report = finished_queue.get_nowait()
+            except queue.Empty:
+                return
+            files_done += 1
+            if progress_callback:
+                progress_callback(files_done, len(reports), report)
+
+    pending = iter(reports)
+    in_flight = {}
+    # Parse at most this many workbooks ahead of the writer
+    max_in_flight = workers + write_queue.maxsize
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            while True:
+                while len(in_flight) < max_in_flight:
+                    report = next(pending, None)
+                    if report is None:
+                        break
+                    if not _stage(report, copy_to_uploads, upload_folder):
+                        finished_queue.put(report)
+                        continue
+                    in_flight[pool.submit(parse_workbook, report['file_path'])] = report
+
+                if not in_flight:
+                    break
+
+                done, _ = wait(in_flight, timeout=0.2, return_when=FIRST_COMPLETED)
+                for future in done:
+                    report = in_flight.pop(future)
+                    try:
+                        parsed = future.result()
+                    except Exception as e:
+                        report.update(status='error', error=str(e))
+                        _discard(report)
+                        finished_queue.put(report)
+                        continue
+                    report['parse_s'] = parsed['parse_s']
+                    # Blocks while the writer is queue_size workbooks behind
+                    write_queue.put((report, parsed))
+                drain_finished()
+    finally:
+        write_queue.put(None)
+        writer.join()
+    drain_finished()
+
+    for report in reports:
+        report.pop('discard_on_failure', None)
+    return reports
+
+def print_report(reports: List[Dict[str, Any]], elapsed: float):
+    """Print a per-file ingestion report and a summary."""
+    for report in reports:
+        timing = ""
+        if report['parse_s'] is not None:
+            timing = f" parse {report['parse_s']:.2f}s"
+        if report['save_s'] is not None:
+            timing += f" save {report['save_s']:.2f}s"
+        detail = f"file_id={report['file_id']} tables={report['tables']}" if report['status'] == 'saved' else report['error']
+        print(f"[{report['status']:>9}] {report['source']}: {detail}{timing}")
+
+    counts = {}
+    for report in reports:
+        counts[report['status']] = counts.get(report['status'], 0) + 1
+    summary = ", ".join(f"{status}: {count}" for status, count in sorted(counts.items()))
+    rate = len(reports) / elapsed if elapsed else 0.0
+    print(f"Ingested {len(reports)} files in {elapsed:.1f}s ({rate:.2f} files/s) - {summary}")
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Ingest many Excel workbooks in parallel")
+    arg_parser.add_argument("paths", nargs="+", help="Workbooks, glob patterns or directories")
+    arg_parser.add_argument("--workers", type=int, default=INGEST_WORKERS, help="Parse worker processes")
+    arg_parser.add_argument("--queue-size", type=int, default=INGEST_QUEUE_SIZE,
+                            help="Parsed workbooks buffered for the database writer")
+    arg_parser.add_argument("--no-copy", action="store_true",
+                            help=f"Store files where they are instead of copying them to {parser.UPLOAD_FOLDER}/")
+    args = arg_parser.parse_args()
+
+    files = collect_files(args.paths)
+    if not files:
+        arg_parser.error("no .xlsx/.xls files found")
+
+    db.init_db()
+    started = time.perf_counter()
+
+    def print_progress(files_done, total_files, report):
+        print(f"{files_done}/{total_files} {report['status']}: {report['source']}")
+
+    reports = ingest_files(files, workers=args.workers, copy_to_uploads=not args.no_copy,
+                           queue_size=args.queue_size, progress_callback=print_progress)
+    print_report(reports, time.perf_counter() - started)
+    raise SystemExit(1 if any(r['status'] == 'error' for r in reports) else 0)
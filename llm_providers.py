@@ -0,0 +1,316 @@
+"""
+Chat-completion providers behind ``ai_utils``: the OpenAI API or a local stand-in.
+
+``get_provider()`` returns the provider selected by ``LLM_PROVIDER``:
+
+- ``openai`` (default): the OpenAI API through the openai package
+- ``mock``: the stand-in server in ``mock_llm``, which emulates latency,
+  streaming and token usage without network access or cost. ``MOCK_LLM_URL``
+  points at a running server (``python mock_llm.py``); without it a server is
+  started in this process on first use.
+
+Providers return plain dicts, so callers do not depend on the openai types:
+``complete`` returns content, model, prompt_tokens, completion_tokens and
+finish_reason; ``stream`` yields chunks with a ``content`` delta, the last one
+with ``usage`` as well.
+
+With ``LLM_COALESCE`` on (the default), the provider is wrapped in a
+``CoalescingProvider``: identical requests made while one is in flight, e.g. the
+same question about the same file from several browser tabs, share that
+request's answer or stream instead of calling the API again.
+"""
+import json
+import logging
+import os
+import threading
+from typing import Dict, List, Any, Iterator, Optional
+from dotenv import load_dotenv
+from singleflight import SingleFlight, fingerprint
+
+# Load environment variables
+load_dotenv()
+
+# 'openai' or 'mock'
+LLM_PROVIDER = os.getenv('LLM_PROVIDER', 'openai').strip().lower()
+# Base URL of a running mock server, e.g. http://127.0.0.1:8765/v1; empty starts one in-process
+MOCK_LLM_URL = os.getenv('MOCK_LLM_URL', '').strip()
+# Seconds to wait for a completion, including a whole stream
+LLM_TIMEOUT = float(os.getenv('LLM_TIMEOUT', '120'))
+# Share one upstream request between identical concurrent requests (1/0)
+LLM_COALESCE = os.getenv('LLM_COALESCE', '1').strip().lower() not in ('0', 'false', 'no', 'off')
+
+_provider = None
+_provider_lock = threading.Lock()
+logger = logging.getLogger(__name__)
+
+def _usage(prompt_tokens: Optional[int], completion_tokens: Optional[int]) -> Dict[str, Optional[int]]:
+    return {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens}
+
+class LLMProvider:
+    """Interface of a chat-completion provider."""
+    name = 'base'
+
+    @property
+    def label(self) -> str:
+        """Human-readable description, e.g. for the sidebar."""
+        return self.name
+
+    def complete(self, messages: List[Dict[str, str]], model: str, **params) -> Dict[str, Any]:
+        """
+        Get a chat completion.
+
+        Args:
+            messages: List of message dictionaries with 'role' and 'content'
+            model: Model name
+            **params: Request parameters such as temperature and max_tokens
+
+        Returns:
+            dict: content, model, prompt_tokens, completion_tokens and finish_reason
+        """
+        raise NotImplementedError
+
+    def stream(self, messages: List[Dict[str, str]], model: str, **params) -> Iterator[Dict[str, Any]]:
+        """
+        Stream a chat completion.
+
+        Yields:
+            dict: ``content`` (the text delta, possibly empty); the last chunk
+                also has ``usage`` with prompt_tokens and completion_tokens
+        """
+        raise NotImplementedError
+
+    def check(self):
+        """
+        Verify that the provider is configured and reachable.
+
+        Raises:
+            RuntimeError: With a message suitable for showing to the user
+        """
+
+class OpenAIProvider(LLMProvider):
+    """The OpenAI chat-completions API, through a lazily created client."""
+    name = 'openai'
+
+    def __init__(self, api_key: Optional[str] = None):
+        self.api_key = (api_key if api_key is not None else os.getenv('OPENAI_API_KEY', '')).strip()
+        self._client = None
+        self._client_lock = threading.Lock()
+
+    @property
+    def label(self) -> str:
+        return "OpenAI API"
+
+    @property
+    def client(self):
+        """The shared OpenAI client; the openai package is imported on first use."""
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    from openai import OpenAI
+                    self._client = OpenAI(api_key=self.api_key, timeout=LLM_TIMEOUT)
+        return self._client
+
+    def complete(self, messages: List[Dict[str, str]], model: str, **params) -> Dict[str, Any]:
+        response = self.client.chat.completions.create(model=model, messages=messages, **params)
+        usage = getattr(response, 'usage', None)
+        return {
+            'content': response.choices[0].message.content or "",
+            'model': getattr(response, 'model', model),
+            'finish_reason': response.choices[0].finish_reason,
+            **_usage(usage.prompt_tokens if usage else None, usage.completion_tokens if usage else None)
+        }
+
+    def stream(self, messages: List[Dict[str, str]], model: str, **params) -> Iterator[Dict[str, Any]]:
+        response = self.client.chat.completions.create(
+            model=model, messages=messages, stream=True, stream_options={'include_usage': True}, **params
+        )
+        for chunk in response:
+            content = chunk.choices[0].delta.content if chunk.choices else None
+            usage = getattr(chunk, 'usage', None)
+            if usage:
+                yield {'content': content or "", 'usage': _usage(usage.prompt_tokens, usage.completion_tokens)}
+            elif content:
+                yield {'content': content}
+
+    def check(self):
+        import requests
+
+        if not self.api_key:
+            raise RuntimeError("OPENAI_API_KEY not found in environment variables. Please check your .env file.")
+
+        # Simple validation that the key starts with 'sk-'
+        if not self.api_key.startswith('sk-'):
+            raise RuntimeError(f"Invalid API key format. OpenAI API key should start with 'sk-'. Got: '{self.api_key[:10]}...'")
+
+        logger.debug("OpenAI API key format is valid")
+
+        # Test the API key with a simple request to OpenAI
+        test_headers = {
+            'Authorization': f'Bearer {self.api_key}',
+            'Content-Type': 'application/json'
+        }
+        test_data = {
+            'model': 'gpt-3.5-turbo',
+            'messages': [{'role': 'user', 'content': 'test'}],
+            'max_tokens': 5
+        }
+
+        try:
+            response = requests.post(
+                'https://api.openai.com/v1/chat/completions',
+                headers=test_headers,
+                json=test_data,
+                timeout=10
+            )
+        except Exception as e:
+            raise RuntimeError(f"Error validating OpenAI API key: {str(e)}")
+        if response.status_code != 200:
+            raise RuntimeError(f"OpenAI API key validation failed with status {response.status_code}: {response.text}")
+        logger.info("OpenAI API key is valid and working")
+
+class MockProvider(LLMProvider):
+    """The local stand-in server from ``mock_llm``, spoken to over plain HTTP."""
+    name = 'mock'
+
+    def __init__(self, base_url: str):
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.base_url = base_url.rstrip('/')
+        self.session = requests.Session()
+        # One pooled connection per concurrent caller, up to 64
+        self.session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=64))
+
+    @property
+    def label(self) -> str:
+        return f"mock LLM at {self.base_url}"
+
+    def _post(self, payload: Dict[str, Any], stream: bool = False):
+        response = self.session.post(f"{self.base_url}/chat/completions", json=payload,
+                                     stream=stream, timeout=LLM_TIMEOUT)
+        if response.status_code != 200:
+            try:
+                error_detail = response.json().get('error', {}).get('message', response.text)
+            except ValueError:
+                error_detail = response.text
+            raise RuntimeError(f"Mock LLM request failed with status {response.status_code}: {error_detail}")
+        return response
+
+    def complete(self, messages: List[Dict[str, str]], model: str, **params) -> Dict[str, Any]:
+        result = self._post({'model': model, 'messages': messages, **params}).json()
+        usage = result.get('usage') or {}
+        return {
+            'content': result['choices'][0]['message']['content'],
+            'model': result.get('model', model),
+            'finish_reason': result['choices'][0].get('finish_reason'),
+            **_usage(usage.get('prompt_tokens'), usage.get('completion_tokens'))
+        }
+
+    def stream(self, messages: List[Dict[str, str]], model: str, **params) -> Iterator[Dict[str, Any]]:
+        payload = {'model': model, 'messages': messages, 'stream': True,
+                   'stream_options': {'include_usage': True}, **params}
+        with self._post(payload, stream=True) as response:
+            # Server-sent events: "data: {json}" lines separated by blank lines, ending with [DONE]
+            for line in response.iter_lines():
+                if not line.startswith(b"data: "):
+                    continue
+                data = line[len(b"data: "):]
+                if data == b"[DONE]":
+                    break
+                chunk = json.loads(data)
+                content = chunk['choices'][0]['delta'].get('content') if chunk.get('choices') else None
+                if chunk.get('usage'):
+                    yield {'content': content or "",
+                           'usage': _usage(chunk['usage'].get('prompt_tokens'), chunk['usage'].get('completion_tokens'))}
+                elif content:
+                    yield {'content': content}
+
+    def check(self):
+        try:
+            response = self.session.get(f"{self.base_url}/models", timeout=5)
+        except Exception as e:
+            raise RuntimeError(f"Mock LLM at {self.base_url} is not reachable: {str(e)}")
+        if response.status_code != 200:
+            raise RuntimeError(f"Mock LLM at {self.base_url} answered with status {response.status_code}")
+        logger.info("Using the mock LLM at %s", self.base_url)
+
+class CoalescingProvider(LLMProvider):
+    """
+    Wraps a provider so that identical concurrent requests share one upstream request.
+
+    Requests are identical when their model, messages and parameters are; the key
+    is a hash of all three. ``complete`` results gain ``shared`` (True when the
+    answer came from another caller's request). Nothing is cached once a request
+    has finished.
+    """
+
+    def __init__(self, provider: LLMProvider):
+        self.provider = provider
+        self.name = provider.name
+        self.flights = SingleFlight()
+
+    @property
+    def label(self) -> str:
+        return self.provider.label
+
+    def complete(self, messages: List[Dict[str, str]], model: str, **params) -> Dict[str, Any]:
+        key = fingerprint('complete', model, messages, params)
+        outcome = self.flights.do(key, lambda: self.provider.complete(messages, model=model, **params))
+        return {**outcome['result'], 'shared': outcome['shared']}
+
+    def stream(self, messages: List[Dict[str, str]], model: str, **params) -> Iterator[Dict[str, Any]]:
+        key = fingerprint('stream', model, messages, params)
+        return self.flights.stream(key, lambda: self.provider.stream(messages, model=model, **params))
+
+    def check(self):
+        self.provider.check()
+
+    def stats(self) -> Dict[str, Any]:
+        """Request counters, see ``SingleFlight.stats``; ``saved`` is the number of upstream requests avoided."""
+        return self.flights.stats()
+
+def create_provider(name: str = None, coalesce: bool = None) -> LLMProvider:
+    """
+    Create a provider by name.
+
+    Args:
+        name: 'openai' or 'mock' (default: LLM_PROVIDER)
+        coalesce: Wrap it in a ``CoalescingProvider`` (default: LLM_COALESCE)
+
+    Raises:
+        ValueError: If the name is unknown
+    """
+    name = (name or LLM_PROVIDER).lower()
+    coalesce = LLM_COALESCE if coalesce is None else coalesce
+    if name == 'openai':
+        provider = OpenAIProvider()
+    elif name == 'mock':
+        url = MOCK_LLM_URL
+        if not url:
+            from mock_llm import start_server
+            url = start_server()['url']
+            logger.info("Started the mock LLM at %s", url)
+        provider = MockProvider(url)
+    else:
+        raise ValueError(f"Unknown LLM_PROVIDER {name!r}; use 'openai' or 'mock'")
+    return CoalescingProvider(provider) if coalesce else provider
+
+def get_provider() -> LLMProvider:
+    """Return the process-wide provider, creating it on first use."""
+    global _provider
+    if _provider is None:
+        with _provider_lock:
+            if _provider is None:
+                _provider = create_provider()
+    return _provider
+
+def set_provider(provider: Optional[LLMProvider]):
+    """Replace the process-wide provider, e.g. with a mock for benchmarks; None resets it."""
+    global _provider
+    with _provider_lock:
+        _provider = provider
+
+def coalescing_stats() -> Optional[Dict[str, Any]]:
+    """Counters of the process-wide provider's request coalescing, or None when it does not coalesce."""
+    provider = _provider
+    return provider.stats() if isinstance(provider, CoalescingProvider) else None
@@ -0,0 +1,446 @@
+"""
+Concurrent load tests for the database layer and for whole chat sessions.
+
+The ``db`` scenario starts N worker threads that each run the read paths used by
+the Streamlit pages (list files, open a file, read a table slice) through
+``database.get_db_session``.
+
+The ``session`` scenario runs N concurrent virtual users through upload, browse
+and chat with the same calls the pages make: each user uploads its own
+generated workbook, opens the file list and the file, and asks questions that
+are answered by the local mock LLM (``mock_llm``). Streamlit runs every browser
+session as a thread of one server process, and so does this test; AppTest cannot
+be used for this because it drives a single script runtime per process.
+
+With ``--shared-file`` every user chats about the same file, as users of a
+shared dashboard do, so identical questions overlap and are coalesced into one
+LLM request (``llm_providers.CoalescingProvider``; ``--no-coalesce`` turns it off).
+
+Both print latency percentiles, throughput and connection pool metrics; the
+session scenario adds memory per session, the mock LLM's peak concurrency and
+the LLM requests saved by coalescing.
+Runs against the database configured for ``database.engine``.
+
+Usage:
+    python load_test.py --users 50 --iterations 20
+    DATABASE_URL=sqlite:///load_test.db python load_test.py --scenario session --users 20 --questions 3
+    DATABASE_URL=sqlite:///load_test.db python load_test.py --scenario session --users 20 --shared-file
+"""
+import argparse
+import contextlib
+import io
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import uuid
+from typing import Dict, List, Any, Optional
+
+import database as db
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Return the pct-th percentile of values using nearest-rank."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[rank]
+
+
+def seed_file(rows: int = 500) -> int:
+    """Create a throwaway ExcelFile with one table of ``rows`` rows and return its ID."""
+    tag = uuid.uuid4().hex
+    table = [{'id': i, 'name': f'item_{i}', 'value': i * 1.5} for i in range(rows)]
+    return db.save_excel_file(
+        file_name=f'load_test_{tag[:8]}.xlsx',
+        file_path=f'load_test_{tag[:8]}.xlsx',
+        file_hash=tag + tag[:32],
+        tables_data={'Sheet1': {'Table_1': table}}
+    )
+
+
+def run_user(file_id: int, iterations: int, latencies: Dict[str, List[float]],
+             errors: List[str], lock: threading.Lock):
+    """Run one virtual user's iterations and record per-operation latencies."""
+    operations = [
+        ('list_files', lambda: db.list_excel_files()),
+        ('get_file', lambda: db.get_excel_file(file_id)),
+        ('last_rows', lambda: db.get_table_rows(file_id, 'Sheet1', 'Table_1', -3)),
+    ]
+    for _ in range(iterations):
+        for name, operation in operations:
+            started = time.perf_counter()
+            try:
+                operation()
+            except Exception as e:
+                with lock:
+                    errors.append(f"{name}: {str(e)}")
+                continue
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies[name].append(elapsed)
+
+
+class PoolSampler:
+    """Samples the number of checked-out connections in a background thread and keeps the peak."""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.peak_checked_out = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            checked_out = db.get_pool_metrics().get('checked_out') or 0
+            self.peak_checked_out = max(self.peak_checked_out, checked_out)
+            time.sleep(self.interval)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self) -> int:
+        """Stop sampling and return the peak number of checked-out connections."""
+        self._stop.set()
+        self._thread.join()
+        return self.peak_checked_out
+
+
+def latency_stats(latencies: Dict[str, List[float]]) -> Dict[str, Dict[str, float]]:
+    """Percentiles and mean in ms for each operation's latencies (in seconds)."""
+    return {
+        name: {
+            'p50': percentile(values, 50) * 1000,
+            'p95': percentile(values, 95) * 1000,
+            'p99': percentile(values, 99) * 1000,
+            'mean': statistics.mean(values) * 1000 if values else 0.0,
+        }
+        for name, values in latencies.items()
+    }
+
+
+def run_load_test(users: int, iterations: int, rows: int) -> Dict[str, Any]:
+    """Run the load test and return latency and pool statistics."""
+    db.init_db()
+    file_id = seed_file(rows)
+    db.reset_pool_metrics()
+
+    latencies = {'list_files': [], 'get_file': [], 'last_rows': []}
+    errors = []
+    lock = threading.Lock()
+    sampler = PoolSampler()
+    sampler.start()
+
+    started = time.perf_counter()
+    threads = [
+        threading.Thread(target=run_user, args=(file_id, iterations, latencies, errors, lock))
+        for _ in range(users)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    peak_checked_out = sampler.stop()
+
+    try:
+        db.delete_excel_file(file_id)
+    except Exception as e:
+        print(f"Warning: could not remove seeded file {file_id}: {str(e)}")
+
+    total_ops = sum(len(values) for values in latencies.values())
+    return {
+        'users': users,
+        'iterations': iterations,
+        'elapsed_s': elapsed,
+        'throughput_ops_s': total_ops / elapsed if elapsed else 0.0,
+        'errors': errors,
+        'latency_ms': latency_stats(latencies),
+        'peak_checked_out': peak_checked_out,
+        'pool': db.get_pool_metrics(),
+    }
+
+
+class _Upload:
+    """The parts of Streamlit's UploadedFile that ``parser.save_uploaded_file`` uses."""
+
+    def __init__(self, name: str, content: bytes):
+        self.name = name
+        self.size = len(content)
+        self._content = content
+
+    def getvalue(self) -> bytes:
+        return self._content
+
+
+def upload_workbook(name: str, content: bytes, upload_folder: str) -> int:
+    """Store a workbook the way the upload page does and return its file ID."""
+    import excel_parser as parser
+
+    file_path, file_hash = parser.save_uploaded_file(_Upload(name, content), upload_folder)
+    is_duplicate, message = db.is_duplicate_file(file_hash, name)
+    if is_duplicate:
+        os.remove(file_path)
+        raise RuntimeError(message)
+    sheet_hashes = parser.calculate_sheet_hashes(file_path)
+    return db.save_excel_file(
+        file_name=os.path.basename(file_path),
+        file_path=file_path,
+        file_hash=file_hash,
+        tables_data=parser.iter_tables(file_path),
+        sheet_hashes=sheet_hashes
+    )
+
+
+def browse(file_id: int) -> Dict[str, Any]:
+    """The browse page's file list, then the file detail page."""
+    db.list_excel_files()
+    return db.get_excel_file(file_id)
+
+
+def chat_turn(file_id: int, question: str, history: List[Dict[str, str]]) -> str:
+    """
+    Answer one question the way the chat page does and save the conversation.
+
+    The chat page loads the file on the run that accepts the question and again
+    on the run that answers it.
+    """
+    from ai_utils import analyze_table, prepare_analysis_data
+
+    db.get_excel_file(file_id)
+    file_data = db.get_excel_file(file_id)
+    analysis_data = prepare_analysis_data(file_data)
+    answer = analyze_table(analysis_data, question)
+    if answer.startswith("Error analyzing table data"):
+        raise RuntimeError(answer.splitlines()[0])
+    history.extend([{'role': 'user', 'content': question}, {'role': 'assistant', 'content': answer}])
+    db.save_chat_history(file_id, history, 'all_sheets')
+    return answer
+
+
+def run_session(name: str, content: bytes, questions: List[str], upload_folder: str,
+                latencies: Dict[str, List[float]], errors: List[str], file_ids: List[int],
+                lock: threading.Lock, chat_file_id: Optional[int] = None):
+    """
+    Run one virtual user's session (upload, browse, chat) and record per-step latencies.
+
+    The user chats about its own upload, or about ``chat_file_id`` when given.
+    """
+    session_started = time.perf_counter()
+    file_id = None
+    history = []
+    steps = [('upload', lambda: upload_workbook(name, content, upload_folder)),
+             ('browse', lambda: browse(file_id))]
+    steps += [('chat', lambda question=question: chat_turn(chat_file_id or file_id, question, history))
+              for question in questions]
+    for step, operation in steps:
+        started = time.perf_counter()
+        try:
+            result = operation()
+        except Exception as e:
+            with lock:
+                errors.append(f"{name} {step}: {str(e)}")
+            return  # later steps depend on this one
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies[step].append(elapsed)
+            if step == 'upload':
+                file_id = result
+                file_ids.append(file_id)
+    with lock:
+        latencies['session'].append(time.perf_counter() - session_started)
+
+
+def _max_rss_mb() -> Optional[float]:
+    """Peak resident set size of this process in MB, where the platform reports it."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in bytes on macOS and in kilobytes elsewhere
+    return max_rss / (1024 * 1024) if sys.platform == 'darwin' else max_rss / 1024
+
+
+def run_session_load_test(users: int, questions: int, rows: int, llm_latency_ms: float,
+                          llm_token_ms: float, completion_tokens: int, shared_file: bool = False,
+                          coalesce: bool = True) -> Dict[str, Any]:
+    """
+    Run concurrent upload/browse/chat sessions against the mock LLM.
+
+    Args:
+        shared_file: Every user chats about the warm-up session's file instead of its own
+        coalesce: Share one LLM request between identical concurrent requests
+
+    Returns:
+        dict: Latency percentiles per step and per session, throughput, memory per
+            session, pool saturation, the mock LLM's request statistics and the
+            coalescing counters (None without coalescing)
+    """
+    import workbook_generator
+    from llm_providers import CoalescingProvider, MockProvider, set_provider
+    from mock_llm import start_server
+
+    db.init_db()
+    mock = start_server(latency_ms=llm_latency_ms, token_ms=llm_token_ms, completion_tokens=completion_tokens)
+    provider = MockProvider(mock['url'])
+    if coalesce:
+        provider = CoalescingProvider(provider)
+    set_provider(provider)
+    question_texts = [
+        "What is the total of the total column per region?",
+        "Which product has the highest quantity?",
+        "Summarize the notes column.",
+        "Are there unusual unit prices?",
+    ]
+    session_questions = [question_texts[i % len(question_texts)] for i in range(questions)]
+
+    workdir = tempfile.mkdtemp(prefix='load_test_')
+    upload_folder = os.path.join(workdir, 'uploads')
+    os.makedirs(upload_folder)
+    file_ids = []
+    try:
+        # One distinct workbook per user (plus one for the warm-up), so no upload is a duplicate
+        workbooks = []
+        for i in range(users + 1):
+            path = os.path.join(workdir, f'user_{i:03d}.xlsx')
+            workbook_generator.generate_workbook(path, sheets=2, tables_per_sheet=2, rows=rows, seed=i)
+            with open(path, 'rb') as f:
+                workbooks.append((f'load_test_{uuid.uuid4().hex[:8]}_{i:03d}.xlsx', f.read()))
+
+        latencies = {'upload': [], 'browse': [], 'chat': [], 'session': []}
+        errors = []
+        lock = threading.Lock()
+        quiet = contextlib.redirect_stdout(io.StringIO())
+
+        # Warm-up session on its own: loads the modules and measures one session's allocations
+        with quiet:
+            tracemalloc.start()
+            try:
+                run_session(*workbooks[0], session_questions, upload_folder,
+                            {name: [] for name in latencies}, errors, file_ids, lock)
+                _, session_peak = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+
+        chat_file_id = file_ids[0] if shared_file and file_ids else None
+        db.reset_pool_metrics()
+        if coalesce:
+            provider.flights.reset_stats()
+        mock_before = mock['server'].snapshot()
+        rss_before = _max_rss_mb()
+        sampler = PoolSampler()
+        sampler.start()
+        started = time.perf_counter()
+        threads = [
+            threading.Thread(target=run_session, args=(*workbooks[i], session_questions, upload_folder,
+                                                       latencies, errors, file_ids, lock, chat_file_id))
+            for i in range(1, users + 1)
+        ]
+        # The pipeline prints progress; keep it out of the report
+        with quiet:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        elapsed = time.perf_counter() - started
+        peak_checked_out = sampler.stop()
+        rss_after = _max_rss_mb()
+    finally:
+        mock['server'].shutdown()
+        set_provider(None)
+        try:
+            db.delete_excel_files(file_ids)
+        except Exception as e:
+            print(f"Warning: could not remove load test files: {str(e)}")
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    pool = db.get_pool_metrics()
+    capacity = (pool['pool_size'] or 0) + (pool['max_overflow'] or 0) if pool['pool_size'] is not None else None
+    return {
+        'scenario': 'session',
+        'users': users,
+        'questions': questions,
+        'elapsed_s': elapsed,
+        'throughput_sessions_s': len(latencies['session']) / elapsed if elapsed else 0.0,
+        'throughput_chats_s': len(latencies['chat']) / elapsed if elapsed else 0.0,
+        'errors': errors,
+        'latency_ms': latency_stats(latencies),
+        'session_peak_mb': session_peak / (1024 * 1024),
+        'rss_growth_per_session_mb': (rss_after - rss_before) / users if rss_before is not None and users else None,
+        'peak_checked_out': peak_checked_out,
+        'pool_saturation': peak_checked_out / capacity if capacity else None,
+        'pool': pool,
+        'llm': {key: value - mock_before[key] if key not in ('active', 'peak_active') else value
+                for key, value in mock['server'].snapshot().items()},
+        'coalescing': provider.stats() if coalesce else None,
+    }
+
+
+def print_report(report: Dict[str, Any]):
+    """Print a load test report."""
+    if report.get('scenario') == 'session':
+        print(f"Users: {report['users']}  Questions: {report['questions']}  Elapsed: {report['elapsed_s']:.2f}s  "
+              f"Throughput: {report['throughput_sessions_s']:.2f} sessions/s, {report['throughput_chats_s']:.2f} chats/s")
+        rss_growth = report['rss_growth_per_session_mb']
+        print(f"Memory: {report['session_peak_mb']:.1f} MB peak allocated by one session; "
+              f"peak RSS growth {f'{rss_growth:.1f} MB' if rss_growth is not None else 'n/a'} per concurrent session")
+    else:
+        print(f"Users: {report['users']}  Iterations: {report['iterations']}  "
+              f"Elapsed: {report['elapsed_s']:.2f}s  Throughput: {report['throughput_ops_s']:.1f} ops/s")
+    print(f"{'operation':<12} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'mean ms':>9}")
+    for name, stats in report['latency_ms'].items():
+        print(f"{name:<12} {stats['p50']:>9.2f} {stats['p95']:>9.2f} {stats['p99']:>9.2f} {stats['mean']:>9.2f}")
+    pool = report['pool']
+    print(f"Pool: {pool['pool_class']} size={pool['pool_size']} max_overflow={pool['max_overflow']} "
+          f"peak_checked_out={report['peak_checked_out']}")
+    print(f"Checkouts: {pool['checkouts']}  timeouts: {pool['checkout_timeouts']}  "
+          f"avg wait: {pool['avg_wait_ms']:.2f}ms  max wait: {pool['max_wait_ms']:.2f}ms")
+    if report.get('pool_saturation') is not None:
+        print(f"Pool saturation: {report['pool_saturation']:.0%} of pool_size + max_overflow at peak")
+    if report.get('llm'):
+        llm = report['llm']
+        print(f"Mock LLM: {llm['requests']} requests, peak {llm['peak_active']} concurrent, "
+              f"{llm['prompt_tokens']:,} prompt / {llm['completion_tokens']:,} completion tokens")
+    if report.get('coalescing'):
+        coalescing = report['coalescing']
+        print(f"Coalescing: {coalescing['calls']} LLM requests, {coalescing['upstream']} sent, "
+              f"{coalescing['saved']} saved ({coalescing['saved_share']:.0%}), "
+              f"up to {coalescing['peak_followers'] + 1} callers sharing one request")
+    if report['errors']:
+        print(f"Errors ({len(report['errors'])}):")
+        for error in report['errors'][:10]:
+            print(f"  - {error}")
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Concurrent load test for the database layer and chat sessions")
+    arg_parser.add_argument("--scenario", choices=["db", "session"], default="db",
+                            help="db: database read paths; session: upload, browse and chat with the mock LLM")
+    arg_parser.add_argument("--users", type=int, default=20, help="Number of concurrent virtual users")
+    arg_parser.add_argument("--iterations", type=int, default=10, help="Iterations per user (db scenario)")
+    arg_parser.add_argument("--rows", type=int, default=500,
+                            help="Rows in the seeded table (db) or per table of each uploaded workbook (session)")
+    arg_parser.add_argument("--questions", type=int, default=3, help="Chat questions per session")
+    arg_parser.add_argument("--llm-latency-ms", type=float, default=300, help="Mock LLM time to first token")
+    arg_parser.add_argument("--llm-token-ms", type=float, default=10, help="Mock LLM time per generated token")
+    arg_parser.add_argument("--completion-tokens", type=int, default=200, help="Mock LLM tokens per answer")
+    arg_parser.add_argument("--shared-file", action="store_true",
+                            help="All users chat about one file, as on a shared dashboard (session scenario)")
+    arg_parser.add_argument("--no-coalesce", action="store_true",
+                            help="Send every LLM request upstream, even when an identical one is in flight")
+    args = arg_parser.parse_args()
+
+    if args.scenario == 'session':
+        report = run_session_load_test(args.users, args.questions, args.rows, args.llm_latency_ms,
+                                       args.llm_token_ms, args.completion_tokens, args.shared_file,
+                                       not args.no_coalesce)
+    else:
+        report = run_load_test(args.users, args.iterations, args.rows)
+    print_report(report)
+    raise SystemExit(1 if report['errors'] else 0)
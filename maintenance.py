@@ -0,0 +1,439 @@
+"""
+Maintenance job for the upload folder and the files stored in the database.
+
+Reconciles ``excel_uploads/`` against ``ExcelFile.file_path`` in both directions,
+enforces age and size retention, deduplicates identical uploads with hardlinks,
+and optionally recompresses or archives old uploads. Every phase works through
+at most ``batch_size * max_batches`` items per run, so the job can be scheduled
+repeatedly and makes incremental progress on large folders.
+
+Stored paths are relative to the directory the app runs in (``UPLOAD_BASE_DIR``,
+by default the project directory), so they resolve the same way whatever the
+job's working directory. Files younger than ``--orphan-min-age-minutes`` are never
+treated as orphans, since an upload's file is written before its row commits.
+
+Usage:
+    python maintenance.py --dry-run
+    python maintenance.py --max-age-days 365 --max-total-mb 20000 --dedupe
+    python maintenance.py --recompress-after-days 30 --archive-after-days 90
+"""
+import argparse
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+import zipfile
+from datetime import datetime, timedelta
+from typing import Dict, List, Any, Optional, Iterator, Tuple
+
+import database as db
+from excel_parser import UPLOAD_FOLDER
+from models import ExcelFile
+
+ARCHIVE_DIR_NAME = "archive"
+EXCEL_EXTENSIONS = ('.xlsx', '.xlsm', '.xls')
+# Directory relative upload paths (in the database and UPLOAD_FOLDER) are relative to: where the app runs
+UPLOAD_BASE_DIR = os.path.abspath(os.getenv('UPLOAD_BASE_DIR', os.path.dirname(os.path.abspath(__file__))))
+# Files modified more recently than this are not orphans yet: their upload may still be committing
+ORPHAN_MIN_AGE_MINUTES = float(os.getenv('ORPHAN_MIN_AGE_MINUTES', '60'))
+# Refuse to delete rows with missing files when more than this share of scanned rows is missing,
+# which points to a wrong base directory rather than lost files
+MISSING_ROWS_MAX_SHARE = float(os.getenv('MISSING_ROWS_MAX_SHARE', '0.5'))
+
+
+def resolve_path(path: str, base_dir: str = None) -> str:
+    """Canonical absolute path of a stored or configured path, resolving relative ones against ``base_dir``."""
+    return os.path.realpath(os.path.join(base_dir or UPLOAD_BASE_DIR, path))
+
+
+def _new_report(dry_run: bool) -> Dict[str, Any]:
+    """Create an empty maintenance report."""
+    return {
+        'dry_run': dry_run,
+        'orphan_files_removed': [],
+        'missing_file_rows': [],
+        'missing_file_rows_deleted': 0,
+        'retention_files_deleted': 0,
+        'duplicates_linked': 0,
+        'files_recompressed': 0,
+        'files_archived': 0,
+        'bytes_reclaimed': 0,
+        'errors': [],
+    }
+
+
+def _reclaimable_bytes(path: str) -> int:
+    """Bytes freed by removing ``path``: its size unless another hardlink keeps the data."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return 0
+    return stat.st_size if stat.st_nlink <= 1 else 0
+
+
+def _file_digest(path: str, block_size: int = 1024 * 1024) -> str:
+    """SHA-256 of a file, read in blocks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _iter_file_batches(batch_size: int, max_batches: int) -> Iterator[List[Tuple[int, str, datetime]]]:
+    """Yield (id, file_path, uploaded_at) rows in ID order, one bounded batch at a time."""
+    last_id = 0
+    for _ in range(max_batches):
+        with db.get_db_session() as db_session:
+            rows = db_session.query(
+                ExcelFile.id, ExcelFile.file_path, ExcelFile.uploaded_at
+            ).filter(ExcelFile.id > last_id).order_by(ExcelFile.id).limit(batch_size).all()
+        if not rows:
+            return
+        last_id = rows[-1].id
+        yield [(row.id, row.file_path, row.uploaded_at) for row in rows]
+
+
+def _iter_upload_files(upload_folder: str, limit: int) -> Iterator[str]:
+    """Yield up to ``limit`` resolved workbook paths in the upload folder, skipping the archive."""
+    count = 0
+    for root, dirs, files in os.walk(resolve_path(upload_folder)):
+        dirs[:] = [d for d in dirs if d != ARCHIVE_DIR_NAME]
+        for name in sorted(files):
+            if not name.lower().endswith(EXCEL_EXTENSIONS):
+                continue
+            if count >= limit:
+                return
+            count += 1
+            yield os.path.realpath(os.path.join(root, name))
+
+
+def _referenced_paths() -> set:
+    """Resolved paths of every file referenced by an ExcelFile row."""
+    with db.get_db_session() as db_session:
+        return {resolve_path(path) for (path,) in db_session.query(ExcelFile.file_path)}
+
+
+def remove_orphan_files(upload_folder: str, report: Dict[str, Any], limit: int, dry_run: bool,
+                        min_age_minutes: float = ORPHAN_MIN_AGE_MINUTES):
+    """Remove workbooks on disk that no ExcelFile row references and that are older than ``min_age_minutes``."""
+    referenced = _referenced_paths()
+    cutoff = time.time() - min_age_minutes * 60
+    for path in _iter_upload_files(upload_folder, limit):
+        if path in referenced:
+            continue
+        try:
+            if os.path.getmtime(path) > cutoff:
+                continue  # possibly an upload whose row is not committed yet
+        except OSError:
+            continue
+        report['orphan_files_removed'].append(path)
+        report['bytes_reclaimed'] += _reclaimable_bytes(path)
+        if not dry_run:
+            try:
+                os.remove(path)
+            except OSError as e:
+                report['errors'].append(f"Could not remove orphan {path}: {str(e)}")
+
+
+def find_missing_files(report: Dict[str, Any], batch_size: int, max_batches: int,
+                       delete_rows: bool, dry_run: bool):
+    """
+    Find ExcelFile rows whose file is gone from disk, optionally deleting them.
+
+    Deletion is refused when more than ``MISSING_ROWS_MAX_SHARE`` of the scanned
+    rows are missing: that points to a wrong ``UPLOAD_BASE_DIR``, and deleting the
+    rows would cascade to their tables and chat history.
+    """
+    missing_ids = []
+    scanned = 0
+    for batch in _iter_file_batches(batch_size, max_batches):
+        for file_id, file_path, _ in batch:
+            scanned += 1
+            if not os.path.exists(resolve_path(file_path)):
+                report['missing_file_rows'].append({'id': file_id, 'file_path': file_path})
+                missing_ids.append(file_id)
+    if delete_rows and missing_ids and len(missing_ids) > scanned * MISSING_ROWS_MAX_SHARE:
+        report['errors'].append(
+            f"Not deleting rows: {len(missing_ids)} of {scanned} files are missing under {UPLOAD_BASE_DIR}; "
+            f"check UPLOAD_BASE_DIR / --base-dir"
+        )
+        return
+    if delete_rows and missing_ids and not dry_run:
+        deleted, _ = db.delete_excel_files(missing_ids, batch_size=batch_size)
+        report['missing_file_rows_deleted'] = deleted
+
+
+def enforce_retention(report: Dict[str, Any], batch_size: int, max_batches: int,
+                      max_age_days: Optional[int], max_total_mb: Optional[float], dry_run: bool):
+    """Delete files older than ``max_age_days`` and then the oldest files until under ``max_total_mb``."""
+    if max_age_days is None and max_total_mb is None:
+        return
+    cutoff = datetime.utcnow() - timedelta(days=max_age_days) if max_age_days is not None else None
+    limit = batch_size * max_batches
+
+    # (uploaded_at, id, path, reclaimable bytes), oldest first
+    candidates = []
+    seen_inodes = set()
+    total_bytes = 0
+    for batch in _iter_file_batches(batch_size, max_batches):
+        for file_id, file_path, uploaded_at in batch:
+            file_path = resolve_path(file_path)
+            size = 0
+            try:
+                stat = os.stat(file_path)
+                # Hardlinked copies share their bytes; count each inode once
+                if (stat.st_dev, stat.st_ino) not in seen_inodes:
+                    seen_inodes.add((stat.st_dev, stat.st_ino))
+                    size = stat.st_size
+            except OSError:
+                pass
+            total_bytes += size
+            candidates.append((uploaded_at or datetime.min, file_id, file_path, size))
+    candidates.sort()
+
+    to_delete = []
+    max_total_bytes = max_total_mb * 1024 * 1024 if max_total_mb is not None else None
+    for uploaded_at, file_id, file_path, size in candidates:
+        if len(to_delete) >= limit:
+            break
+        too_old = cutoff is not None and uploaded_at < cutoff
+        over_size = max_total_bytes is not None and total_bytes > max_total_bytes
+        if not (too_old or over_size):
+            continue
+        to_delete.append(file_id)
+        total_bytes -= size
+        report['bytes_reclaimed'] += _reclaimable_bytes(file_path)
+
+    if to_delete and not dry_run:
+        deleted, _ = db.delete_excel_files(to_delete, batch_size=batch_size)
+        report['retention_files_deleted'] = deleted
+    else:
+        report['retention_files_deleted'] = len(to_delete)
+
+
+def deduplicate_files(upload_folder: str, report: Dict[str, Any], limit: int, dry_run: bool):
+    """Replace byte-identical uploads with hardlinks to a single copy."""
+    by_size: Dict[int, List[str]] = {}
+    for path in _iter_upload_files(upload_folder, limit):
+        try:
+            by_size.setdefault(os.path.getsize(path), []).append(path)
+        except OSError:
+            continue
+
+    for size, paths in by_size.items():
+        if len(paths) < 2:
+            continue
+        by_digest: Dict[str, List[str]] = {}
+        for path in paths:
+            by_digest.setdefault(_file_digest(path), []).append(path)
+        for same_paths in by_digest.values():
+            canonical = same_paths[0]
+            canonical_stat = os.stat(canonical)
+            for path in same_paths[1:]:
+                if os.path.samestat(canonical_stat, os.stat(path)):
+                    continue
+                report['duplicates_linked'] += 1
+                report['bytes_reclaimed'] += _reclaimable_bytes(path)
+                if dry_run:
+                    continue
+                temp_path = f"{path}.link-tmp"
+                try:
+                    os.link(canonical, temp_path)
+                    os.replace(temp_path, path)
+                except OSError as e:
+                    report['errors'].append(f"Could not link {path} to {canonical}: {str(e)}")
+                    if os.path.exists(temp_path):
+                        os.remove(temp_path)
+
+
+def recompress_file(path: str) -> int:
+    """
+    Rewrite an .xlsx/.xlsm archive with maximum deflate compression.
+
+    The workbook stays a valid Excel file. The rewrite is kept only if it is smaller.
+
+    Returns:
+        int: Bytes saved (0 if the file was left unchanged)
+    """
+    original_size = os.path.getsize(path)
+    fd, temp_path = tempfile.mkstemp(suffix=os.path.splitext(path)[1], dir=os.path.dirname(path))
+    os.close(fd)
+    try:
+        with zipfile.ZipFile(path) as source, \
+                zipfile.ZipFile(temp_path, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=9) as target:
+            for info in source.infolist():
+                # Opening by name applies the target archive's compression level
+                with source.open(info) as src, target.open(info.filename, 'w') as dst:
+                    shutil.copyfileobj(src, dst)
+        new_size = os.path.getsize(temp_path)
+        if new_size >= original_size:
+            return 0
+        shutil.copystat(path, temp_path)
+        os.replace(temp_path, path)
+        return original_size - new_size
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def recompress_old_files(report: Dict[str, Any], batch_size: int, max_batches: int,
+                         older_than_days: int, dry_run: bool):
+    """Recompress uploads older than ``older_than_days`` that are not shared by hardlinks."""
+    cutoff = time.time() - older_than_days * 86400
+    for batch in _iter_file_batches(batch_size, max_batches):
+        for _, file_path, _ in batch:
+            file_path = resolve_path(file_path)
+            if not file_path.lower().endswith(('.xlsx', '.xlsm')):
+                continue
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                continue
+            # Rewriting a hardlinked file would break the sharing and cost space
+            if stat.st_mtime > cutoff or stat.st_nlink > 1:
+                continue
+            if dry_run:
+                report['files_recompressed'] += 1
+                continue
+            try:
+                saved = recompress_file(file_path)
+            except (OSError, zipfile.BadZipFile) as e:
+                report['errors'].append(f"Could not recompress {file_path}: {str(e)}")
+                continue
+            if saved:
+                report['files_recompressed'] += 1
+                report['bytes_reclaimed'] += saved
+
+
+def archive_old_files(upload_folder: str, report: Dict[str, Any], batch_size: int, max_batches: int,
+                      older_than_days: int, dry_run: bool):
+    """Move uploads older than ``older_than_days`` into ``<upload_folder>/archive/<year>/``."""
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    archive_root = os.path.join(resolve_path(upload_folder), ARCHIVE_DIR_NAME)
+    for batch in _iter_file_batches(batch_size, max_batches):
+        for file_id, file_path, uploaded_at in batch:
+            if uploaded_at is None or uploaded_at >= cutoff:
+                continue
+            file_path = resolve_path(file_path)
+            if file_path.startswith(archive_root + os.sep) or not os.path.exists(file_path):
+                continue
+            report['files_archived'] += 1
+            if dry_run:
+                continue
+            target_dir = os.path.join(archive_root, str(uploaded_at.year))
+            target_path = os.path.join(target_dir, os.path.basename(file_path))
+            try:
+                os.makedirs(target_dir, exist_ok=True)
+                shutil.move(file_path, target_path)
+                with db.get_db_session() as db_session:
+                    db_session.query(ExcelFile).filter(ExcelFile.id == file_id).update(
+                        {ExcelFile.file_path: target_path}, synchronize_session=False
+                    )
+            except Exception as e:
+                report['errors'].append(f"Could not archive {file_path}: {str(e)}")
+
+
+def run_maintenance(upload_folder: str = UPLOAD_FOLDER, dry_run: bool = False, batch_size: int = 500,
+                    max_batches: int = 10, remove_orphans: bool = True, delete_missing: bool = False,
+                    max_age_days: Optional[int] = None, max_total_mb: Optional[float] = None,
+                    dedupe: bool = False, recompress_after_days: Optional[int] = None,
+                    archive_after_days: Optional[int] = None,
+                    orphan_min_age_minutes: float = ORPHAN_MIN_AGE_MINUTES) -> Dict[str, Any]:
+    """
+    Run the maintenance phases and return a report.
+
+    Args:
+        upload_folder: Folder holding uploaded workbooks
+        dry_run: Only report what would change
+        batch_size: Rows or files handled per batch
+        max_batches: Maximum batches per phase in this run
+        remove_orphans: Remove files on disk that no ExcelFile references
+        orphan_min_age_minutes: Only remove orphans last modified longer ago than this
+        delete_missing: Delete ExcelFile rows whose file is missing on disk
+        max_age_days: Delete files uploaded more than this many days ago
+        max_total_mb: Delete the oldest files until the uploads fit in this size
+        dedupe: Hardlink byte-identical uploads together
+        recompress_after_days: Recompress uploads older than this many days
+        archive_after_days: Move uploads older than this many days into the archive folder
+
+    Returns:
+        dict: Counts of what was (or would be) changed and the bytes reclaimed
+    """
+    report = _new_report(dry_run)
+    limit = batch_size * max_batches
+    started = time.perf_counter()
+
+    if remove_orphans:
+        remove_orphan_files(upload_folder, report, limit, dry_run, orphan_min_age_minutes)
+    find_missing_files(report, batch_size, max_batches, delete_missing, dry_run)
+    enforce_retention(report, batch_size, max_batches, max_age_days, max_total_mb, dry_run)
+    if not dry_run:
+        # Retention deletes remove their files in the background
+        db.wait_for_file_cleanup()
+    if dedupe:
+        deduplicate_files(upload_folder, report, limit, dry_run)
+    if recompress_after_days is not None:
+        recompress_old_files(report, batch_size, max_batches, recompress_after_days, dry_run)
+    if archive_after_days is not None:
+        archive_old_files(upload_folder, report, batch_size, max_batches, archive_after_days, dry_run)
+
+    report['elapsed_s'] = time.perf_counter() - started
+    return report
+
+
+def print_report(report: Dict[str, Any]):
+    """Print a maintenance report."""
+    prefix = "[dry run] " if report['dry_run'] else ""
+    print(f"{prefix}Orphan files removed: {len(report['orphan_files_removed'])}")
+    print(f"{prefix}Rows with missing files: {len(report['missing_file_rows'])} "
+          f"(deleted: {report['missing_file_rows_deleted']})")
+    print(f"{prefix}Files deleted by retention policy: {report['retention_files_deleted']}")
+    print(f"{prefix}Duplicate files hardlinked: {report['duplicates_linked']}")
+    print(f"{prefix}Files recompressed: {report['files_recompressed']}")
+    print(f"{prefix}Files archived: {report['files_archived']}")
+    print(f"{prefix}Bytes reclaimed: {report['bytes_reclaimed']:,} ({report['bytes_reclaimed'] / 1024 / 1024:.1f} MB)")
+    print(f"Elapsed: {report['elapsed_s']:.2f}s")
+    for error in report['errors']:
+        print(f"❌ {error}")
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Reconcile and compact uploaded Excel files")
+    arg_parser.add_argument("--upload-folder", default=UPLOAD_FOLDER, help="Folder holding uploaded workbooks")
+    arg_parser.add_argument("--dry-run", action="store_true", help="Only report what would change")
+    arg_parser.add_argument("--batch-size", type=int, default=500, help="Rows or files per batch")
+    arg_parser.add_argument("--max-batches", type=int, default=10, help="Maximum batches per phase in this run")
+    arg_parser.add_argument("--base-dir", default=UPLOAD_BASE_DIR,
+                            help="Directory relative upload paths are relative to (where the app runs)")
+    arg_parser.add_argument("--keep-orphans", action="store_true", help="Do not remove unreferenced files")
+    arg_parser.add_argument("--orphan-min-age-minutes", type=float, default=ORPHAN_MIN_AGE_MINUTES,
+                            help="Keep unreferenced files modified more recently than this")
+    arg_parser.add_argument("--delete-missing", action="store_true",
+                            help="Delete database rows whose file is missing on disk")
+    arg_parser.add_argument("--max-age-days", type=int, help="Delete uploads older than this many days")
+    arg_parser.add_argument("--max-total-mb", type=float, help="Delete the oldest uploads above this total size")
+    arg_parser.add_argument("--dedupe", action="store_true", help="Hardlink byte-identical uploads")
+    arg_parser.add_argument("--recompress-after-days", type=int, help="Recompress uploads older than this many days")
+    arg_parser.add_argument("--archive-after-days", type=int, help="Archive uploads older than this many days")
+    args = arg_parser.parse_args()
+
+    UPLOAD_BASE_DIR = os.path.abspath(args.base_dir)
+    db.init_db()
+    maintenance_report = run_maintenance(
+        upload_folder=args.upload_folder,
+        dry_run=args.dry_run,
+        batch_size=max(1, args.batch_size),
+        max_batches=max(1, args.max_batches),
+        remove_orphans=not args.keep_orphans,
+        delete_missing=args.delete_missing,
+        max_age_days=args.max_age_days,
+        max_total_mb=args.max_total_mb,
+        dedupe=args.dedupe,
+        recompress_after_days=args.recompress_after_days,
+        archive_after_days=args.archive_after_days,
+        orphan_min_age_minutes=args.orphan_min_age_minutes,
+    )
+    print_report(maintenance_report)
+    raise SystemExit(1 if maintenance_report['errors'] else 0)
@@ -1,10 +1,12 @@
 """
-Database migration script to add the chat_history table.
+Database migration script to add the chat_history table and upgrade table storage.
 Run this script to update your database schema.
 """
-from sqlalchemy import create_engine, MetaData, Table, Column, Integer, String, Text, DateTime, ForeignKey, Enum
+from sqlalchemy import create_engine, MetaData, Table, Column, Integer, String, Text, DateTime, ForeignKey, Enum, text, select
 from sqlalchemy.orm import sessionmaker
 import os
+import re
+import hashlib
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -16,7 +18,7 @@ POSTGRES_PASSWORD = os.getenv('POSTGRES_PASSWORD', 'Sweethome%40143')
 POSTGRES_HOST = os.getenv('POSTGRES_HOST', 'localhost')
 POSTGRES_PORT = os.getenv('POSTGRES_PORT', '5432')
 POSTGRES_DB = os.getenv('POSTGRES_DB', 'Adora_AI')
-DATABASE_URL = f"postgresql://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DB}"
+DATABASE_URL = os.getenv('DATABASE_URL') or f"postgresql://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DB}"
 
 def create_chat_history_table():
     """Create the chat_history table if it doesn't exist."""
@@ -73,7 +75,254 @@ def create_chat_history_table():
         print(f"❌ Error creating 'chat_history' table: {str(e)}")
         raise
 
+def upgrade_table_data_to_jsonb():
+    """Convert excel_tables.data to JSONB and add the GIN and file-id indexes."""
+    try:
+        engine = create_engine(DATABASE_URL)
+        if engine.dialect.name != 'postgresql':
+            print("ℹ️ JSONB storage only applies to PostgreSQL, skipping")
+            return
+        from sqlalchemy import inspect
+        inspector = inspect(engine)
+        data_column = next(col for col in inspector.get_columns('excel_tables') if col['name'] == 'data')
+        
+        with engine.begin() as conn:
+            if data_column['type'].__class__.__name__ != 'JSONB':
+                conn.execute(text("ALTER TABLE excel_tables ALTER COLUMN data TYPE JSONB USING data::jsonb"))
+                print("✅ Converted 'excel_tables.data' to JSONB")
+            else:
+                print("ℹ️ 'excel_tables.data' is already JSONB")
+                
+            conn.execute(text(
+                "CREATE INDEX IF NOT EXISTS ix_excel_tables_data_gin ON excel_tables USING GIN (data)"
+            ))
+            conn.execute(text(
+                "CREATE INDEX IF NOT EXISTS ix_excel_tables_excel_file_id ON excel_tables (excel_file_id)"
+            ))
+            print("✅ Ensured indexes on 'excel_tables'")
+            
+    except Exception as e:
+        print(f"❌ Error upgrading 'excel_tables' storage: {str(e)}")
+        raise
+
+def add_table_chunk_storage():
+    """Add the row_count/is_chunked columns and the excel_table_chunks table."""
+    try:
+        engine = create_engine(DATABASE_URL)
+        from sqlalchemy import inspect
+        from models import ExcelTableChunk
+        inspector = inspect(engine)
+        existing_columns = {col['name'] for col in inspector.get_columns('excel_tables')}
+        
+        with engine.begin() as conn:
+            if 'row_count' not in existing_columns:
+                conn.execute(text("ALTER TABLE excel_tables ADD COLUMN row_count INTEGER"))
+                length_fn = "jsonb_array_length(data::jsonb)" if engine.dialect.name == 'postgresql' else "json_array_length(data)"
+                conn.execute(text(f"UPDATE excel_tables SET row_count = {length_fn}"))
+                print("✅ Added 'row_count' column to 'excel_tables'")
+            if 'is_chunked' not in existing_columns:
+                conn.execute(text("ALTER TABLE excel_tables ADD COLUMN is_chunked BOOLEAN NOT NULL DEFAULT FALSE"))
+                print("✅ Added 'is_chunked' column to 'excel_tables'")
+                
+        if not inspector.has_table('excel_table_chunks'):
+            ExcelTableChunk.__table__.create(engine)
+            print("✅ Created 'excel_table_chunks' table")
+        else:
+            print("ℹ️ 'excel_table_chunks' table already exists")
+            
+    except Exception as e:
+        print(f"❌ Error adding table chunk storage: {str(e)}")
+        raise
+
+def add_table_profiles(backfill: bool = True):
+    """Add the excel_tables.profile column and compute profiles for existing tables."""
+    try:
+        engine = create_engine(DATABASE_URL)
+        from sqlalchemy import inspect
+        from models import ExcelTable, ExcelTableChunk
+        from profiling import profile_table
+        inspector = inspect(engine)
+        existing_columns = {col['name'] for col in inspector.get_columns('excel_tables')}
+        
+        if 'profile' not in existing_columns:
+            column_type = "JSONB" if engine.dialect.name == 'postgresql' else "JSON"
+            with engine.begin() as conn:
+                conn.execute(text(f"ALTER TABLE excel_tables ADD COLUMN profile {column_type}"))
+            print("✅ Added 'profile' column to 'excel_tables'")
+        else:
+            print("ℹ️ 'profile' column already exists on 'excel_tables'")
+        
+        if not backfill:
+            return
+        
+        # One table per transaction so only one table's rows are in memory at a time
+        tables = ExcelTable.__table__
+        chunks = ExcelTableChunk.__table__
+        with engine.connect() as conn:
+            pending = conn.execute(
+                select(tables.c.id, tables.c.is_chunked).where(tables.c.profile.is_(None)).order_by(tables.c.id)
+            ).all()
+        for table_id, is_chunked in pending:
+            with engine.begin() as conn:
+                if is_chunked:
+                    rows = [row for (data,) in conn.execute(
+                        select(chunks.c.data).where(chunks.c.excel_table_id == table_id).order_by(chunks.c.row_offset)
+                    ) for row in data]
+                else:
+                    rows = conn.execute(select(tables.c.data).where(tables.c.id == table_id)).scalar_one()
+                conn.execute(tables.update().where(tables.c.id == table_id).values(profile=profile_table(rows)))
+        print(f"✅ Computed profiles for {len(pending)} existing tables")
+            
+    except Exception as e:
+        print(f"❌ Error adding table profiles: {str(e)}")
+        raise
+
+def add_file_versions():
+    """Add the version chain and content hash columns used by incremental re-uploads."""
+    try:
+        engine = create_engine(DATABASE_URL)
+        from sqlalchemy import inspect
+        inspector = inspect(engine)
+        file_columns = {col['name'] for col in inspector.get_columns('excel_files')}
+        table_columns = {col['name'] for col in inspector.get_columns('excel_tables')}
+        json_type = "JSONB" if engine.dialect.name == 'postgresql' else "JSON"
+        
+        with engine.begin() as conn:
+            if 'version' not in file_columns:
+                conn.execute(text("ALTER TABLE excel_files ADD COLUMN version INTEGER NOT NULL DEFAULT 1"))
+                print("✅ Added 'version' column to 'excel_files'")
+            if 'parent_file_id' not in file_columns:
+                conn.execute(text(
+                    "ALTER TABLE excel_files ADD COLUMN parent_file_id INTEGER "
+                    "REFERENCES excel_files(id) ON DELETE SET NULL"
+                ))
+                print("✅ Added 'parent_file_id' column to 'excel_files'")
+            if 'sheet_hashes' not in file_columns:
+                conn.execute(text(f"ALTER TABLE excel_files ADD COLUMN sheet_hashes {json_type}"))
+                print("✅ Added 'sheet_hashes' column to 'excel_files'")
+            if 'content_hash' not in table_columns:
+                conn.execute(text("ALTER TABLE excel_tables ADD COLUMN content_hash VARCHAR(64)"))
+                print("✅ Added 'content_hash' column to 'excel_tables'")
+        # Existing files have no sheet hashes, so their next upload is parsed in full
+            
+    except Exception as e:
+        print(f"❌ Error adding file versions: {str(e)}")
+        raise
+
+def add_table_fingerprints(backfill: bool = True):
+    """Add the table/sheet fingerprint columns and compute them for existing tables."""
+    try:
+        engine = create_engine(DATABASE_URL)
+        from sqlalchemy import inspect
+        from models import ExcelTable, ExcelTableChunk
+        from excel_parser import fingerprint_table, fingerprint_sheet
+        inspector = inspect(engine)
+        existing_columns = {col['name'] for col in inspector.get_columns('excel_tables')}
+        
+        with engine.begin() as conn:
+            for column in ('fingerprint', 'sheet_fingerprint'):
+                if column not in existing_columns:
+                    conn.execute(text(f"ALTER TABLE excel_tables ADD COLUMN {column} VARCHAR(64)"))
+                    print(f"✅ Added '{column}' column to 'excel_tables'")
+            conn.execute(text(
+                "CREATE INDEX IF NOT EXISTS ix_excel_tables_fingerprint ON excel_tables (fingerprint)"
+            ))
+        
+        if not backfill:
+            return
+        
+        tables = ExcelTable.__table__
+        chunks = ExcelTableChunk.__table__
+        with engine.connect() as conn:
+            pending = conn.execute(
+                select(tables.c.id, tables.c.excel_file_id, tables.c.sheet_name, tables.c.table_name, tables.c.is_chunked)
+                .where(tables.c.fingerprint.is_(None)).order_by(tables.c.id)
+            ).all()
+        
+        # Table fingerprints, one table at a time; sheet fingerprints once all tables of a sheet are known
+        sheets = set()
+        for table_id, file_id, sheet_name, table_name, is_chunked in pending:
+            with engine.begin() as conn:
+                if is_chunked:
+                    rows = [row for (data,) in conn.execute(
+                        select(chunks.c.data).where(chunks.c.excel_table_id == table_id).order_by(chunks.c.row_offset)
+                    ) for row in data]
+                else:
+                    rows = conn.execute(select(tables.c.data).where(tables.c.id == table_id)).scalar_one()
+                fingerprint = fingerprint_table(rows)
+                conn.execute(tables.update().where(tables.c.id == table_id).values(fingerprint=fingerprint))
+            sheets.add((file_id, sheet_name))
+        
+        with engine.begin() as conn:
+            # Also sheets whose tables were all fingerprinted by an interrupted earlier run
+            sheets.update(conn.execute(
+                select(tables.c.excel_file_id, tables.c.sheet_name).where(tables.c.sheet_fingerprint.is_(None)).distinct()
+            ).all())
+            for file_id, sheet_name in sheets:
+                # From every table of the sheet, not only the ones fingerprinted in this run
+                table_fingerprints = dict(conn.execute(
+                    select(tables.c.table_name, tables.c.fingerprint).where(
+                        tables.c.excel_file_id == file_id, tables.c.sheet_name == sheet_name
+                    ).order_by(tables.c.id)
+                ).all())
+                conn.execute(tables.update().where(
+                    tables.c.excel_file_id == file_id, tables.c.sheet_name == sheet_name
+                ).values(sheet_fingerprint=fingerprint_sheet(table_fingerprints)))
+        print(f"✅ Computed fingerprints for {len(pending)} existing tables")
+            
+    except Exception as e:
+        print(f"❌ Error adding table fingerprints: {str(e)}")
+        raise
+
+def add_file_content_hashes():
+    """Add excel_files.content_hash, the hash of the file's bytes, and fill it from file_hash."""
+    try:
+        engine = create_engine(DATABASE_URL)
+        from sqlalchemy import inspect
+        inspector = inspect(engine)
+        file_columns = {col['name'] for col in inspector.get_columns('excel_files')}
+        
+        with engine.begin() as conn:
+            if 'content_hash' not in file_columns:
+                conn.execute(text("ALTER TABLE excel_files ADD COLUMN content_hash VARCHAR(64)"))
+                print("✅ Added 'content_hash' column to 'excel_files'")
+            conn.execute(text(
+                "CREATE INDEX IF NOT EXISTS ix_excel_files_content_hash ON excel_files (content_hash)"
+            ))
+            files = conn.execute(text(
+                "SELECT id, file_name, file_hash FROM excel_files WHERE content_hash IS NULL"
+            )).all()
+            known_hashes = set(conn.execute(text("SELECT file_hash FROM excel_files")).scalars())
+            
+            # Duplicates (named fileN.ext) got file_hash = sha256("<source file_hash>:<name>");
+            # find their source so they get its content hash rather than the derived one
+            sources = {}
+            duplicate_names = {name for _, name, _ in files if re.match(r'^file\d+', name)}
+            for name in duplicate_names:
+                for source_hash in known_hashes:
+                    derived = hashlib.sha256(f"{source_hash}:{name}".encode()).hexdigest()
+                    if derived in known_hashes:
+                        sources[derived] = source_hash
+            
+            for file_id, _, file_hash in files:
+                content_hash = file_hash
+                while content_hash in sources:
+                    content_hash = sources[content_hash]
+                conn.execute(text("UPDATE excel_files SET content_hash = :content_hash WHERE id = :id"),
+                             {'content_hash': content_hash, 'id': file_id})
+            print(f"✅ Filled content_hash for {len(files)} existing files ({len(sources)} duplicates)")
+            
+    except Exception as e:
+        print(f"❌ Error adding file content hashes: {str(e)}")
+        raise
+
 if __name__ == "__main__":
     print("Starting database migration...")
     create_chat_history_table()
+    upgrade_table_data_to_jsonb()
+    add_table_chunk_storage()
+    add_table_profiles()
+    add_file_versions()
+    add_table_fingerprints()
+    add_file_content_hashes()
     print("✅ Database migration completed")
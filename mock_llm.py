@@ -0,0 +1,244 @@
+"""
+Local stand-in for the OpenAI chat-completions API.
+
+Serves ``POST /v1/chat/completions`` (plain and ``stream=True`` server-sent
+events) with realistic timing: a time to first token, extra prefill time per
+1,000 prompt tokens and a delay per generated token, each with jitter. Responses
+carry ``usage`` counts, with prompt tokens counted by ``prompt_compiler``. The
+answer is filler text, so the chat pipeline's own cost (data loading, prompt
+building, transport) can be measured and load-tested without network or cost.
+
+``GET /v1/models`` is a health check and ``GET /v1/stats`` returns request and
+token counters, including the peak number of concurrent requests.
+
+Usage:
+    python mock_llm.py --port 8765 --latency-ms 400 --token-ms 20
+    LLM_PROVIDER=mock MOCK_LLM_URL=http://127.0.0.1:8765/v1 streamlit run app.py
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Any, Optional
+
+# Time to first token (ms)
+MOCK_LLM_LATENCY_MS = float(os.getenv('MOCK_LLM_LATENCY_MS', '300'))
+# Extra time to first token per 1,000 prompt tokens (ms)
+MOCK_LLM_PREFILL_MS_PER_1K = float(os.getenv('MOCK_LLM_PREFILL_MS_PER_1K', '20'))
+# Time per generated token (ms)
+MOCK_LLM_TOKEN_MS = float(os.getenv('MOCK_LLM_TOKEN_MS', '10'))
+# Tokens per answer, capped by the request's max_tokens
+MOCK_LLM_COMPLETION_TOKENS = int(os.getenv('MOCK_LLM_COMPLETION_TOKENS', '200'))
+# Random variation of every delay, as a fraction (0.1 = +/-10%)
+MOCK_LLM_JITTER = float(os.getenv('MOCK_LLM_JITTER', '0.1'))
+# Share of requests answered with HTTP 429, to exercise retries and error paths
+MOCK_LLM_ERROR_RATE = float(os.getenv('MOCK_LLM_ERROR_RATE', '0'))
+
+_FILLER = ("the data shows a steady trend across regions with totals in line with the "
+           "column profile and no unusual values in the sampled rows").split()
+
+def default_config() -> Dict[str, float]:
+    """Timing and behaviour settings from the MOCK_LLM_* environment variables."""
+    return {
+        'latency_ms': MOCK_LLM_LATENCY_MS,
+        'prefill_ms_per_1k': MOCK_LLM_PREFILL_MS_PER_1K,
+        'token_ms': MOCK_LLM_TOKEN_MS,
+        'completion_tokens': MOCK_LLM_COMPLETION_TOKENS,
+        'jitter': MOCK_LLM_JITTER,
+        'error_rate': MOCK_LLM_ERROR_RATE
+    }
+
+def _question(messages: List[Dict[str, str]]) -> str:
+    """The question of the last user message: its first line that is not a Markdown heading."""
+    for message in reversed(messages):
+        if message.get('role') == 'user':
+            for line in str(message.get('content', '')).splitlines():
+                if line.strip() and not line.lstrip().startswith('#'):
+                    return line.strip()[:200]
+    return ""
+
+def _answer_tokens(messages: List[Dict[str, str]], count: int) -> List[str]:
+    """A deterministic answer of ``count`` tokens (one word each) for the given messages."""
+    question = _question(messages)
+    words = [f"**Mock answer** to: {question}\n\n"] if question else []
+    offset = int(hashlib.md5(question.encode('utf-8')).hexdigest()[:4], 16)
+    while len(words) < count:
+        words.append(_FILLER[(offset + len(words)) % len(_FILLER)] + " ")
+    return words[:max(1, count)]
+
+class MockLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'MockLLM/1.0'
+    # Headers and body are separate writes; with Nagle's algorithm each response waits for a delayed ACK
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send_json(self, status: int, payload: Dict[str, Any]):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_event(self, payload):
+        data = b"data: " + (payload if isinstance(payload, bytes) else json.dumps(payload).encode('utf-8')) + b"\n\n"
+        # Chunked transfer encoding: size in hex, the data, CRLF
+        self.wfile.write(f"{len(data):X}\r\n".encode('ascii') + data + b"\r\n")
+        self.wfile.flush()
+
+    def _sleep(self, ms: float):
+        if ms > 0:
+            jitter = self.server.config['jitter']
+            time.sleep(ms * (1 + random.uniform(-jitter, jitter)) / 1000)
+
+    def do_GET(self):
+        if self.path.rstrip('/') == '/v1/models':
+            self._send_json(200, {'object': 'list', 'data': [{'id': 'mock', 'object': 'model', 'owned_by': 'mock'}]})
+        elif self.path.rstrip('/') == '/v1/stats':
+            self._send_json(200, self.server.snapshot())
+        else:
+            self._send_json(404, {'error': {'message': f"Unknown path {self.path}", 'type': 'invalid_request_error'}})
+
+    def do_POST(self):
+        if self.path.rstrip('/') != '/v1/chat/completions':
+            self._send_json(404, {'error': {'message': f"Unknown path {self.path}", 'type': 'invalid_request_error'}})
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length') or 0)) or b'{}')
+            messages = request['messages']
+        except (ValueError, KeyError) as e:
+            self._send_json(400, {'error': {'message': f"Invalid request: {str(e)}", 'type': 'invalid_request_error'}})
+            return
+
+        config = self.server.config
+        self.server.record(active=1)
+        try:
+            if random.random() < config['error_rate']:
+                self.server.record(errors=1)
+                self._send_json(429, {'error': {'message': "Rate limit reached (mock)", 'type': 'rate_limit_error'}})
+                return
+
+            from prompt_compiler import count_message_tokens
+            model = request.get('model', 'mock')
+            prompt_tokens = count_message_tokens(messages, model)
+            completion_tokens = min(config['completion_tokens'], request.get('max_tokens') or config['completion_tokens'])
+            tokens = _answer_tokens(messages, completion_tokens)
+            usage = {'prompt_tokens': prompt_tokens, 'completion_tokens': len(tokens),
+                     'total_tokens': prompt_tokens + len(tokens)}
+            completion_id = f"chatcmpl-mock-{uuid.uuid4().hex[:12]}"
+            created = int(time.time())
+
+            self._sleep(config['latency_ms'] + config['prefill_ms_per_1k'] * prompt_tokens / 1000)
+            if request.get('stream'):
+                self.server.record(streamed=1)
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Cache-Control', 'no-cache')
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+                chunk = {'id': completion_id, 'object': 'chat.completion.chunk', 'created': created, 'model': model}
+                for i, token in enumerate(tokens):
+                    if i:
+                        self._sleep(config['token_ms'])
+                    delta = {'role': 'assistant', 'content': token} if i == 0 else {'content': token}
+                    self._send_event({**chunk, 'choices': [{'index': 0, 'delta': delta, 'finish_reason': None}]})
+                self._send_event({**chunk, 'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}]})
+                if (request.get('stream_options') or {}).get('include_usage'):
+                    self._send_event({**chunk, 'choices': [], 'usage': usage})
+                self._send_event(b"[DONE]")
+                self.wfile.write(b"0\r\n\r\n")
+            else:
+                self._sleep(config['token_ms'] * (len(tokens) - 1))
+                self._send_json(200, {
+                    'id': completion_id,
+                    'object': 'chat.completion',
+                    'created': created,
+                    'model': model,
+                    'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': "".join(tokens).strip()},
+                                 'finish_reason': 'stop'}],
+                    'usage': usage
+                })
+            self.server.record(requests=1, prompt_tokens=prompt_tokens, completion_tokens=len(tokens))
+        finally:
+            self.server.record(active=-1)
+
+class MockLLMServer(ThreadingHTTPServer):
+    """Threaded HTTP server holding the timing config and request counters."""
+    daemon_threads = True
+    # Load tests open many connections at once; the default backlog of 5 drops some
+    request_queue_size = 256
+
+    def __init__(self, address, config: Dict[str, float], verbose: bool = False):
+        super().__init__(address, MockLLMHandler)
+        self.config = config
+        self.verbose = verbose
+        self._lock = threading.Lock()
+        self.stats = {'requests': 0, 'streamed': 0, 'errors': 0, 'prompt_tokens': 0,
+                      'completion_tokens': 0, 'active': 0, 'peak_active': 0}
+
+    def record(self, **counts):
+        with self._lock:
+            for key, value in counts.items():
+                self.stats[key] += value
+            self.stats['peak_active'] = max(self.stats['peak_active'], self.stats['active'])
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self.stats)
+
+def start_server(host: str = '127.0.0.1', port: int = 0, verbose: bool = False,
+                 **config) -> Dict[str, Any]:
+    """
+    Start the mock server in a background thread.
+
+    Args:
+        host: Interface to bind
+        port: Port to bind; 0 picks a free port
+        verbose: Log every request to stderr
+        **config: Overrides of ``default_config()``, e.g. latency_ms=0, token_ms=0
+
+    Returns:
+        dict: url (the API base URL, ending in /v1), server and thread
+    """
+    settings = default_config()
+    unknown = set(config) - set(settings)
+    if unknown:
+        raise ValueError(f"Unknown mock LLM settings: {', '.join(sorted(unknown))}")
+    settings.update(config)
+    server = MockLLMServer((host, port), settings, verbose)
+    thread = threading.Thread(target=server.serve_forever, name='mock-llm', daemon=True)
+    thread.start()
+    return {'url': f"http://{host}:{server.server_address[1]}/v1", 'server': server, 'thread': thread}
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Run a local stand-in for the OpenAI chat-completions API")
+    arg_parser.add_argument("--host", default="127.0.0.1")
+    arg_parser.add_argument("--port", type=int, default=8765)
+    arg_parser.add_argument("--latency-ms", type=float, default=MOCK_LLM_LATENCY_MS, help="Time to first token")
+    arg_parser.add_argument("--prefill-ms-per-1k", type=float, default=MOCK_LLM_PREFILL_MS_PER_1K,
+                            help="Extra time to first token per 1,000 prompt tokens")
+    arg_parser.add_argument("--token-ms", type=float, default=MOCK_LLM_TOKEN_MS, help="Time per generated token")
+    arg_parser.add_argument("--completion-tokens", type=int, default=MOCK_LLM_COMPLETION_TOKENS)
+    arg_parser.add_argument("--jitter", type=float, default=MOCK_LLM_JITTER)
+    arg_parser.add_argument("--error-rate", type=float, default=MOCK_LLM_ERROR_RATE)
+    arg_parser.add_argument("--verbose", action="store_true", help="Log every request")
+    args = arg_parser.parse_args()
+
+    settings = {key: value for key, value in vars(args).items() if key not in ('host', 'port', 'verbose')}
+    server = MockLLMServer((args.host, args.port), settings, args.verbose)
+    print(f"Mock LLM listening on http://{args.host}:{server.server_address[1]}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -1,4 +1,5 @@
-from sqlalchemy import Column, String, Text, DateTime, Integer, JSON, ForeignKey, Enum
+from sqlalchemy import Column, String, Text, DateTime, Integer, Boolean, JSON, ForeignKey, Enum, Index, false
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from datetime import datetime
@@ -7,6 +8,10 @@ from typing import Optional
 
 Base = declarative_base()
 
+# Table rows are stored as binary JSONB on PostgreSQL so they can be indexed and
+# queried server-side; other backends fall back to the generic JSON type.
+TableData = JSON().with_variant(JSONB(), 'postgresql')
+
 class MessageRole(PyEnum):
     USER = "user"
     ASSISTANT = "assistant"
@@ -18,18 +23,61 @@ class ExcelFile(Base):
     file_name = Column(String(255), nullable=False)
     file_path = Column(String(512), nullable=False)
     file_hash = Column(String(64), nullable=False, unique=True)
+    # SHA-256 of the file's bytes. Equals file_hash except for duplicates made with
+    # database.duplicate_excel_file, which share the original's bytes but need a unique file_hash
+    content_hash = Column(String(64), nullable=True, index=True)
     uploaded_at = Column(DateTime, default=datetime.utcnow)
-    tables = relationship("ExcelTable", back_populates="excel_file", cascade="all, delete-orphan")
-    chat_messages = relationship("ChatHistory", back_populates="excel_file", cascade="all, delete-orphan")
+    # Re-uploads of a changed workbook form a version chain; see database.save_excel_file
+    version = Column(Integer, nullable=False, default=1, server_default='1')
+    parent_file_id = Column(Integer, ForeignKey('excel_files.id', ondelete='SET NULL'), nullable=True)
+    # Sheet name -> content hash (excel_parser.calculate_sheet_hashes), used to find unchanged sheets
+    sheet_hashes = Column(TableData, nullable=True)
+    # passive_deletes leaves child rows to ON DELETE CASCADE instead of loading them
+    tables = relationship("ExcelTable", back_populates="excel_file", cascade="all, delete-orphan",
+                          passive_deletes=True)
+    chat_messages = relationship("ChatHistory", back_populates="excel_file", cascade="all, delete-orphan",
+                                 passive_deletes=True)
 
 class ExcelTable(Base):
     __tablename__ = 'excel_tables'
     id = Column(Integer, primary_key=True, autoincrement=True)
-    excel_file_id = Column(Integer, ForeignKey('excel_files.id', ondelete='CASCADE'))
+    excel_file_id = Column(Integer, ForeignKey('excel_files.id', ondelete='CASCADE'), index=True)
     sheet_name = Column(String(255), nullable=False)
     table_name = Column(String(255), nullable=False)
-    data = Column(JSON, nullable=False)
+    data = Column(TableData, nullable=False)
+    row_count = Column(Integer, nullable=True)
+    # Chunked tables keep an empty ``data`` array and store their rows in ExcelTableChunk
+    is_chunked = Column(Boolean, nullable=False, default=False, server_default=false())
+    # Per-column statistics computed at upload time (see profiling.profile_table)
+    profile = Column(TableData, nullable=True)
+    # SHA-256 of the table's rows, used to reuse unchanged tables across versions
+    content_hash = Column(String(64), nullable=True)
+    # Fingerprints over normalized cell values (excel_parser.fingerprint_table/fingerprint_sheet);
+    # unlike content_hash they ignore formatting-only differences, so caches can key on them
+    fingerprint = Column(String(64), nullable=True, index=True)
+    sheet_fingerprint = Column(String(64), nullable=True)
     excel_file = relationship("ExcelFile", back_populates="tables")
+    chunks = relationship("ExcelTableChunk", back_populates="excel_table", cascade="all, delete-orphan",
+                          passive_deletes=True, order_by="ExcelTableChunk.row_offset")
+
+    __table_args__ = (
+        Index('ix_excel_tables_data_gin', 'data', postgresql_using='gin').ddl_if(dialect='postgresql'),
+    )
+
+class ExcelTableChunk(Base):
+    __tablename__ = 'excel_table_chunks'
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    excel_table_id = Column(Integer, ForeignKey('excel_tables.id', ondelete='CASCADE'), nullable=False)
+    chunk_index = Column(Integer, nullable=False)
+    row_offset = Column(Integer, nullable=False)  # Index of the chunk's first row within the table
+    row_count = Column(Integer, nullable=False)
+    data = Column(TableData, nullable=False)
+    excel_table = relationship("ExcelTable", back_populates="chunks")
+
+    __table_args__ = (
+        Index('ix_excel_table_chunks_table_offset', 'excel_table_id', 'row_offset', unique=True),
+        Index('ix_excel_table_chunks_data_gin', 'data', postgresql_using='gin').ddl_if(dialect='postgresql'),
+    )
 
 class ChatHistory(Base):
     __tablename__ = 'chat_history'
@@ -0,0 +1,230 @@
+"""
+Per-column statistics computed when a table is saved.
+
+``profile_table`` turns a table's rows into a JSON-serializable profile with,
+for every column: inferred type, null count, min/max/sum/mean for numeric and
+date columns, an approximate distinct count (HyperLogLog) and the most frequent
+values. Rows are processed in slices of ``PROFILE_CHUNK_ROWS`` so large tables
+are never materialized as a single DataFrame; per-slice results are merged.
+"""
+import os
+import math
+import numpy as np
+import pandas as pd
+from typing import Dict, Any, List, Optional
+
+# Number of most frequent values kept per column
+PROFILE_TOP_K = int(os.getenv('PROFILE_TOP_K', '5'))
+# Rows converted to a DataFrame at a time while profiling
+PROFILE_CHUNK_ROWS = int(os.getenv('PROFILE_CHUNK_ROWS', '50000'))
+# HyperLogLog precision; 2**p registers, standard error about 1.04 / sqrt(2**p)
+HLL_PRECISION = int(os.getenv('HLL_PRECISION', '12'))
+
+# Number of candidate values tracked per column when merging slices for top-k
+_TOP_K_CANDIDATES = 20
+
+_NUMERIC_KINDS = {'integer', 'floating', 'mixed-integer-float', 'decimal'}
+
+class HyperLogLog:
+    """HyperLogLog distinct-count sketch updated with vectorized 64-bit hashes."""
+
+    def __init__(self, precision: int = HLL_PRECISION):
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8)
+
+    def add_hashes(self, hashes: np.ndarray):
+        """Add an array of uint64 hashes to the sketch."""
+        if len(hashes) == 0:
+            return
+        hashes = hashes.astype(np.uint64, copy=False)
+        index = (hashes >> np.uint64(64 - self.precision)).astype(np.int64)
+        remainder = hashes << np.uint64(self.precision)
+        # Rank is the position of the leftmost 1-bit in the remaining 64 - p bits
+        max_rank = 64 - self.precision + 1
+        with np.errstate(divide='ignore'):
+            leading_zeros = 63 - np.floor(np.log2(remainder.astype(np.float64)))
+        rank = np.where(remainder == 0, max_rank, np.minimum(leading_zeros + 1, max_rank)).astype(np.uint8)
+        np.maximum.at(self.registers, index, rank)
+
+    def add(self, series: pd.Series):
+        """Add the values of a series to the sketch."""
+        self.add_hashes(pd.util.hash_pandas_object(series, index=False).to_numpy())
+
+    def merge(self, other: 'HyperLogLog'):
+        """Merge another sketch with the same precision into this one."""
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+    def estimate(self) -> int:
+        """Return the estimated number of distinct values added."""
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.sum(np.power(2.0, -self.registers.astype(np.float64)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * m and zeros:
+            # Linear counting is more accurate for small cardinalities
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+def _json_value(value):
+    """Convert a NumPy/pandas scalar to a JSON-serializable Python value."""
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, pd.Timestamp):
+        return value.isoformat()
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    return value
+
+def _parse_dates(values: pd.Series) -> Optional[pd.Series]:
+    """Parse ISO date strings (as written by serialize_data), or None if they cannot be parsed."""
+    try:
+        try:
+            return pd.to_datetime(values, format='ISO8601', errors='coerce')
+        except ValueError:
+            # pandas < 2.0 has no 'ISO8601' format
+            return pd.to_datetime(values, errors='coerce')
+    except (TypeError, ValueError, OverflowError):
+        return None
+
+class ColumnProfiler:
+    """Accumulates the statistics of one column over successive slices of rows."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.count = 0
+        self.null_count = 0
+        self.kinds = set()
+        self.ranges = {}
+        self.total = 0.0
+        self.numeric_count = 0
+        self.sketch = HyperLogLog()
+        self.value_counts = pd.Series(dtype='int64')
+
+    def _update_range(self, kind: str, minimum, maximum):
+        if kind in self.ranges:
+            low, high = self.ranges[kind]
+            minimum, maximum = min(low, minimum), max(high, maximum)
+        self.ranges[kind] = (minimum, maximum)
+
+    def update(self, series: pd.Series):
+        """Add a slice of the column's values."""
+        values = series.dropna()
+        self.null_count += len(series) - len(values)
+        self.count += len(values)
+        if values.empty:
+            return
+
+        kind = pd.api.types.infer_dtype(values, skipna=True)
+        if kind in _NUMERIC_KINDS:
+            numbers = pd.to_numeric(values, errors='coerce').dropna()
+            self.kinds.add('number')
+            if not numbers.empty:
+                self._update_range('number', float(numbers.min()), float(numbers.max()))
+                self.total += float(numbers.sum())
+                self.numeric_count += len(numbers)
+        elif kind == 'boolean':
+            self.kinds.add('boolean')
+        elif kind == 'string':
+            dates = _parse_dates(values)
+            if dates is not None and dates.notna().all():
+                self.kinds.add('datetime')
+                self._update_range('datetime', dates.min(), dates.max())
+            else:
+                self.kinds.add('string')
+        else:
+            self.kinds.add('mixed')
+
+        self.sketch.add(values)
+        counts = values.value_counts()
+        self.value_counts = self.value_counts.add(counts, fill_value=0).nlargest(
+            max(PROFILE_TOP_K, _TOP_K_CANDIDATES)
+        )
+
+    def result(self) -> Dict[str, Any]:
+        """Return the column profile as a JSON-serializable dict."""
+        dtype = next(iter(self.kinds)) if len(self.kinds) == 1 else ('mixed' if self.kinds else 'empty')
+        profile = {
+            'name': self.name,
+            'dtype': dtype,
+            'count': self.count,
+            'null_count': self.null_count,
+            'distinct_estimate': min(self.sketch.estimate(), self.count),
+            # Values seen only once are not "frequent", e.g. in ID columns
+            'top_values': [
+                [_json_value(value), int(count)]
+                for value, count in self.value_counts.nlargest(PROFILE_TOP_K).items()
+                if count > 1
+            ]
+        }
+        if dtype in self.ranges:
+            profile['min'] = _json_value(self.ranges[dtype][0])
+            profile['max'] = _json_value(self.ranges[dtype][1])
+        if dtype == 'number' and self.numeric_count:
+            profile['sum'] = _json_value(self.total)
+            profile['mean'] = _json_value(self.total / self.numeric_count)
+        return profile
+
+def profile_table(rows: List[Dict[str, Any]], chunk_rows: int = PROFILE_CHUNK_ROWS) -> Dict[str, Any]:
+    """
+    Compute a per-column profile for a table's rows.
+
+    Args:
+        rows: Table rows as a list of dicts
+        chunk_rows: Number of rows converted to a DataFrame at a time
+
+    Returns:
+        dict: ``{'row_count': int, 'columns': [column profile, ...]}`` with
+            columns in the order they first appear
+    """
+    chunk_rows = max(1, chunk_rows)
+    profilers = {}
+    for start in range(0, len(rows), chunk_rows):
+        df = pd.DataFrame.from_records(rows[start:start + chunk_rows])
+        for column in df.columns:
+            profiler = profilers.get(column)
+            if profiler is None:
+                profiler = profilers[column] = ColumnProfiler(str(column))
+                # Rows from earlier slices did not have this column at all
+                profiler.null_count += start
+            profiler.update(df[column])
+        for column, profiler in profilers.items():
+            if column not in df.columns:
+                profiler.null_count += len(df)
+
+    return {
+        'row_count': len(rows),
+        'columns': [profiler.result() for profiler in profilers.values()]
+    }
+
+def format_profile(profile: Optional[Dict[str, Any]]) -> str:
+    """
+    Render a table profile as a Markdown table for use in prompts.
+
+    Args:
+        profile: Profile as returned by ``profile_table``
+
+    Returns:
+        str: Markdown table with one row per column, or an empty string
+    """
+    if not profile or not profile.get('columns'):
+        return ""
+
+    def cell(value) -> str:
+        if value is None:
+            return ""
+        if isinstance(value, float):
+            return f"{value:,.0f}" if value.is_integer() else f"{value:,.4f}".rstrip('0')
+        return str(value).replace('|', '\\|')
+
+    lines = [
+        "| Column | Type | Non-null | Nulls | Distinct (est.) | Min | Max | Sum | Mean | Top values |",
+        "|---|---|---|---|---|---|---|---|---|---|"
+    ]
+    for column in profile['columns']:
+        top_values = ", ".join(f"{cell(value)} ({count})" for value, count in column.get('top_values', []))
+        lines.append("| " + " | ".join([
+            cell(column['name']), column['dtype'], f"{column['count']:,}", f"{column['null_count']:,}",
+            f"{column['distinct_estimate']:,}", cell(column.get('min')), cell(column.get('max')),
+            cell(column.get('sum')), cell(column.get('mean')), top_values
+        ]) + " |")
+    return "\n".join(lines)
@@ -0,0 +1,414 @@
+"""
+Token-budgeted prompt compiler for questions about stored tables.
+
+``compile_prompt`` takes the table catalog built by ``ai_utils.prepare_analysis_data``
+and a question, and fills a hard token budget in priority order:
+
+1. the schema of every table (sheet, name, row count, columns and types)
+2. the column profiles, computed over all rows at upload time
+3. a few sample rows per table
+4. further rows, shared out between tables in blocks until the budget is used
+
+Tables whose sheet or table name appears in the question are served first at
+every level. Tokens are counted with tiktoken when it is installed and with a
+conservative local estimate otherwise, and the compiled prompt plus the reserved
+response tokens never exceed the model's context window.
+"""
+import math
+import os
+import re
+from typing import Callable, Dict, Iterable, List, Any, Optional
+
+# Hard limit for the prompt (system + user message) in tokens; also capped by the context window
+PROMPT_TOKEN_BUDGET = int(os.getenv('PROMPT_TOKEN_BUDGET', '12000'))
+# Rows shown per table at the sample level
+PROMPT_SAMPLE_ROWS = int(os.getenv('PROMPT_SAMPLE_ROWS', '3'))
+# Rows added per table per round when the remaining budget is shared out
+PROMPT_ROW_BLOCK = int(os.getenv('PROMPT_ROW_BLOCK', '25'))
+# Longest cell value shown in row tables; longer values are cut
+PROMPT_MAX_CELL_CHARS = int(os.getenv('PROMPT_MAX_CELL_CHARS', '50'))
+
+# Context window (tokens) per model name prefix; the longest matching prefix wins
+MODEL_CONTEXT_WINDOWS = {
+    'gpt-4-turbo': 128000,
+    'gpt-4-1106': 128000,
+    'gpt-4-0125': 128000,
+    'gpt-4o': 128000,
+    'gpt-4-32k': 32768,
+    'gpt-4': 8192,
+    'gpt-3.5-turbo': 16385,
+}
+DEFAULT_CONTEXT_WINDOW = 8192
+
+# Tokens added per chat message and for priming the reply (OpenAI chat format)
+_TOKENS_PER_MESSAGE = 4
+_TOKENS_PER_REPLY = 3
+# Safety factor applied to the local estimate, which has no vocabulary to go by
+_ESTIMATE_MARGIN = 1.15
+_ESTIMATE_PIECES = re.compile(r"\s?[A-Za-z]+|\s?\d{1,3}|\s?[^\sA-Za-z\d]+|\s+")
+
+_encodings = {}
+
+class PromptBudgetError(ValueError):
+    """Raised when not even the instructions, the question and one table schema fit the budget."""
+
+def context_window(model: str) -> int:
+    """Return the context window of a model in tokens."""
+    matches = [prefix for prefix in MODEL_CONTEXT_WINDOWS if model.startswith(prefix)]
+    return MODEL_CONTEXT_WINDOWS[max(matches, key=len)] if matches else DEFAULT_CONTEXT_WINDOW
+
+def _get_encoding(model: str):
+    """Return the tiktoken encoding for a model, or None when tiktoken is unavailable."""
+    if model not in _encodings:
+        try:
+            import tiktoken
+            try:
+                _encodings[model] = tiktoken.encoding_for_model(model)
+            except KeyError:
+                _encodings[model] = tiktoken.get_encoding('cl100k_base')
+        except Exception as e:
+            # Not installed, or its vocabulary cannot be loaded (e.g. offline on first use)
+            if None not in _encodings.values():
+                print(f"Warning: tiktoken unavailable ({str(e)}); estimating token counts")
+            _encodings[model] = None
+    return _encodings[model]
+
+def _estimate_tokens(text: str) -> int:
+    """Estimate the token count without a vocabulary: about 4 letters or 3 digits per token."""
+    tokens = 0
+    for piece in _ESTIMATE_PIECES.findall(text):
+        if piece.isascii():
+            tokens += math.ceil(len(piece.strip() or piece) / 4)
+        else:
+            # Emoji and non-Latin text take roughly one token per 2 UTF-8 bytes
+            tokens += math.ceil(len(piece.encode('utf-8')) / 2)
+    return math.ceil(tokens * _ESTIMATE_MARGIN)
+
+def tokenizer_name(model: str) -> str:
+    """Name of the tokenizer ``count_tokens`` uses for a model."""
+    encoding = _get_encoding(model)
+    return f"tiktoken:{encoding.name}" if encoding else "estimate"
+
+def count_tokens(text: str, model: str) -> int:
+    """Count the tokens of a text for a model."""
+    if not text:
+        return 0
+    encoding = _get_encoding(model)
+    if encoding is None:
+        return _estimate_tokens(text)
+    return len(encoding.encode(text, disallowed_special=()))
+
+def count_message_tokens(messages: List[Dict[str, str]], model: str) -> int:
+    """Count the prompt tokens of a list of chat messages, including the per-message overhead."""
+    return sum(count_tokens(message['content'], model) + _TOKENS_PER_MESSAGE for message in messages) + _TOKENS_PER_REPLY
+
+def _cell(value) -> str:
+    """Format a value for a Markdown table cell."""
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return ""
+    text = str(value)
+    if text in ('nan', 'None', 'NaT'):
+        return ""
+    text = text.replace("\n", " ").replace("|", "\\|")
+    if len(text) > PROMPT_MAX_CELL_CHARS:
+        text = text[:PROMPT_MAX_CELL_CHARS] + "..."
+    return text
+
+def _row_line(row: Dict[str, Any], columns: List[str]) -> str:
+    return "| " + " | ".join(_cell(row.get(column)) for column in columns) + " |"
+
+class _LazyRows:
+    """
+    The rows of one table, read from its row source on first use.
+
+    At most ``limit`` rows (as many as could fit the budget) are read, in one call
+    to ``source(start, stop)``. Rows are only formatted when a row table is built.
+    """
+
+    def __init__(self, source: Callable[[int, int], Iterable[Dict[str, Any]]], limit: int):
+        self._source = source
+        self._limit = limit
+        self._rows = None
+
+    def _load(self) -> List[Dict[str, Any]]:
+        if self._rows is None:
+            self._rows = list(self._source(0, self._limit)) if self._limit > 0 else []
+        return self._rows
+
+    def __len__(self) -> int:
+        return len(self._load())
+
+    def __getitem__(self, index):
+        return self._load()[index]
+
+def _row_limit(columns: List[str], total_rows: int, budget: int) -> int:
+    """Most rows of a table that could fit the budget; a row line costs at least a token per two cells."""
+    return min(total_rows, max(PROMPT_SAMPLE_ROWS, budget // (len(columns) // 2 + 2)))
+
+def _catalog_entry(entry: Dict[str, Any], index: int, budget: int) -> Dict[str, Any]:
+    """Normalize an ``analysis_data`` entry; ``data`` or ``row_source`` is required."""
+    data = entry.get('data') or entry.get('sample_data') or []
+    source = entry.get('row_source') or (lambda start, stop: data[start:stop])
+    profile = entry.get('profile')
+    columns = entry.get('columns') or [column['name'] for column in (profile or {}).get('columns', [])]
+    if not columns:
+        columns = [key for row in source(0, 1) for key in row]
+    # The profile has the types inferred at upload; column_types may just say "object"
+    column_types = ({column['name']: column['dtype'] for column in profile['columns']}
+                    if profile and profile.get('columns') else entry.get('column_types') or {})
+    total_rows = entry.get('total_rows', len(data))
+    return {
+        'sheet': entry.get('sheet', 'Unknown Sheet'),
+        'table': entry.get('table', f'Table {index}'),
+        'columns': columns,
+        'column_types': column_types,
+        'total_rows': total_rows,
+        'profile': profile,
+        'rows': _LazyRows(source, _row_limit(columns, total_rows, budget))
+    }
+
+def mentions(question: str, table: Dict[str, Any]) -> bool:
+    """Whether the question names a table (a catalog entry with 'table' and 'sheet') or its sheet."""
+    question = question.lower()
+    return any(len(str(name)) > 2 and str(name).lower() in question for name in (table['table'], table['sheet']))
+
+def _system_message(sheets: List[str], total_tables: int) -> Dict[str, str]:
+    return {
+        "role": "system",
+        "content": f"""# Multi-Sheet Excel Data Analysis Assistant
+
+You are an expert data analyst AI that helps users understand and work with Excel data across {len(sheets)} sheets and {total_tables} tables. Your responses should be:
+
+## Response Guidelines:
+- **Accuracy**: Base responses strictly on the provided data from all sheets and tables
+- **Clarity**: Use clear, concise language with proper Markdown formatting
+- **Insightful**: Provide meaningful analysis and insights across all sheets and tables
+- **Structured**: Organize information with headers, lists, and tables
+- **Helpful**: Offer explanations and context for non-technical users
+- **Honest**: Acknowledge data limitations when present
+
+## Data Analysis Approach:
+1. **Understand the Data**:
+   - Review all provided tables and their structures across all sheets
+   - Note column names, data types, and sample values
+   - Use the column profiles (computed over every row) for counts, totals, averages, ranges, distinct values and most frequent values
+   - Identify relationships between tables and sheets
+   - Pay attention to the sheet and table names for context
+
+2. **Analyze the Query**:
+   - Carefully read and understand the user's question
+   - Identify which sheets and tables are relevant to the question
+   - Consider any calculations or transformations needed across sheets
+   - If specific sheet/table is mentioned, focus on that data
+
+3. **Provide Response**:
+   - Start with a direct answer to the query
+   - Include supporting data and calculations from relevant sheets/tables
+   - Clearly indicate which sheet and table each piece of data comes from
+   - Explain your reasoning and methodology
+   - Highlight any limitations or assumptions
+   - Suggest follow-up questions or analyses
+
+4. **Formatting**:
+   - Use Markdown for clear formatting
+   - Include tables for tabular data (use markdown tables)
+   - Use bullet points for lists
+   - **Bold** important information
+   - Use headers to organize different sections
+   - Always mention the sheet and table names when referencing data
+   - Use code blocks for data samples or calculations
+
+5. **Important Notes**:
+   - The data comes from {len(sheets)} sheets: {', '.join(sheets)}
+   - Each sheet may contain multiple tables
+   - Pay attention to the table names and sheet names in the data
+   - If the user asks about a specific sheet or table, make sure to reference the correct one
+   - Large tables are shown partially; each row listing says which rows it contains. Do not compute totals or counts from partial rows, use the column profiles instead"""
+    }
+
+def _user_message(question: str, tables: List[Dict[str, Any]], parts: Dict[int, Dict[str, Any]],
+                  sheets: List[str]) -> Dict[str, str]:
+    prompt_parts = [f"# USER QUESTION:\n{question}\n"]
+    prompt_parts.append("## AVAILABLE DATA SUMMARY")
+    prompt_parts.append(f"- Total Sheets: {len(sheets)}")
+    prompt_parts.append(f"- Total Tables: {len(tables)}")
+    omitted = [f"{table['sheet']} / {table['table']}" for i, table in enumerate(tables) if not parts[i]['schema']]
+    if omitted:
+        prompt_parts.append(f"- Left out to fit the token budget: {', '.join(omitted)}")
+
+    for sheet in sheets:
+        in_sheet = [i for i, table in enumerate(tables) if table['sheet'] == sheet and parts[i]['schema']]
+        if not in_sheet:
+            continue
+        prompt_parts.append(f"\n## 📑 SHEET: {sheet}")
+        prompt_parts.append(f"**Tables in this sheet:** {len(in_sheet)}")
+        for i in in_sheet:
+            prompt_parts.append(parts[i]['schema'])
+            if parts[i]['profile']:
+                prompt_parts.append(parts[i]['profile'])
+            if parts[i]['rows']:
+                prompt_parts.append(_rows_block(tables[i], parts[i]['rows']))
+            prompt_parts.append("\n---")
+
+    prompt_parts.append(f"\n# QUESTION TO ANSWER:\n{question}")
+    prompt_parts.append("""
+## INSTRUCTIONS FOR YOUR RESPONSE:
+1. Start with a clear, concise answer to the question
+2. Reference specific sheets and tables when providing data
+3. Include relevant data points and calculations
+4. Format your response with markdown for clarity
+5. If multiple sheets/tables are relevant, compare and contrast the data
+6. If the question is unclear or data is missing, ask for clarification
+""")
+    return {"role": "user", "content": "\n".join(prompt_parts)}
+
+def _schema_block(table: Dict[str, Any]) -> str:
+    columns = ", ".join(
+        f"{column} ({table['column_types'][column]})" if column in table['column_types'] else str(column)
+        for column in table['columns']
+    )
+    return (f"\n### Table: {table['table']}\n"
+            f"- **Total Rows**: {table['total_rows']:,}\n"
+            f"- **Columns**: {columns}")
+
+def _profile_block(table: Dict[str, Any]) -> str:
+    from profiling import format_profile
+    profile_markdown = format_profile(table['profile'])
+    return f"\n**Column Profile (computed over all rows):**\n{profile_markdown}" if profile_markdown else ""
+
+def _rows_title(table: Dict[str, Any], count: int) -> str:
+    if count >= table['total_rows']:
+        return f"\n**All {table['total_rows']:,} rows:**"
+    if count <= PROMPT_SAMPLE_ROWS:
+        return f"\n**Sample Data (first {count} of {table['total_rows']:,} rows):**"
+    return f"\n**Rows 1-{count:,} of {table['total_rows']:,}:**"
+
+def _rows_header(table: Dict[str, Any]) -> str:
+    columns = table['columns']
+    return ("| " + " | ".join(_cell(column) for column in columns) + " |\n"
+            "|" + "|".join("---" for _ in columns) + "|")
+
+def _rows_block(table: Dict[str, Any], count: int) -> str:
+    lines = [_rows_title(table, count), _rows_header(table)]
+    lines.extend(_row_line(row, table['columns']) for row in table['rows'][:count])
+    return "\n".join(lines)
+
+def compile_prompt(catalog: List[Dict[str, Any]], question: str, token_budget: Optional[int] = None,
+                   model: str = "gpt-4-turbo-preview", response_tokens: int = 4000) -> Dict[str, Any]:
+    """
+    Compile the chat messages for a question about a set of tables within a token budget.
+
+    Args:
+        catalog: Table entries as built by ``ai_utils.prepare_analysis_data``
+            (sheet, table, columns, column_types, total_rows, profile, and the rows
+            as a ``data`` list or a lazy ``row_source(start, stop)`` callable)
+        question: User's question
+        token_budget: Prompt token limit (default: PROMPT_TOKEN_BUDGET)
+        model: Model the prompt is for; selects the tokenizer and context window
+        response_tokens: Tokens reserved for the answer (the request's max_tokens)
+
+    Returns:
+        dict: messages, prompt_tokens, budget, tokenizer and tables (per table:
+            sheet, table, total_rows, and the schema/profile/rows included)
+
+    Raises:
+        PromptBudgetError: If the instructions, question and one table schema do not fit
+    """
+    budget = min(token_budget or PROMPT_TOKEN_BUDGET, context_window(model) - response_tokens)
+    tables = [_catalog_entry(entry, i, budget) for i, entry in enumerate(catalog, 1)]
+    sheets = list(dict.fromkeys(table['sheet'] for table in tables))
+    parts = {i: {'schema': '', 'profile': '', 'rows': 0} for i in range(len(tables))}
+
+    def measure() -> List[Dict[str, str]]:
+        return [_system_message(sheets, len(tables)), _user_message(question, tables, parts, sheets)]
+
+    remaining = budget - count_message_tokens(measure(), model)
+    # Questions that name a table or sheet get its data first
+    order = sorted(range(len(tables)), key=lambda i: not mentions(question, tables[i]))
+
+    # Levels 1-3: the schema, profile and sample of each table, whole or not at all.
+    # A part costs its own tokens plus the newlines joining it to the prompt; a schema
+    # also pays for the table separator and, for the first table of a sheet, the sheet header.
+    sheets_shown = set()
+    for level in ('schema', 'profile', 'sample'):
+        for i in order:
+            table = tables[i]
+            if level != 'schema' and not parts[i]['schema']:
+                continue
+            if level == 'schema':
+                text = _schema_block(table) + "\n\n---"
+                if table['sheet'] not in sheets_shown:
+                    text += f"\n\n## 📑 SHEET: {table['sheet']}\n**Tables in this sheet:** 1"
+                value = _schema_block(table)
+            elif level == 'profile':
+                text = value = _profile_block(table)
+            else:
+                value = min(PROMPT_SAMPLE_ROWS, len(table['rows']))
+                text = _rows_block(table, value) if value else ""
+            if not text:
+                continue
+            cost = count_tokens(text, model) + 1
+            if cost <= remaining:
+                parts[i]['rows' if level == 'sample' else level] = value
+                remaining -= cost
+                if level == 'schema':
+                    sheets_shown.add(table['sheet'])
+
+    # Level 4: more rows, PROMPT_ROW_BLOCK per table per round, until the budget is used
+    growing = [i for i in order if parts[i]['rows'] and parts[i]['rows'] < len(tables[i]['rows'])]
+    while growing and remaining > 0:
+        for i in list(growing):
+            table = tables[i]
+            shown = parts[i]['rows']
+            for row in table['rows'][shown:shown + PROMPT_ROW_BLOCK]:
+                cost = count_tokens(_row_line(row, table['columns']), model) + 1
+                if cost > remaining:
+                    growing.remove(i)
+                    break
+                parts[i]['rows'] += 1
+                remaining -= cost
+            else:
+                if parts[i]['rows'] >= len(table['rows']):
+                    growing.remove(i)
+
+    # Part counts are an approximation of the joined text; trim until the exact count fits
+    messages = measure()
+    prompt_tokens = count_message_tokens(messages, model)
+    while prompt_tokens > budget:
+        with_rows = [i for i in order if parts[i]['rows']]
+        with_profile = [i for i in order if parts[i]['profile']]
+        with_schema = [i for i in order if parts[i]['schema']]
+        if with_rows:
+            i = max(with_rows, key=lambda i: parts[i]['rows'])
+            parts[i]['rows'] -= max(1, parts[i]['rows'] // 10)
+        elif with_profile:
+            parts[with_profile[-1]]['profile'] = ''
+        elif len(with_schema) > 1:
+            parts[with_schema[-1]]['schema'] = ''
+        else:
+            raise PromptBudgetError(
+                f"Prompt needs {prompt_tokens:,} tokens but the budget is {budget:,}; shorten the question "
+                f"or raise PROMPT_TOKEN_BUDGET")
+        messages = measure()
+        prompt_tokens = count_message_tokens(messages, model)
+
+    if not any(part['schema'] for part in parts.values()) and tables:
+        raise PromptBudgetError(f"No table schema fits the token budget of {budget:,}; raise PROMPT_TOKEN_BUDGET")
+
+    return {
+        'messages': messages,
+        'prompt_tokens': prompt_tokens,
+        'budget': budget,
+        'tokenizer': tokenizer_name(model),
+        'tables': [
+            {
+                'sheet': table['sheet'],
+                'table': table['table'],
+                'total_rows': table['total_rows'],
+                'schema': bool(parts[i]['schema']),
+                'profile': bool(parts[i]['profile']),
+                'rows': parts[i]['rows']
+            }
+            for i, table in enumerate(tables)
+        ]
+    }
@@ -0,0 +1,159 @@
+"""
+Coalescing of identical concurrent calls ("single flight").
+
+When a call arrives while an identical one (same key) is still running, it
+waits for that call and gets its result instead of starting another. The
+first caller is the leader; later callers are followers and count as saved
+calls. Nothing is cached: once a call has finished, the next identical call
+starts a new one.
+
+``SingleFlight.do`` coalesces plain calls. ``SingleFlight.stream`` coalesces
+iterators: one background thread consumes the upstream iterator, and every
+caller, including followers that join partway through, replays all chunks
+from the start as they arrive.
+"""
+import hashlib
+import json
+import threading
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional
+
+def fingerprint(*parts: Any) -> str:
+    """Stable hash of JSON-serializable parts (dict keys sorted), e.g. a model, its messages and parameters."""
+    payload = json.dumps(parts, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+class _Flight:
+    """State of one running call, shared by its leader and followers."""
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.done = False
+        self.result = None
+        self.error = None
+        self.chunks = []
+        self.followers = 0
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key and counts the calls saved."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+        self._stats = {'calls': 0, 'upstream': 0, 'saved': 0, 'errors': 0, 'peak_followers': 0}
+
+    def _join(self, key: str):
+        """Return (flight, is_leader), registering a new flight when none is running for the key."""
+        with self._lock:
+            self._stats['calls'] += 1
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = self._flights[key] = _Flight()
+                self._stats['upstream'] += 1
+                return flight, True
+            flight.followers += 1
+            self._stats['saved'] += 1
+            self._stats['peak_followers'] = max(self._stats['peak_followers'], flight.followers)
+            return flight, False
+
+    def _finish(self, key: str, flight: _Flight, result: Any = None, error: Optional[BaseException] = None):
+        with self._lock:
+            # Later identical calls start a new flight from here on
+            self._flights.pop(key, None)
+            if error is not None:
+                self._stats['errors'] += 1
+        with flight.condition:
+            flight.result = result
+            flight.error = error
+            flight.done = True
+            flight.condition.notify_all()
+
+    def do(self, key: str, func: Callable[[], Any]) -> Dict[str, Any]:
+        """
+        Run ``func`` unless an identical call is running, then share its result.
+
+        Args:
+            key: Identity of the call, e.g. from ``fingerprint``
+            func: The call; it runs in the leader's thread
+
+        Returns:
+            dict: result and shared (True for followers)
+
+        Raises:
+            Exception: The leader's exception, in the leader and every follower
+        """
+        flight, leader = self._join(key)
+        if leader:
+            try:
+                result = func()
+            except BaseException as e:
+                self._finish(key, flight, error=e)
+                raise
+            self._finish(key, flight, result=result)
+            return {'result': result, 'shared': False}
+
+        with flight.condition:
+            flight.condition.wait_for(lambda: flight.done)
+        if flight.error is not None:
+            raise flight.error
+        return {'result': flight.result, 'shared': True}
+
+    def stream(self, key: str, func: Callable[[], Iterable[Any]]) -> Iterator[Any]:
+        """
+        Iterate ``func()`` unless an identical stream is running, then replay that one.
+
+        The upstream iterator is consumed by a background thread, so it runs to the
+        end even when the caller that started it stops reading. Callers get every
+        chunk from the first one, however late they join.
+
+        Raises:
+            Exception: The upstream error, after the chunks received before it
+        """
+        flight, leader = self._join(key)
+        if leader:
+            def pump():
+                try:
+                    for chunk in func():
+                        with flight.condition:
+                            flight.chunks.append(chunk)
+                            flight.condition.notify_all()
+                except BaseException as e:
+                    self._finish(key, flight, error=e)
+                else:
+                    self._finish(key, flight)
+
+            threading.Thread(target=pump, name='singleflight-stream', daemon=True).start()
+
+        position = 0
+        while True:
+            with flight.condition:
+                flight.condition.wait_for(lambda: position < len(flight.chunks) or flight.done)
+                chunks = flight.chunks[position:]
+                done = flight.done
+            for chunk in chunks:
+                yield chunk
+            position += len(chunks)
+            if done and position == len(flight.chunks):
+                break
+        if flight.error is not None:
+            raise flight.error
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Return the counters.
+
+        Returns:
+            dict: calls (all calls), upstream (calls that ran), saved (calls that
+                joined a running one), errors, peak_followers (most callers sharing
+                one call), in_flight and saved_share (saved / calls)
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats['in_flight'] = len(self._flights)
+        stats['saved_share'] = stats['saved'] / stats['calls'] if stats['calls'] else 0.0
+        return stats
+
+    def reset_stats(self):
+        """Zero the counters; running calls are unaffected."""
+        with self._lock:
+            for key in self._stats:
+                self._stats[key] = 0
@@ -0,0 +1,28 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from benchmarks import BASELINE_FILE
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Baseline to compare with; record one with `python benchmarks.py --save-baseline`
+BASELINE = os.path.join(ROOT, os.getenv('BENCHMARK_BASELINE', BASELINE_FILE))
+
+
+def test_no_benchmark_regressions():
+    if not os.path.exists(BASELINE):
+        pytest.fail(f"No benchmark baseline at {BASELINE}; record one with `python benchmarks.py --save-baseline`")
+    with open(BASELINE, encoding='utf-8') as f:
+        rows = json.load(f)['meta']['rows']
+
+    # A separate process: benchmarks.py points DATABASE_URL at a throwaway database before importing database
+    result = subprocess.run(
+        [sys.executable, 'benchmarks.py', '--baseline', BASELINE, '--rows', str(rows),
+         '--repeat', os.getenv('BENCHMARK_REPEAT', '5')],
+        capture_output=True, text=True, cwd=ROOT
+    )
+
+    assert result.returncode == 0, result.stdout + result.stderr
@@ -0,0 +1,41 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from chart_sampling import prepare_chart_data
+
+
+@pytest.fixture
+def large_table():
+    rows = 20000
+    return pd.DataFrame({
+        'a': np.arange(rows) % 300,
+        'label': [f'k{i % 50}' for i in range(rows)],
+    })
+
+
+@pytest.mark.parametrize('chart_type', ['Line', 'Scatter', 'Bar', 'Pie'])
+@pytest.mark.parametrize('column', ['a', 'label'])
+def test_same_column_on_both_axes(large_table, chart_type, column):
+    # Both axis selectboxes start on the first column, so x == y is the default state
+    plot_df, info = prepare_chart_data(large_table, chart_type, column, column, budget=5000)
+
+    assert info['original_rows'] == len(large_table)
+    assert info['plotted_points'] == len(plot_df) <= 5000
+    assert plot_df.columns.is_unique
+    assert column in plot_df.columns
+
+
+def test_line_with_same_column_keeps_its_values(large_table):
+    plot_df, info = prepare_chart_data(large_table, 'Line', 'a', 'a', budget=1000)
+
+    assert info['method'] == 'lttb'
+    assert list(plot_df.columns) == ['a']
+    assert plot_df['a'].is_monotonic_increasing
+
+
+def test_bar_with_same_column_keeps_group_labels(large_table):
+    plot_df, _ = prepare_chart_data(large_table, 'Bar', 'label', 'label', budget=1000)
+
+    assert list(plot_df.columns) == ['label']
+    assert set(plot_df['label']) == set(large_table['label'])
@@ -0,0 +1,15 @@
+import pytest
+
+from import_budget import BUDGETS, IMPORT_BUDGET_SCALE, check_module
+
+
+@pytest.mark.parametrize('module', list(BUDGETS))
+def test_import_budget(module):
+    # Fresh interpreters with -X importtime; the fastest of three runs counts
+    result = check_module(module, BUDGETS[module], runs=3, scale=IMPORT_BUDGET_SCALE)
+
+    assert not result['forbidden'], f"import {module} loads {', '.join(result['forbidden'])}, which should be lazy"
+    assert result['elapsed_ms'] <= result['budget_ms'], (
+        f"import {module} took {result['elapsed_ms']:.0f} ms, budget {result['budget_ms']:.0f} ms "
+        f"(IMPORT_BUDGET_SCALE={IMPORT_BUDGET_SCALE})"
+    )
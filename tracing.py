@@ -0,0 +1,188 @@
+"""
+Lightweight span timing for uploads and chat answers.
+
+Wrap a stage in ``span`` to time it; spans opened inside it become its children:
+
+    with span('excel.load_workbook', bytes=size) as s:
+        workbook = openpyxl.load_workbook(path)
+        s.set(sheets=len(workbook.sheetnames))
+
+The last ``TRACE_HISTORY`` root spans are kept in memory with their children for
+the debug panel in the sidebar. When ``TRACE_LOG_FILE`` is set, every finished
+span is also written to it as one JSON line (through the ``trace`` logger); the
+file is rotated at ``TRACE_LOG_MAX_MB``.
+"""
+import os
+import json
+import time
+import uuid
+import logging
+import logging.handlers
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, List, Any, Optional, Iterator
+
+# Set to 0 to disable span recording entirely
+TRACING_ENABLED = os.getenv('TRACING_ENABLED', '1') == '1'
+# JSON-lines file finished spans are appended to, e.g. trace.jsonl; empty (default) keeps them in memory only
+TRACE_LOG_FILE = os.getenv('TRACE_LOG_FILE', '')
+# Size at which the trace log is rotated (MB), and rotated files kept
+TRACE_LOG_MAX_MB = float(os.getenv('TRACE_LOG_MAX_MB', '10'))
+TRACE_LOG_BACKUPS = int(os.getenv('TRACE_LOG_BACKUPS', '3'))
+# Number of recent root spans (with their children) kept for the debug panel
+TRACE_HISTORY = int(os.getenv('TRACE_HISTORY', '50'))
+
+_current_span = contextvars.ContextVar('current_span', default=None)
+_history = deque(maxlen=max(1, TRACE_HISTORY))
+_history_lock = threading.Lock()
+_logger = logging.getLogger('trace')
+_logger_lock = threading.Lock()
+
+class Span:
+    """A timed stage with attributes; ``children`` holds the spans opened inside it."""
+
+    def __init__(self, name: str, attributes: Dict[str, Any], parent: Optional['Span'] = None):
+        self.name = name
+        self.attributes = dict(attributes)
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex[:16]
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent else None
+        self.started_at = datetime.now()
+        self.duration_ms = None
+        self.error = None
+        self.children = []
+
+    def set(self, **attributes):
+        """Add or update attributes, e.g. row counts known only at the end of the stage."""
+        self.attributes.update(attributes)
+
+    def to_dict(self, children: bool = False) -> Dict[str, Any]:
+        """Return the span as a JSON-serializable dict, optionally with its children."""
+        record = {
+            'ts': self.started_at.isoformat(timespec='milliseconds'),
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'duration_ms': round(self.duration_ms, 3) if self.duration_ms is not None else None,
+            'attributes': self.attributes
+        }
+        if self.error:
+            record['error'] = self.error
+        if children:
+            record['children'] = [child.to_dict(children=True) for child in self.children]
+        return record
+
+class _NoopSpan:
+    """Stand-in yielded when tracing is disabled."""
+
+    def set(self, **attributes):
+        pass
+
+def _log_span(finished: Span):
+    """Write a finished span to the structured log, configuring the file handler on first use."""
+    if not TRACE_LOG_FILE:
+        return
+    if not _logger.handlers:
+        with _logger_lock:
+            if not _logger.handlers:
+                handler = logging.handlers.RotatingFileHandler(
+                    TRACE_LOG_FILE, maxBytes=int(TRACE_LOG_MAX_MB * 1024 * 1024),
+                    backupCount=TRACE_LOG_BACKUPS, encoding='utf-8'
+                )
+                handler.setFormatter(logging.Formatter('%(message)s'))
+                _logger.addHandler(handler)
+                _logger.setLevel(logging.INFO)
+                _logger.propagate = False
+    try:
+        _logger.info(json.dumps(finished.to_dict(), default=str))
+    except Exception as e:
+        print(f"Warning: could not write span {finished.name}: {str(e)}")
+
+@contextmanager
+def span(name: str, **attributes) -> Iterator[Span]:
+    """
+    Time a stage of work.
+
+    Args:
+        name: Stage name, e.g. 'excel.load_workbook' or 'llm.call'
+        **attributes: Initial attributes such as rows, bytes or tokens
+
+    Yields:
+        Span: The open span; call ``set`` on it to add attributes
+    """
+    if not TRACING_ENABLED:
+        yield _NoopSpan()
+        return
+
+    parent = _current_span.get()
+    current = Span(name, attributes, parent)
+    token = _current_span.set(current)
+    started = time.perf_counter()
+    try:
+        yield current
+    except Exception as e:
+        current.error = f"{type(e).__name__}: {str(e)}"
+        raise
+    finally:
+        current.duration_ms = (time.perf_counter() - started) * 1000
+        _current_span.reset(token)
+        if parent is not None:
+            parent.children.append(current)
+        else:
+            with _history_lock:
+                _history.append(current)
+        _log_span(current)
+
+def current_span() -> Optional[Span]:
+    """Return the innermost open span of the calling context, if any."""
+    return _current_span.get()
+
+def recent_traces(limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    Return recently finished root spans with their children, newest first.
+
+    Args:
+        limit: Maximum number of traces to return (default: all kept)
+
+    Returns:
+        list: Span dicts as returned by ``Span.to_dict(children=True)``
+    """
+    with _history_lock:
+        roots = list(_history)
+    roots.reverse()
+    return [root.to_dict(children=True) for root in roots[:limit]]
+
+def flatten_trace(trace: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Flatten a trace into rows for display, children directly after their parent.
+
+    Returns:
+        list: dicts with depth, name, duration_ms, share of the root's duration,
+            attributes and error
+    """
+    total = trace.get('duration_ms') or 0
+    rows = []
+
+    def visit(node: Dict[str, Any], depth: int):
+        rows.append({
+            'depth': depth,
+            'name': node['name'],
+            'duration_ms': node['duration_ms'],
+            'share': (node['duration_ms'] or 0) / total if total else None,
+            'attributes': node['attributes'],
+            'error': node.get('error')
+        })
+        for child in node.get('children', []):
+            visit(child, depth + 1)
+
+    visit(trace, 0)
+    return rows
+
+def clear_traces():
+    """Forget the traces kept for the debug panel."""
+    with _history_lock:
+        _history.clear()
@@ -2,78 +2,261 @@ import streamlit as st
 import pandas as pd
 import plotly.express as px
 import io
+import os
+import hashlib
+import threading
+import importlib.util
+from collections import OrderedDict
+from typing import Optional
+import database as db
+from chart_sampling import prepare_chart_data
 
-def visualize_excel_file():
+# Upper bound on the memory held by parsed DataFrames across all sessions
+DATAFRAME_CACHE_MAX_MB = int(os.getenv('DATAFRAME_CACHE_MAX_MB', '512'))
+
+class DataFrameCache:
+    """Thread-safe LRU cache of DataFrames bounded by their total in-memory size."""
+    
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, key) -> Optional[pd.DataFrame]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+    
+    def put(self, key, df: pd.DataFrame):
+        size = int(df.memory_usage(deep=True).sum())
+        with self._lock:
+            if key in self._entries:
+                self.current_bytes -= self._entries.pop(key)[1]
+            if size > self.max_bytes:
+                # Too large to cache without evicting everything else
+                return
+            self._entries[key] = (df, size)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_size
+
+@st.cache_resource
+def get_dataframe_cache() -> DataFrameCache:
+    """Process-wide DataFrame cache shared by all sessions."""
+    return DataFrameCache(DATAFRAME_CACHE_MAX_MB * 1024 * 1024)
+
+def _excel_engine() -> Optional[str]:
+    """Use the Rust-based calamine reader when python-calamine and pandas>=2.2 are available."""
+    pandas_version = tuple(int(part) for part in pd.__version__.split('.')[:2] if part.isdigit())
+    if pandas_version >= (2, 2) and importlib.util.find_spec('python_calamine') is not None:
+        return 'calamine'
+    return None
+
+def _uploaded_workbook(uploaded_file) -> dict:
     """
-    Streamlit interface for uploading and visualizing Excel files.
-    Allows selecting sheets, chart types, X-axis, and Y-axis
-    to generate interactive Plotly charts.
+    Return the hash and sheet names of an upload; the sheet names are read once per distinct file.
+    
+    The session entry is matched on the content hash rather than the name and size,
+    which another workbook can share. Hashing the bytes already in memory is cheap
+    next to opening the workbook.
     """
-    st.header("Visualize Excel")
+    file_bytes = uploaded_file.getvalue()
+    file_hash = hashlib.sha256(file_bytes).hexdigest()
+    workbook = st.session_state.get('visualize_workbook')
+    if not workbook or workbook['hash'] != file_hash:
+        with pd.ExcelFile(io.BytesIO(file_bytes), engine=_excel_engine()) as excel_data:
+            sheet_names = excel_data.sheet_names
+        workbook = {
+            'hash': file_hash,
+            'sheet_names': sheet_names
+        }
+        st.session_state.visualize_workbook = workbook
+    return workbook
 
+def load_uploaded_sheet(uploaded_file, file_hash: str, sheet_name: str) -> pd.DataFrame:
+    """Parse one sheet of an uploaded workbook, reusing the cached parse for the same file hash and sheet."""
+    cache = get_dataframe_cache()
+    cache_key = ('upload', file_hash, sheet_name)
+    df = cache.get(cache_key)
+    if df is None:
+        df = pd.read_excel(io.BytesIO(uploaded_file.getvalue()), sheet_name=sheet_name, engine=_excel_engine())
+        cache.put(cache_key, df)
+    return df
+
+def load_stored_table(file_hash: str, table: dict) -> pd.DataFrame:
+    """
+    Build a DataFrame from a table already stored in the database.
+    
+    The DataFrame is cached under the table's content hash (of its stored rows),
+    so the same table in another file or a later version of the workbook is a
+    cache hit. The normalized fingerprint is not used: it treats 1 and 1.0 or
+    values differing in surrounding whitespace as equal, so a hit could return
+    another table's values and dtypes. Tables without a content hash are keyed by
+    file hash, sheet and name.
+    
+    Args:
+        file_hash: Hash of the stored Excel file
+        table: Table entry as returned by ``database.list_excel_tables``
+        
+    Returns:
+        pd.DataFrame: The table's rows
+    """
+    cache = get_dataframe_cache()
+    if table.get('content_hash'):
+        cache_key = ('table', table['content_hash'])
+    else:
+        cache_key = ('stored', file_hash, table['sheet_name'], table['table_name'])
+    df = cache.get(cache_key)
+    if df is None:
+        df = pd.DataFrame.from_records(list(db.iter_table_rows(table['id'])))
+        cache.put(cache_key, df)
+    return df
+
+def _select_stored_table() -> Optional[pd.DataFrame]:
+    """Let the user pick a stored file and table and return its DataFrame."""
+    files = db.list_excel_files()
+    if not files:
+        st.info("No Excel files found. Upload a file to get started!")
+        return None
+    
+    selected_file = st.selectbox(
+        "Select a file",
+        files,
+        format_func=lambda f: f"{f['file_name']} ({f['tables_count']} tables)"
+    )
+    tables = db.list_excel_tables(selected_file['id'])
+    if not tables:
+        st.info("This file has no tables to visualize.")
+        return None
+    
+    selected_table = st.selectbox(
+        "Select a table",
+        tables,
+        format_func=lambda t: (
+            f"{t['sheet_name']} / {t['table_name']}"
+            + (f" ({t['row_count']} rows)" if t['row_count'] is not None else "")
+        )
+    )
+    return load_stored_table(selected_file['file_hash'], selected_table)
+
+def _select_uploaded_sheet() -> Optional[pd.DataFrame]:
+    """Let the user upload a workbook and pick a sheet, returning its DataFrame."""
     uploaded_file = st.file_uploader("Upload an Excel file", type=["xlsx", "xls"])
+    if uploaded_file is None:
+        return None
+    
+    # Hash and sheet names are computed once per upload; sheets are parsed
+    # once per (file hash, sheet) and served from the cache on reruns
+    workbook = _uploaded_workbook(uploaded_file)
+    sheet_names = workbook['sheet_names']
+    
+    selected_sheet = sheet_names[0]
+    if len(sheet_names) > 1:
+        selected_sheet = st.selectbox("Select a sheet", sheet_names)
+    
+    return load_uploaded_sheet(uploaded_file, workbook['hash'], selected_sheet)
 
-    if uploaded_file is not None:
-        try:
-            # Read the Excel file
-            excel_data = pd.ExcelFile(uploaded_file)
+def render_chart_builder(df: pd.DataFrame):
+    """
+    Show a data preview and the chart options for a DataFrame, and render
+    the selected Plotly chart when requested.
+    
+    Args:
+        df: Data to chart
+    """
+    st.subheader("Data Preview (first 5 rows)")
+    st.write(df.head())
 
-            # Get sheet names
-            sheet_names = excel_data.sheet_names
+    # Identify column types
+    numeric_cols = df.select_dtypes(include=['number']).columns.tolist()
+    object_cols = df.select_dtypes(include=['object', 'category']).columns.tolist()
+    all_cols = df.columns.tolist()
+
+    st.subheader("Chart Options")
+
+    chart_type = st.selectbox(
+        "Select chart type",
+        ["Bar", "Line", "Pie", "Scatter"]
+    )
+
+    x_axis = st.selectbox("Select X-axis", all_cols)
+    y_axis = st.selectbox("Select Y-axis", all_cols)
 
-            selected_sheet = sheet_names[0]
-            if len(sheet_names) > 1:
-                selected_sheet = st.selectbox("Select a sheet", sheet_names)
-
-            df = excel_data.parse(selected_sheet)
-
-            st.subheader("Data Preview (first 5 rows)")
-            st.write(df.head())
-
-            # Identify column types
-            numeric_cols = df.select_dtypes(include=['number']).columns.tolist()
-            object_cols = df.select_dtypes(include=['object', 'category']).columns.tolist()
-            all_cols = df.columns.tolist()
-
-            st.subheader("Chart Options")
-
-            chart_type = st.selectbox(
-                "Select chart type",
-                ["Bar", "Line", "Pie", "Scatter"]
-            )
-
-            x_axis = st.selectbox("Select X-axis", all_cols)
-            y_axis = st.selectbox("Select Y-axis", all_cols)
-
-            if st.button("Generate Chart"):
-                try:
-                    fig = None
-                    if chart_type == "Bar":
-                        if x_axis in all_cols and y_axis in all_cols:
-                            fig = px.bar(df, x=x_axis, y=y_axis, title=f'{chart_type} Chart of {y_axis} vs {x_axis}')
-                        else:
-                             st.warning("Please select valid X and Y axes for the bar chart.")
-                    elif chart_type == "Line":
-                         if x_axis in all_cols and y_axis in all_cols:
-                            fig = px.line(df, x=x_axis, y=y_axis, title=f'{chart_type} Chart of {y_axis} vs {x_axis}')
-                         else:
-                             st.warning("Please select valid X and Y axes for the line chart.")
-                    elif chart_type == "Pie":
-                         if y_axis in numeric_cols and x_axis in object_cols:
-                            fig = px.pie(df, values=y_axis, names=x_axis, title=f'{chart_type} Chart of {y_axis} by {x_axis}')
-                         else:
-                              st.warning("For Pie chart, please select a numeric column for 'Values' (Y-axis) and a categorical column for 'Names' (X-axis).")
-                    elif chart_type == "Scatter":
-                         if x_axis in all_cols and y_axis in all_cols:
-                            fig = px.scatter(df, x=x_axis, y=y_axis, title=f'{chart_type} Chart of {y_axis} vs {x_axis}')
-                         else:
-                             st.warning("Please select valid X and Y axes for the scatter chart.")
-
-                    if fig:
-                        st.plotly_chart(fig, use_container_width=True)
-
-                except Exception as e:
-                    st.error(f"An error occurred while generating the chart: {e}")
+    if st.button("Generate Chart"):
+        try:
+            fig = None
+            # Downsample or aggregate large tables so the chart payload stays within the point budget
+            plot_df, sampling = prepare_chart_data(df, chart_type, x_axis, y_axis)
+            if chart_type == "Bar":
+                if x_axis in all_cols and y_axis in all_cols:
+                    fig = px.bar(plot_df, x=x_axis, y=y_axis, title=f'{chart_type} Chart of {y_axis} vs {x_axis}')
+                else:
+                    st.warning("Please select valid X and Y axes for the bar chart.")
+            elif chart_type == "Line":
+                if x_axis in all_cols and y_axis in all_cols:
+                    fig = px.line(plot_df, x=x_axis, y=y_axis, title=f'{chart_type} Chart of {y_axis} vs {x_axis}',
+                                  render_mode=sampling['render_mode'])
+                else:
+                    st.warning("Please select valid X and Y axes for the line chart.")
+            elif chart_type == "Pie":
+                if y_axis in numeric_cols and x_axis in object_cols:
+                    fig = px.pie(plot_df, values=y_axis, names=x_axis, title=f'{chart_type} Chart of {y_axis} by {x_axis}')
+                else:
+                    st.warning("For Pie chart, please select a numeric column for 'Values' (Y-axis) and a categorical column for 'Names' (X-axis).")
+            elif chart_type == "Scatter":
+                if x_axis in all_cols and y_axis in all_cols:
+                    fig = px.scatter(plot_df, x=x_axis, y=y_axis, title=f'{chart_type} Chart of {y_axis} vs {x_axis}',
+                                     size='points' if sampling['method'] == 'binned' else None,
+                                     render_mode=sampling['render_mode'])
+                else:
+                    st.warning("Please select valid X and Y axes for the scatter chart.")
+
+            if fig and sampling['method']:
+                st.caption(f"Showing {sampling['plotted_points']:,} of {sampling['original_rows']:,} rows "
+                           f"({sampling['method']}).")
+            if fig:
+                st.plotly_chart(fig, use_container_width=True)
 
         except Exception as e:
-            st.error(f"Error reading the Excel file: {e}")
\ No newline at end of file
+            st.error(f"An error occurred while generating the chart: {e}")
+
+def visualize_excel_file():
+    """
+    Streamlit interface for visualizing Excel data.
+    Charts either a table already stored in the database or a sheet of a
+    newly uploaded workbook, with a choice of chart type, X-axis and Y-axis
+    to generate interactive Plotly charts.
+    """
+    st.header("Visualize Excel")
+
+    source = st.radio(
+        "Data source",
+        ["Stored file", "Upload a file"],
+        horizontal=True
+    )
+
+    try:
+        if source == "Stored file":
+            df = _select_stored_table()
+        else:
+            df = _select_uploaded_sheet()
+    except Exception as e:
+        st.error(f"Error reading the Excel data: {e}")
+        return
+
+    if df is None:
+        return
+    if df.empty:
+        st.info("The selected table has no rows.")
+        return
+
+    render_chart_builder(df)
@@ -0,0 +1,321 @@
+"""
+Generator for realistic test workbooks, from a few KB to several GB.
+
+Workbooks are written with openpyxl's write-only mode, so memory use stays flat
+however many rows are generated. Each sheet holds a stack of tables separated by
+blank rows; tables can be Excel-defined tables, implicit (blank-row separated)
+tables or a mix. Columns include IDs, dates, categories, numbers, a formula
+column and sparsely filled columns, and the output is reproducible for a given
+seed, so the parser, storage and chat pipeline can be exercised offline.
+
+openpyxl writes formulas without a cached value, which ``data_only`` readers
+(including ``excel_parser``) would see as empty cells. The value of every formula
+cell is therefore recorded while the rows are generated and written into the
+saved workbook afterwards, as Excel itself would have stored it.
+
+Usage:
+    python workbook_generator.py out.xlsx --preset medium
+    python workbook_generator.py out.xlsx --sheets 4 --tables 3 --rows 50000 --columns 12 --layout mixed
+    python workbook_generator.py big.xlsx --target-size 2GB --seed 7
+"""
+import argparse
+import array
+import os
+import random
+import re
+import shutil
+import tempfile
+import time
+import warnings
+import zipfile
+from datetime import datetime, timedelta
+from typing import Dict, List, Any
+
+LAYOUTS = ('defined', 'implicit', 'mixed')
+
+# Columns in the order they are added; extra columns beyond these are value_N numbers
+BASE_COLUMNS = ['id', 'date', 'region', 'product', 'quantity', 'unit_price', 'total', 'notes']
+
+REGIONS = ['North', 'South', 'East', 'West', 'Central']
+NOTES = ['checked', 'late delivery', 'discount applied', 'returned', 'priority customer', 'see email']
+
+# Named option sets, from a few KB to a few GB
+PRESETS = {
+    'tiny': {'sheets': 1, 'tables_per_sheet': 1, 'rows': 50, 'columns': 6},
+    'small': {'sheets': 2, 'tables_per_sheet': 2, 'rows': 2000, 'columns': 8},
+    'medium': {'sheets': 3, 'tables_per_sheet': 2, 'rows': 50000, 'columns': 10},
+    'large': {'sheets': 4, 'tables_per_sheet': 3, 'columns': 12, 'target_size': '250MB'},
+    'huge': {'sheets': 4, 'tables_per_sheet': 3, 'columns': 12, 'target_size': '2GB'},
+}
+
+_SIZE_UNITS = {'': 1, 'B': 1, 'KB': 1024, 'MB': 1024 ** 2, 'GB': 1024 ** 3, 'TB': 1024 ** 4}
+# Formula cells as openpyxl writes them: the formula followed by an empty value
+_EMPTY_FORMULA_VALUE = re.compile(rb'(<f>[^<]*</f>)(?:<v\s*/>|<v></v>)')
+
+def parse_size(text: str) -> int:
+    """Parse a size such as '500KB', '1.5GB' or '2048' into bytes."""
+    match = re.fullmatch(r'\s*([\d.]+)\s*([KMGT]?B?)\s*', str(text).upper())
+    if not match:
+        raise ValueError(f"Invalid size: {text!r}")
+    return int(float(match.group(1)) * _SIZE_UNITS[match.group(2)])
+
+def column_names(columns: int, dates: bool = True, formulas: bool = True) -> List[str]:
+    """Return the header of a generated table with ``columns`` columns."""
+    names = [name for name in BASE_COLUMNS
+             if (dates or name != 'date') and (formulas or name != 'total')]
+    if columns <= len(names):
+        return names[:max(1, columns)]
+    return names + [f'value_{i}' for i in range(1, columns - len(names) + 1)]
+
+def _table_kind(layout: str, index: int) -> str:
+    """Whether the index-th table of a sheet is 'defined' or 'implicit'."""
+    if layout == 'mixed':
+        return 'defined' if index % 2 == 0 else 'implicit'
+    return layout
+
+class _FormulaValues:
+    """Cached values of formula cells, in the order they are written, spooled to a temp file."""
+
+    def __init__(self, directory: str):
+        self.path = os.path.join(directory, 'formula_values.bin')
+        self.buffer = array.array('d')
+        self.count = 0
+        self.file = open(self.path, 'wb')
+
+    def add(self, value: float):
+        self.buffer.append(value)
+        self.count += 1
+        if len(self.buffer) >= 65536:
+            self.buffer.tofile(self.file)
+            self.buffer = array.array('d')
+
+    def close(self):
+        self.buffer.tofile(self.file)
+        self.buffer = array.array('d')
+        self.file.close()
+
+    def __iter__(self):
+        with open(self.path, 'rb') as f:
+            while True:
+                block = array.array('d')
+                try:
+                    block.fromfile(f, 65536)
+                except EOFError:
+                    pass  # partial last block is still filled in
+                if not block:
+                    return
+                yield from block
+
+def _fill_formula_values(source_path: str, target_path: str, values: _FormulaValues, chunk_size: int = 4 * 1024 * 1024):
+    """
+    Copy a workbook, writing the cached value of each formula cell into the sheet XML.
+
+    Worksheets are rewritten as a stream, whole ``<row>`` elements at a time, and
+    formula cells are matched with ``values`` in document order.
+    """
+    value_iter = iter(values)
+
+    def cached(match):
+        return match.group(1) + b'<v>' + repr(next(value_iter)).encode('ascii') + b'</v>'
+
+    with zipfile.ZipFile(source_path) as source, \
+            zipfile.ZipFile(target_path, 'w', zipfile.ZIP_DEFLATED, allowZip64=True) as target:
+        for info in source.infolist():
+            with source.open(info) as reader, target.open(info.filename, 'w', force_zip64=True) as writer:
+                if not info.filename.startswith('xl/worksheets/sheet'):
+                    shutil.copyfileobj(reader, writer, chunk_size)
+                    continue
+                pending = b''
+                while True:
+                    block = reader.read(chunk_size)
+                    data = pending + block
+                    if block:
+                        # Rewrite up to the last complete row; the rest waits for the next block
+                        cut = data.rfind(b'</row>')
+                        if cut < 0:
+                            pending = data
+                            continue
+                        cut += len(b'</row>')
+                    else:
+                        cut = len(data)
+                    writer.write(_EMPTY_FORMULA_VALUE.sub(cached, data[:cut]))
+                    pending = data[cut:]
+                    if not block:
+                        break
+
+def generate_workbook(path: str, sheets: int = 2, tables_per_sheet: int = 2, rows: int = 1000,
+                      columns: int = 8, layout: str = 'mixed', blank_rows: int = 1,
+                      dates: bool = True, formulas: bool = True, sparsity: float = 0.3,
+                      sparse_columns: int = 0, seed: int = 0) -> Dict[str, Any]:
+    """
+    Write a generated workbook.
+
+    Args:
+        path: Output .xlsx path
+        sheets: Number of worksheets
+        tables_per_sheet: Tables stacked vertically on each sheet
+        rows: Data rows per table
+        columns: Columns per table (id, date, region, product, quantity,
+            unit_price, total, notes, then value_N numbers)
+        layout: 'defined' (Excel tables), 'implicit' (blank-row separated ranges)
+            or 'mixed' (alternating)
+        blank_rows: Empty rows between tables
+        dates: Include the date column
+        formulas: Make ``total`` a ``quantity * unit_price`` formula with a cached value
+        sparsity: Share of empty cells in the notes and value_N columns (0-1)
+        sparse_columns: Extra columns after a gap of empty columns, about 1% filled,
+            like stray annotations next to a table
+        seed: Random seed; the same options and seed give the same workbook
+
+    Returns:
+        dict: path, bytes, sheets, tables, rows, formula_cells and seconds
+    """
+    import openpyxl
+    from openpyxl.utils import get_column_letter
+    from openpyxl.worksheet.table import Table, TableColumn, TableStyleInfo
+
+    if layout not in LAYOUTS:
+        raise ValueError(f"layout must be one of {', '.join(LAYOUTS)}")
+    started = time.perf_counter()
+    rng = random.Random(seed)
+    header = column_names(columns, dates, formulas)
+    gap = 3 if sparse_columns else 0
+    full_header = header + [None] * gap + [f'annotation_{i}' for i in range(1, sparse_columns + 1)]
+    index = {name: i for i, name in enumerate(header)}
+    has_formula = formulas and {'quantity', 'unit_price', 'total'} <= set(header)
+    if has_formula:
+        quantity_letter = get_column_letter(index['quantity'] + 1)
+        price_letter = get_column_letter(index['unit_price'] + 1)
+    products = [f'Product {i:03d}' for i in range(1, 201)]
+    start_date = datetime(2023, 1, 1)
+
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(path))) as workdir:
+        formula_values = _FormulaValues(workdir)
+        workbook = openpyxl.Workbook(write_only=True)
+        tables = 0
+        row_id = 0
+
+        for sheet_index in range(1, sheets + 1):
+            sheet = workbook.create_sheet(f'Sheet{sheet_index}')
+            current_row = 0
+            for table_index in range(tables_per_sheet):
+                if table_index:
+                    for _ in range(blank_rows):
+                        sheet.append([])
+                    current_row += blank_rows
+
+                sheet.append(full_header)
+                current_row += 1
+                header_row = current_row
+                for _ in range(rows):
+                    row_id += 1
+                    current_row += 1
+                    quantity = rng.randint(1, 50)
+                    unit_price = round(rng.uniform(1, 500), 2)
+                    values = {
+                        'id': row_id,
+                        'date': start_date + timedelta(minutes=row_id),
+                        'region': rng.choice(REGIONS),
+                        'product': rng.choice(products),
+                        'quantity': quantity,
+                        'unit_price': unit_price,
+                        'total': quantity * unit_price,
+                        'notes': rng.choice(NOTES) if rng.random() >= sparsity else None
+                    }
+                    row = []
+                    for name in header:
+                        if name == 'total' and has_formula:
+                            row.append(f'={quantity_letter}{current_row}*{price_letter}{current_row}')
+                            formula_values.add(values['total'])
+                        elif name in values:
+                            row.append(values[name])
+                        else:
+                            row.append(round(rng.gauss(100, 30), 3) if rng.random() >= sparsity else None)
+                    if sparse_columns:
+                        row.extend([None] * gap)
+                        row.extend(rng.choice(NOTES) if rng.random() < 0.01 else None for _ in range(sparse_columns))
+                    sheet.append(row)
+
+                if _table_kind(layout, table_index) == 'defined':
+                    ref = f"A{header_row}:{get_column_letter(len(header))}{header_row + rows}"
+                    table = Table(displayName=f'Sheet{sheet_index}_Table{table_index + 1}', ref=ref)
+                    # Write-only worksheets cannot read the header cells back
+                    table.tableColumns = [TableColumn(id=i + 1, name=name) for i, name in enumerate(header)]
+                    table.tableStyleInfo = TableStyleInfo(name='TableStyleMedium9', showRowStripes=True)
+                    with warnings.catch_warnings():
+                        # openpyxl warns about write-only tables even when the columns are set
+                        warnings.simplefilter('ignore', UserWarning)
+                        sheet.add_table(table)
+                tables += 1
+
+        formula_values.close()
+        if formula_values.count:
+            raw_path = os.path.join(workdir, 'raw.xlsx')
+            workbook.save(raw_path)
+            _fill_formula_values(raw_path, path, formula_values)
+        else:
+            workbook.save(path)
+
+    return {
+        'path': path,
+        'bytes': os.path.getsize(path),
+        'sheets': sheets,
+        'tables': tables,
+        'rows': tables * rows,
+        'formula_cells': formula_values.count,
+        'seconds': time.perf_counter() - started
+    }
+
+def rows_for_target_size(target_bytes: int, calibration_rows: int = 2000, **options) -> int:
+    """
+    Estimate the rows per table that give a workbook of about ``target_bytes``.
+
+    Generates two small workbooks with the same options; the size difference
+    gives the bytes per row and the remainder the fixed overhead.
+    """
+    options = {key: value for key, value in options.items() if key != 'rows'}
+    small_rows = max(1, calibration_rows // 4)
+    with tempfile.TemporaryDirectory() as workdir:
+        large = generate_workbook(os.path.join(workdir, 'large.xlsx'), rows=calibration_rows, **options)
+        small = generate_workbook(os.path.join(workdir, 'small.xlsx'), rows=small_rows, **options)
+    bytes_per_row = max((large['bytes'] - small['bytes']) / max(large['rows'] - small['rows'], 1), 1.0)
+    overhead = max(small['bytes'] - small['rows'] * bytes_per_row, 0)
+    tables = max(large['tables'], 1)
+    return max(1, int((target_bytes - overhead) / bytes_per_row / tables))
+
+def _format_size(size: int) -> str:
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024 or unit == 'GB':
+            return f"{size:.1f} {unit}" if unit != 'B' else f"{size} B"
+        size /= 1024
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Generate a realistic test workbook")
+    arg_parser.add_argument("path", help="Output .xlsx path")
+    arg_parser.add_argument("--preset", choices=sorted(PRESETS), help="Named option set; other options override it")
+    arg_parser.add_argument("--sheets", type=int)
+    arg_parser.add_argument("--tables", type=int, dest="tables_per_sheet", help="Tables per sheet")
+    arg_parser.add_argument("--rows", type=int, help="Data rows per table")
+    arg_parser.add_argument("--columns", type=int)
+    arg_parser.add_argument("--layout", choices=LAYOUTS)
+    arg_parser.add_argument("--blank-rows", type=int, help="Empty rows between tables")
+    arg_parser.add_argument("--no-dates", dest="dates", action="store_false", default=None)
+    arg_parser.add_argument("--no-formulas", dest="formulas", action="store_false", default=None)
+    arg_parser.add_argument("--sparsity", type=float, help="Share of empty cells in optional columns (0-1)")
+    arg_parser.add_argument("--sparse-columns", type=int, help="Mostly empty annotation columns after a gap")
+    arg_parser.add_argument("--target-size", help="Approximate file size, e.g. 500KB, 200MB, 2GB (sets --rows)")
+    arg_parser.add_argument("--seed", type=int)
+    args = arg_parser.parse_args()
+
+    options = dict(PRESETS.get(args.preset, {}))
+    options.update({key: value for key, value in vars(args).items()
+                    if key not in ('path', 'preset') and value is not None})
+    target_size = options.pop('target_size', None)
+    if target_size:
+        options['rows'] = rows_for_target_size(parse_size(target_size), **options)
+        print(f"Generating {options['rows']:,} rows per table for a target of {target_size}")
+
+    summary = generate_workbook(args.path, **options)
+    print(f"Wrote {summary['path']}: {_format_size(summary['bytes'])}, {summary['sheets']} sheets, "
+          f"{summary['tables']} tables, {summary['rows']:,} rows, {summary['formula_cells']:,} formula cells "
+          f"in {summary['seconds']:.1f}s")